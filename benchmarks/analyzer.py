@@ -0,0 +1,84 @@
+'''Compare checking snippets with a warm Analyzer and with the command line.
+
+Usage::
+
+    python benchmarks/analyzer.py [--checks N] [--blocks N]
+
+Every check is a small module of *blocks* functions, different each time. It
+is checked *checks* times by running ``python -m xenon`` on it, like a service
+shelling out does, and by a single :class:`~xenon.analyzer.Analyzer`, first
+with new modules and then with the same ones again. The report, with the
+number of checks per minute, is printed as JSON.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from xenon.analyzer import Analyzer  # noqa: E402
+from synthetic import make_block  # noqa: E402
+
+
+def per_minute(checks, elapsed):
+    return int(checks * 60 / elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checks', type=int, default=200)
+    parser.add_argument('--blocks', type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    sources = [('check%d.py' % i,
+                '\n\n\n'.join(make_block('f%d_%d' % (i, j), rng.randint(0, 3),
+                                         rng) for j in range(args.blocks)))
+               for i in range(args.checks)]
+    thresholds = ['-b', 'B', '-m', 'A', '-a', 'A']
+
+    root = tempfile.mkdtemp(prefix='xenon-bench-')
+    try:
+        # Shelling out is slow: measure a tenth of the checks
+        sample = sources[:max(1, args.checks // 10)]
+        start = time.time()
+        for name, source in sample:
+            path = os.path.join(root, name)
+            with open(path, 'w') as fobj:
+                fobj.write(source)
+            subprocess.call([sys.executable, '-m', 'xenon', '--no-cache',
+                             path] + thresholds, cwd=ROOT,
+                            stderr=subprocess.DEVNULL)
+        cli = time.time() - start
+    finally:
+        shutil.rmtree(root)
+
+    with Analyzer(absolute='B', modules='A', average='A') as analyzer:
+        start = time.time()
+        for source in sources:
+            analyzer.check(sources=[source])
+        cold = time.time() - start
+        start = time.time()
+        for source in sources:
+            analyzer.check(sources=[source])
+        warm = time.time() - start
+    report = {
+        'checks': args.checks,
+        'command_line_per_minute': per_minute(len(sample), cli),
+        'analyzer_per_minute': per_minute(args.checks, cold),
+        'analyzer_unchanged_per_minute': per_minute(args.checks, warm),
+    }
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+'''Measure the cost of a baseline with many blocks.
+
+Usage::
+
+    python benchmarks/baseline.py [--modules N] [--blocks N]
+
+A baseline of ``modules * blocks`` synthetic blocks is written, then every
+block is looked up. The time taken to open the baseline is compared with the
+time needed to load the same data from JSON, which has to be parsed as a
+whole before the first lookup.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xenon.baseline import Baseline, block_key, save  # noqa: E402
+from xenon.blocks import Block, to_json  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', type=int, default=5000)
+    parser.add_argument('--blocks', type=int, default=40)
+    args = parser.parse_args()
+
+    results = dict(('pkg%d/mod%d.py' % (i % 50, i), [
+        Block('f%d' % j, 'function', None, j, j + 1, (i + j) % 40 + 1)
+        for j in range(args.blocks)]) for i in range(args.modules))
+    root = tempfile.mkdtemp(prefix='xenon-bench-')
+    path = os.path.join(root, 'baseline')
+    json_path = os.path.join(root, 'baseline.json')
+    try:
+        start = time.time()
+        save(path, results)
+        write_time = time.time() - start
+        with open(json_path, 'w') as fobj:
+            json.dump(results, fobj, default=to_json)
+
+        start = time.time()
+        baseline = Baseline.open(path)
+        open_time = time.time() - start
+        keys = [block_key(module, block)
+                for module, blocks in results.items() for block in blocks]
+        start = time.time()
+        for key in keys:
+            baseline.get(key)
+        lookup_time = time.time() - start
+        baseline.close()
+
+        start = time.time()
+        with open(json_path) as fobj:
+            json.load(fobj)
+        json_time = time.time() - start
+        report = {
+            'blocks': len(keys),
+            'bytes': os.path.getsize(path),
+            'write': round(write_time, 4),
+            'open': round(open_time, 6),
+            'lookup_us': round(lookup_time / len(keys) * 1e6, 3),
+            'json_load': round(json_time, 4),
+        }
+    finally:
+        shutil.rmtree(root)
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
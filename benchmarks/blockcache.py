@@ -0,0 +1,88 @@
+'''Measure the block cache on a refactor touching every file.
+
+Usage::
+
+    python benchmarks/blockcache.py [--files N] [--blocks N] [--repeat N]
+
+The synthetic tree is analyzed once to fill the caches, then one function of
+every module is edited: the whole-file cache is useless, while the block
+cache only has to visit the edited functions. The best time of a cold run and
+of a run with the block cache are reported as JSON, along with the hit and
+miss counters. The results must be the same.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xenon.core import analyze_source  # noqa: E402
+from xenon.cache import SegmentCache  # noqa: E402
+from synthetic import make_tree  # noqa: E402
+
+
+def edit(paths):
+    '''Change the first function of every file in *paths*.'''
+    for path in paths:
+        with open(path) as fobj:
+            source = fobj.read()
+        with open(path, 'w') as fobj:
+            fobj.write(source.replace('(x):', '(x, y=None):', 1))
+
+
+def run(paths, segments):
+    start = time.time()
+    results = {}
+    for path in paths:
+        with open(path, 'rb') as fobj:
+            results[path] = analyze_source(fobj.read(), segments=segments)
+    return time.time() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--blocks', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='xenon-bench-')
+    try:
+        paths = make_tree(root, args.files, args.blocks, args.depth)
+        segments = SegmentCache()
+        run(paths, segments)
+        edit(paths)
+        segments.hits = segments.misses = 0
+        cold, warm, counters = None, None, None
+        for _ in range(args.repeat):
+            elapsed, expected = run(paths, None)
+            cold = elapsed if cold is None else min(cold, elapsed)
+            elapsed, results = run(paths, segments)
+            warm = elapsed if warm is None else min(warm, elapsed)
+            if results != expected:
+                sys.exit('the results differ with the block cache')
+            # The edited functions are only missing on the first run
+            counters = counters or (segments.hits, segments.misses)
+    finally:
+        shutil.rmtree(root)
+    report = {
+        'files': args.files,
+        'blocks': args.files * args.blocks,
+        'cold': round(cold, 4),
+        'block_cache': round(warm, 4),
+        'speedup': round(cold / warm, 2),
+        'hits': counters[0],
+        'misses': counters[1],
+    }
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''Compare the compact block records with Radon's harvester dictionaries.
+
+Usage::
+
+    python benchmarks/blocks.py [--files N] [--blocks N]
+
+Both the time and the memory held by the results (measured with
+:mod:`tracemalloc`) are reported as JSON.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xenon.core import Config, iter_harvest, iter_legacy  # noqa: E402
+from xenon.discovery import iter_filenames  # noqa: E402
+from synthetic import make_tree  # noqa: E402
+
+
+def measure(func):
+    tracemalloc.start()
+    start = time.time()
+    results = dict(func())
+    elapsed = time.time() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {'seconds': round(elapsed, 4), 'bytes': size,
+            'modules': len(results)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=300)
+    parser.add_argument('--blocks', type=int, default=40)
+    parser.add_argument('--depth', type=int, default=3)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='xenon-bench-')
+    config = Config()
+    try:
+        make_tree(root, args.files, args.blocks, args.depth)
+        report = {
+            'legacy': measure(lambda: (
+                r[:2] for r in iter_legacy([root], config))),
+            'compact': measure(lambda: iter_harvest(
+                iter_filenames([root]), config)),
+        }
+    finally:
+        shutil.rmtree(root)
+    report['memory_ratio'] = round(
+        report['legacy']['bytes'] / float(report['compact']['bytes']), 2)
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
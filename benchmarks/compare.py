@@ -0,0 +1,41 @@
+'''Compare two reports written by ``benchmarks/pipeline.py``.
+
+Usage::
+
+    python benchmarks/compare.py old.json new.json [--threshold 1.1]
+
+The median time of every stage is compared, and the exit code is 1 if any
+stage got slower than *threshold* times its old value.
+'''
+
+import sys
+import json
+import argparse
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=1.1)
+    args = parser.parse_args()
+    with open(args.old) as fobj:
+        old = json.load(fobj)['stages']
+    with open(args.new) as fobj:
+        new = json.load(fobj)['stages']
+
+    regressions = 0
+    for stage in sorted(set(old) & set(new)):
+        before, after = old[stage]['median'], new[stage]['median']
+        ratio = after / before if before else 1.
+        flag = ''
+        if ratio > args.threshold:
+            flag = '  <-- regression'
+            regressions += 1
+        print('%-18s %10.6f %10.6f %6.2fx%s' % (stage, before, after, ratio,
+                                               flag))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
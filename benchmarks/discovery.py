@@ -0,0 +1,85 @@
+'''Compare the file discovery with the one of Radon's command line interface.
+
+Usage::
+
+    python benchmarks/discovery.py [--files N] [--vendored N] [--repeat N]
+
+The synthetic tree holds the analyzed packages along with large directories
+which are always ignored (``node_modules``, ``.venv`` and ``build``), much
+like a real checkout. The best time of every implementation is reported as
+JSON, along with the discovery statistics.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from radon.cli.tools import iter_filenames  # noqa: E402
+from xenon.discovery import Discovery  # noqa: E402
+from synthetic import make_tree  # noqa: E402
+
+VENDORED = ('node_modules', '.venv', 'build')
+IGNORE = 'node_modules,build'
+EXCLUDE = '*/tests/*,*_pb2.py'
+
+
+def make_vendored(root, files):
+    '''Write *files* small modules in every vendored directory.'''
+    for vendored in VENDORED:
+        for i in range(files):
+            directory = os.path.join(root, vendored, 'lib%d' % (i % 20))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(os.path.join(directory, 'm%d.py' % i), 'w') as fobj:
+                fobj.write('x = %d\n' % i)
+
+
+def best_of(repeat, func):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 4), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--vendored', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='xenon-bench-')
+    try:
+        make_tree(root, args.files, blocks=1)
+        make_vendored(root, args.vendored)
+        radon_time, expected = best_of(args.repeat, lambda: list(
+            iter_filenames([root], EXCLUDE, IGNORE)))
+        finder = Discovery(EXCLUDE, IGNORE)
+        xenon_time, found = best_of(args.repeat, lambda: list(
+            Discovery(EXCLUDE, IGNORE).iter([root])))
+        list(finder.iter([root]))
+    finally:
+        shutil.rmtree(root)
+    if found != expected:
+        sys.exit('the discovered files differ from the ones of Radon')
+    report = {
+        'radon': radon_time,
+        'xenon': xenon_time,
+        'speedup': round(radon_time / xenon_time, 2),
+        'stats': finder.stats,
+    }
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+'''Compare ``xenon history`` with analyzing every commit from scratch.
+
+Usage::
+
+    python benchmarks/history.py [--files N] [--commits N] [--sample N]
+
+A synthetic repository is written with ``git fast-import``: *files* modules,
+then *commits* commits each editing a couple of them. The history is scanned
+once, and its time is compared with the time needed to analyze the unique
+blobs alone, and with the estimated time of checking out and analyzing every
+commit (measured on *sample* commits). The report is printed as JSON.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xenon import core, history  # noqa: E402
+from xenon.repository import CatFile, git, tree_blobs  # noqa: E402
+from synthetic import make_block  # noqa: E402
+
+
+def fast_import(root, files, commits, seed=0):
+    '''Write the synthetic history to the repository in *root*.'''
+    rng = random.Random(seed)
+    sources = dict(('pkg%d/mod%d.py' % (i % 10, i),
+                    '\n\n\n'.join(make_block('f%d' % j, rng.randint(0, 3),
+                                             rng) for j in range(10)))
+                   for i in range(files))
+    stream = []
+
+    def commit(n, changed):
+        stream.append('commit refs/heads/master\n'
+                      'committer Bench <bench@localhost> %d +0000\n'
+                      'data %d\ncommit %d\n' % (1000000000 + n,
+                                                len('commit %d' % n), n))
+        for path in changed:
+            data = sources[path].encode('utf-8')
+            stream.append('M 100644 inline %s\ndata %d\n' % (path, len(data)))
+            stream.append(data.decode('utf-8') + '\n')
+
+    commit(0, sorted(sources))
+    paths = sorted(sources)
+    for n in range(1, commits):
+        changed = rng.sample(paths, 2)
+        for path in changed:
+            sources[path] += '\n\n\n' + make_block('g%d' % n,
+                                                   rng.randint(0, 3), rng)
+        commit(n, changed)
+    p = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=root,
+                         stdin=subprocess.PIPE)
+    p.communicate(''.join(stream).encode('utf-8'))
+
+
+def scratch(root, shas):
+    '''Return the time taken to check out and analyze every commit in
+    *shas*.'''
+    start = time.time()
+    for sha in shas:
+        tree = tempfile.mkdtemp(prefix='xenon-bench-')
+        try:
+            archive = subprocess.Popen(['git', 'archive', sha], cwd=root,
+                                       stdout=subprocess.PIPE)
+            subprocess.check_call(['tar', '-x', '-C', tree],
+                                  stdin=archive.stdout)
+            archive.wait()
+            core.harvest([tree], core.Config())
+        finally:
+            shutil.rmtree(tree)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--commits', type=int, default=1000)
+    parser.add_argument('--sample', type=int, default=10)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='xenon-bench-')
+    try:
+        git('init', '-q', cwd=root)
+        fast_import(root, args.files, args.commits)
+        thresholds = core.Config()
+        limits = argparse.Namespace(absolute='B', modules='A', average='A')
+        start = time.time()
+        points = list(history.history('master', root, thresholds, limits))
+        scan = time.time() - start
+
+        blobs = set()
+        for sha in git('rev-list', 'master', cwd=root).split():
+            blobs.update(tree_blobs(sha, root).values())
+        with CatFile(root) as cat_file:
+            contents = [cat_file.read(sha) for sha in blobs]
+        start = time.time()
+        for data in contents:
+            core.analyze_source(data)
+        unique = time.time() - start
+
+        shas = git('rev-list', '--max-count=%d' % args.sample, 'master',
+                   cwd=root).split()
+        naive = scratch(root, shas) / len(shas) * len(points)
+    finally:
+        shutil.rmtree(root)
+    report = {
+        'commits': len(points),
+        'unique_blobs': len(blobs),
+        'history': round(scan, 2),
+        'unique_blobs_analysis': round(unique, 2),
+        'checkout_every_commit_estimate': round(naive, 2),
+        'speedup': round(naive / scan, 1),
+    }
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
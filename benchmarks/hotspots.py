@@ -0,0 +1,103 @@
+'''Measure ``xenon hotspots`` on a long history.
+
+Usage::
+
+    python benchmarks/hotspots.py [--files N] [--commits N] [--top N]
+
+A repository is written with ``git fast-import``: *files* modules, then
+*commits* commits each editing one of them, picked with a skewed
+distribution so that some files change much more often than others. The
+ranking is computed once; the time spent streaming the history, the total
+time and the peak memory of the process are printed as JSON.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xenon import core, hotspots  # noqa: E402
+from xenon.repository import git, iter_numstat  # noqa: E402
+from xenon.timings import peak_rss  # noqa: E402
+from synthetic import make_block  # noqa: E402
+
+
+def fast_import(root, files, commits, seed=0):
+    '''Write the synthetic history to the repository in *root*.'''
+    rng = random.Random(seed)
+    paths = ['pkg%d/mod%d.py' % (i % 10, i) for i in range(files)]
+    heads = dict((path, '\n\n\n'.join(make_block('f%d' % j, rng.randint(0, 4),
+                                                 rng) for j in range(5)))
+                 for path in paths)
+    p = subprocess.Popen(['git', 'fast-import', '--quiet'], cwd=root,
+                         stdin=subprocess.PIPE)
+
+    def commit(n, changed):
+        lines = ['commit refs/heads/master',
+                 'committer Bench <bench@localhost> %d +0000'
+                 % (1000000000 + n), 'data 0']
+        for path, source in changed:
+            data = source.encode('utf-8')
+            lines.append('M 100644 inline %s' % path)
+            lines.append('data %d' % len(data))
+            lines.append(data.decode('utf-8'))
+        p.stdin.write(('\n'.join(lines) + '\n').encode('utf-8'))
+
+    commit(0, [(path, heads[path] + '\n') for path in paths])
+    for n in range(1, commits):
+        # A few files get most of the changes
+        path = paths[min(int(rng.expovariate(8. / files)), files - 1)]
+        commit(n, [(path, heads[path] + '\nVERSION = %d\n' % n)])
+    p.stdin.close()
+    p.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--commits', type=int, default=100000)
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    oldwd = os.getcwd()
+    root = tempfile.mkdtemp(prefix='xenon-bench-')
+    try:
+        os.chdir(root)
+        git('init', '-q')
+        start = time.time()
+        fast_import(root, args.files, args.commits)
+        git('checkout', '-q', 'master')
+        setup = time.time() - start
+
+        start = time.time()
+        changes = sum(1 for _ in iter_numstat())
+        stream = time.time() - start
+        start = time.time()
+        spots = hotspots.hotspots(['.'], core.Config(), top=args.top)
+        total = time.time() - start
+    finally:
+        os.chdir(oldwd)
+        shutil.rmtree(root)
+    peak = peak_rss()
+    report = {
+        'commits': args.commits,
+        'file_changes': changes,
+        'setup': round(setup, 2),
+        'numstat_stream': round(stream, 2),
+        'hotspots': round(total, 2),
+        'peak_memory_mb': round(peak / 1024. / 1024, 1) if peak else None,
+        'best': spots[0].as_dict() if spots else None,
+    }
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+'''Measure the peak memory of an upload as the tree grows.
+
+Usage::
+
+    python benchmarks/memory.py [--files N,N,..] [--blocks N] [--max-memory MB]
+
+Synthetic trees of increasing size are analyzed and uploaded to a local
+server which discards the payload, once keeping all the results in memory
+and once with ``--max-memory``. Every run is a separate process, and its peak
+resident set size is reported as JSON, in megabytes: with ``--max-memory``
+it should stay flat.
+'''
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from synthetic import make_tree  # noqa: E402
+
+# Run Xenon and print the peak memory, in bytes
+CHILD = '''
+import sys
+from xenon import main
+from xenon.timings import peak_rss
+sys.argv = ['xenon'] + sys.argv[1:]
+try:
+    main()
+except SystemExit:
+    pass
+sys.stdout.write('%d\\n' % peak_rss())
+'''
+
+
+class DiscardHandler(BaseHTTPRequestHandler):
+    '''Read the chunked body of the request and throw it away.'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            self.rfile.read(size)
+            self.rfile.readline()
+            if not size:
+                break
+        reply = b'{"message": "ok"}'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+def git_tree(root, files, blocks):
+    '''Write a synthetic tree in a new Git repository, as uploads need
+    one.'''
+    make_tree(root, files, blocks, depth=1)
+    for cmd in (['init', '-q'], ['add', '-A'],
+                ['-c', 'user.name=bench', '-c', 'user.email=bench@localhost',
+                 'commit', '-q', '-m', 'tree']):
+        subprocess.check_call(['git'] + cmd, cwd=root)
+
+
+def peak(root, url, extra):
+    '''Return the peak memory of an upload of *root*, in megabytes.'''
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.check_output(
+        [sys.executable, '-c', CHILD, root, '--url', url, '--no-cache'] +
+        extra, env=env, stderr=open(os.devnull, 'w'))
+    return round(int(out.split()[-1]) / 1024. / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', default='1000,4000,16000')
+    parser.add_argument('--blocks', type=int, default=20)
+    parser.add_argument('--max-memory', default='4')
+    args = parser.parse_args()
+
+    server = HTTPServer(('127.0.0.1', 0), DiscardHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:%d/jobs' % server.server_port
+    report = []
+    try:
+        for files in map(int, args.files.split(',')):
+            root = tempfile.mkdtemp(prefix='xenon-bench-')
+            try:
+                git_tree(root, files, args.blocks)
+                report.append({
+                    'files': files,
+                    'blocks': files * args.blocks,
+                    'in_memory_mb': peak(root, url, []),
+                    'max_memory_mb': peak(root, url, ['--max-memory',
+                                                      args.max_memory]),
+                })
+            finally:
+                shutil.rmtree(root)
+    finally:
+        server.shutdown()
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
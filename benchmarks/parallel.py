@@ -0,0 +1,66 @@
+'''Measure the speedup of ``--jobs`` over the serial harvester.
+
+Usage::
+
+    python benchmarks/parallel.py [--files N] [--jobs 1,2,4,8]
+
+The timings are printed as JSON.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xenon.core import Config, harvest, resolve_jobs  # noqa: E402
+from synthetic import make_tree  # noqa: E402
+
+
+def run(root, jobs):
+    config = Config()
+    start = time.time()
+    harvest([root], config, jobs)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--blocks', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--jobs', default=None,
+                        help='Comma separated list of pool sizes')
+    args = parser.parse_args()
+    if args.jobs:
+        jobs = [int(j) for j in args.jobs.split(',')]
+    else:
+        cpus = resolve_jobs(0)
+        jobs = sorted(set([1, 2, 4, cpus]) & set(range(1, cpus + 1)))
+
+    root = tempfile.mkdtemp(prefix='xenon-bench-')
+    try:
+        make_tree(root, args.files, args.blocks, args.depth)
+        serial = run(root, 1)
+        report = {
+            'files': args.files,
+            'cpus': multiprocessing.cpu_count(),
+            'runs': [],
+        }
+        for n in jobs:
+            elapsed = serial if n == 1 else run(root, n)
+            report['runs'].append({'jobs': n, 'seconds': round(elapsed, 4),
+                                   'speedup': round(serial / elapsed, 2)})
+    finally:
+        shutil.rmtree(root)
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
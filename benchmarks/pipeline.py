@@ -0,0 +1,137 @@
+'''Time every stage of Xenon's analysis pipeline on a synthetic tree.
+
+Usage::
+
+    python benchmarks/pipeline.py [--files N] [--blocks N] [--depth N]
+                                  [--repeat N] [--output FILE]
+
+The stages are timed separately: file discovery, parsing, threshold checking,
+JSON payload building and Git metadata collection. The report is written as
+JSON (to standard output by default), so that it can be stored and compared
+across Xenon and Radon versions.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import platform
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import radon  # noqa: E402
+from radon.cli import Config as RadonConfig  # noqa: E402
+from radon.cli.harvest import CCHarvester  # noqa: E402
+from radon.cli.tools import iter_filenames  # noqa: E402
+from radon.complexity import SCORE  # noqa: E402
+
+import xenon  # noqa: E402
+from xenon.api import build_payload  # noqa: E402
+from xenon.core import Config, harvest, find_infractions  # noqa: E402
+from xenon.repository import gitrepo  # noqa: E402
+from synthetic import make_tree  # noqa: E402
+
+
+class Args(object):
+    absolute = 'B'
+    modules = 'B'
+    average = 'A'
+    averagenum = None
+    paths_in_front = False
+
+
+def timeit(func, repeat):
+    '''Call *func* *repeat* times and return its timings along with the
+    result of the last call.'''
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        result = func()
+        timings.append(time.time() - start)
+    timings.sort()
+    stats = {
+        'min': round(timings[0], 6),
+        'median': round(timings[len(timings) // 2], 6),
+        'max': round(timings[-1], 6),
+    }
+    return stats, result
+
+
+def init_repo(root):
+    def git(*args):
+        subprocess.check_call(['git', '-c', 'user.name=bench',
+                               '-c', 'user.email=bench@example.com'] +
+                              list(args), cwd=root, stdout=subprocess.PIPE)
+    git('init', '-q')
+    git('add', '.')
+    git('commit', '-q', '-m', 'Synthetic tree')
+
+
+def run(root, repeat):
+    radon_config = RadonConfig(exclude=None, ignore=None, order=SCORE,
+                               no_assert=False, show_closures=False, min='A',
+                               max='F')
+    logger = logging.getLogger('xenon-bench')
+    logger.disabled = True
+    stages = {}
+    stages['discovery'], filenames = timeit(
+        lambda: list(iter_filenames([root])), repeat)
+    stages['parsing_radon'], _ = timeit(
+        lambda: CCHarvester([root], radon_config)._to_dicts(), repeat)
+    stages['parsing'], results = timeit(
+        lambda: harvest([root], Config()), repeat)
+    stages['find_infractions'], _ = timeit(
+        lambda: find_infractions(Args, logger, results), repeat)
+    stages['build_payload'], payload = timeit(
+        lambda: build_payload('token', '1', 'bench', {}, results), repeat)
+    stages['gitrepo'], _ = timeit(lambda: gitrepo(root), repeat)
+    return {
+        'modules': len(filenames),
+        'blocks': sum(len(b) for b in results.values()),
+        'payload_bytes': len(payload),
+        'stages': stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--blocks', type=int, default=20)
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write the report to this file')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='xenon-bench-')
+    try:
+        make_tree(root, args.files, args.blocks, args.depth, args.seed)
+        init_repo(root)
+        report = run(root, args.repeat)
+    finally:
+        shutil.rmtree(root)
+    parameters = dict(vars(args))
+    del parameters['output']
+    report.update({
+        'parameters': parameters,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'radon': radon.__version__,
+        'xenon': xenon.__version__,
+        'timestamp': int(time.time()),
+    })
+    if args.output:
+        with open(args.output, 'w') as fobj:
+            json.dump(report, fobj, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''Measure the lookup of per-path policies against the number of rules.
+
+Usage::
+
+    python benchmarks/policy.py [--modules N]
+
+For every number of rules, the policies of *modules* module paths are found
+through :class:`~xenon.policy.PolicyIndex` and by matching every rule in
+turn with :mod:`fnmatch`, as a naive implementation would. The rules are
+directory prefixes, a few globs below them and a few globs without a literal
+prefix (e.g. ``*/migrations3/*.py``), which every lookup has to try. The
+microseconds per lookup are printed as JSON.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import fnmatch
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xenon.policy import Policy, PolicyIndex  # noqa: E402
+
+
+def make_rules(count, rng):
+    rules = []
+    for i in range(count):
+        path = 'pkg%d/sub%d/' % (rng.randrange(200), rng.randrange(50))
+        if i % 10 == 0:
+            path += '*_test.py'
+        elif i % 10 == 5:
+            path = rng.choice(['*/migrations%d/*.py', '**/test_%d*.py']) % i
+        rules.append({'path': path, 'max_absolute': rng.choice('ABCDEF')})
+    return rules
+
+
+def naive(rules, module):
+    matched = []
+    for i, rule in enumerate(rules):
+        path = rule['path'].rstrip('/')
+        if fnmatch.fnmatch(module, path) or \
+                fnmatch.fnmatch(module, path + '/*'):
+            matched.append(i)
+    return matched
+
+
+def per_lookup(func, modules):
+    start = time.time()
+    for module in modules:
+        func(module)
+    return round((time.time() - start) / len(modules) * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    modules = ['pkg%d/sub%d/deep/mod%d.py' % (rng.randrange(200),
+                                              rng.randrange(50), i)
+               for i in range(args.modules)]
+    default = Policy('B', 'B')
+    report = []
+    for count in (10, 100, 1000, 10000):
+        rules = make_rules(count, rng)
+        index = PolicyIndex(rules)
+        sample = modules[:max(1, args.modules // count)]
+        report.append({
+            'rules': count,
+            'index_us': per_lookup(lambda m: index.resolve(m, default),
+                                   modules),
+            'naive_us': per_lookup(lambda m: naive(rules, m), sample),
+        })
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
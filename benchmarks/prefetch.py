@@ -0,0 +1,82 @@
+'''Measure the read-ahead of the files on a simulated slow filesystem.
+
+Usage::
+
+    python benchmarks/prefetch.py [--files N] [--latency MS] [--readers N,..]
+
+Every read of the synthetic tree is delayed by *latency* milliseconds, like
+on a network filesystem or a cold container overlay. The files are analyzed
+in a single process, reading them one at a time and then with a growing
+number of reader threads. The time of every run is reported as JSON.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xenon.core import harvest_file  # noqa: E402
+from xenon.discovery import Discovery  # noqa: E402
+from xenon.prefetch import prefetch, read_file  # noqa: E402
+from synthetic import make_tree  # noqa: E402
+
+
+def slow_reader(latency):
+    '''Return a function reading a file after sleeping *latency* seconds.'''
+    def read(name):
+        time.sleep(latency)
+        return read_file(name)
+    return read
+
+
+def run(filenames, read, readers):
+    start = time.time()
+    if readers:
+        contents = prefetch(filenames, readers, read=read)
+    else:
+        contents = ((name, read(name)) for name in filenames)
+    results = dict((name, harvest_file(name, data=data))
+                   for name, data in contents)
+    return round(time.time() - start, 4), results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--blocks', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=5.,
+                        help='Delay of every read, in milliseconds')
+    parser.add_argument('--readers', default='1,2,4,8,16')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='xenon-bench-')
+    try:
+        make_tree(root, args.files, args.blocks)
+        filenames = list(Discovery().iter([root]))
+        read = slow_reader(args.latency / 1000.)
+        serial, expected = run(filenames, read, 0)
+        report = {'files': len(filenames), 'latency_ms': args.latency,
+                  'serial': serial, 'readers': {}}
+        for readers in map(int, args.readers.split(',')):
+            elapsed, results = run(filenames, read, readers)
+            if results != expected:
+                sys.exit('the results differ with %d readers' % readers)
+            report['readers'][readers] = {
+                'time': elapsed, 'speedup': round(serial / elapsed, 2)}
+        # The overhead of the threads when reads are fast
+        local, _ = run(filenames, read_file, 0)
+        prefetched, _ = run(filenames, read_file, 4)
+        report['local'] = {'serial': local, 'readers_4': prefetched}
+    finally:
+        shutil.rmtree(root)
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
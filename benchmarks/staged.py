@@ -0,0 +1,89 @@
+'''Compare the cost of a pre-commit check with and without ``--staged``.
+
+Usage::
+
+    python benchmarks/staged.py [--files N] [--staged N] [--repeat N]
+
+A synthetic tree of *files* modules is committed to a new repository, then
+*staged* of them are edited and staged. The best time of checking the whole
+tree and of checking the staged files only is reported as JSON, without any
+cache, for the default of a single process.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xenon.core import analyze  # noqa: E402
+from xenon.repository import git  # noqa: E402
+from synthetic import make_tree  # noqa: E402
+
+
+class Arguments(object):
+    path = ['.']
+    exclude = ignore = None
+    no_assert = False
+    absolute = 'B'
+    modules = 'A'
+    average = 'A'
+    averagenum = None
+    paths_in_front = False
+    staged = False
+
+
+def best(args, repeat):
+    logger = logging.getLogger('bench')
+    logger.disabled = True
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        analyze(args, logger, keep_results=False)
+        times.append(time.time() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--files', type=int, default=2000)
+    parser.add_argument('--staged', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    oldwd = os.getcwd()
+    root = tempfile.mkdtemp(prefix='xenon-bench-')
+    try:
+        os.chdir(root)
+        paths = make_tree(root, args.files)
+        git('init', '-q')
+        git('add', '.')
+        git('-c', 'user.name=bench', '-c', 'user.email=bench@localhost',
+            'commit', '-q', '-m', 'tree')
+        for path in paths[:args.staged]:
+            with open(path, 'a') as fobj:
+                fobj.write('\n\ndef edited(x):\n    return x and 1\n')
+        git('add', '.')
+        full = Arguments()
+        staged = Arguments()
+        staged.staged = True
+        report = {
+            'files': args.files,
+            'staged_files': args.staged,
+            'whole_tree': round(best(full, args.repeat), 3),
+            'staged': round(best(staged, args.repeat), 3),
+        }
+    finally:
+        os.chdir(oldwd)
+        shutil.rmtree(root)
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+'''Measure Xenon's startup cost and check it against a budget.
+
+Usage::
+
+    python benchmarks/startup.py [--ratio R | --budget MS] [--repeat N]
+
+The import time of ``xenon.core`` is taken from ``python -X importtime``,
+excluding the modules the interpreter imports anyway at startup. The wall
+time of ``python -m xenon --version`` is measured as well. The report is
+printed as JSON, and the exit code is 1 if the median import time exceeds the
+budget.
+
+Import times vary a lot from one machine to another, so the budget is
+relative to the import time of ``radon.complexity``, which Xenon cannot
+avoid: by default ``xenon.core`` may take at most 25 times as long. It was
+calibrated on CPython 3.11, where the ratio is about 16. ``--budget`` sets an
+absolute budget in milliseconds instead.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#: Modules which must never be imported just to run the analysis.
+HEAVY = ('radon.cli', 'requests', 'yaml', 'multiprocessing', 'numpy')
+
+
+def importtime(code):
+    '''Run *code* with ``-X importtime`` and return a dictionary mapping
+    every imported module to its own import time, in microseconds.'''
+    out = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=ROOT, stderr=subprocess.PIPE).communicate()[1].decode('utf-8')
+    modules = {}
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = int(self_us)
+    return modules
+
+
+def median_import(code, baseline, repeat):
+    '''Return the median time in milliseconds spent importing the modules
+    *code* imports, besides the *baseline* ones, and the set of those
+    modules.'''
+    imports = []
+    modules = set()
+    for _ in range(repeat):
+        times = importtime(code)
+        modules = set(times) - baseline
+        imports.append(sum(times[m] for m in modules) / 1000.)
+    imports.sort()
+    return imports[len(imports) // 2], modules
+
+
+def version_time():
+    start = time.time()
+    subprocess.check_call([sys.executable, '-m', 'xenon', '--version'],
+                          cwd=ROOT, stdout=subprocess.PIPE)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ratio', type=float, default=25.,
+                        help='Import time budget, as a multiple of the '
+                        'import time of radon.complexity')
+    parser.add_argument('--budget', type=float,
+                        help='Import time budget in milliseconds, instead of '
+                        'the ratio')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if sys.version_info < (3, 7):
+        sys.exit('-X importtime requires Python 3.7+')
+    baseline = set(importtime('pass'))
+    radon_ms = median_import('import radon.complexity', baseline,
+                             args.repeat)[0]
+    median, modules = median_import('import xenon.core', baseline,
+                                    args.repeat)
+    budget = args.budget
+    if budget is None:
+        budget = args.ratio * radon_ms
+    versions = sorted(version_time() for _ in range(args.repeat))
+    report = {
+        'import_ms': round(median, 3),
+        'radon_import_ms': round(radon_ms, 3),
+        'version_ms': round(versions[len(versions) // 2] * 1000, 3),
+        'budget_ms': round(budget, 3),
+        'modules': len(modules),
+        'heavy_modules': sorted(m for m in modules if m in HEAVY),
+    }
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+    if median > budget or report['heavy_modules']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+'''Helpers to generate synthetic source trees for the benchmarks.'''
+
+import os
+import random
+
+
+def make_block(name, depth, rng):
+    '''Return the source of a function with *depth* nested branches.'''
+    lines = ['def %s(x):' % name]
+    indent = '    '
+    for level in range(depth):
+        cond = rng.choice(['x > %d', 'x < %d', 'x == %d', 'x and %d'])
+        lines.append('%sif %s:' % (indent, cond % level))
+        indent += '    '
+        lines.append('%sx += %d' % (indent, level))
+    lines.append('%sreturn x' % indent)
+    for level in reversed(range(depth)):
+        indent = '    ' * (level + 1)
+        lines.append('%sfor i in range(%d):' % (indent, level + 1))
+        lines.append('%s    x -= i' % indent)
+    lines.append('    return x')
+    return '\n'.join(lines)
+
+
+def make_tree(root, files=100, blocks=10, depth=3, seed=0):
+    '''Write a tree of *files* Python modules under *root*, each one with
+    *blocks* functions whose nesting goes up to *depth*. Modules are spread
+    over ten packages. The list of written paths is returned.
+    '''
+    rng = random.Random(seed)
+    paths = []
+    for i in range(files):
+        package = os.path.join(root, 'pkg%d' % (i % 10))
+        if not os.path.isdir(package):
+            os.makedirs(package)
+        path = os.path.join(package, 'mod%d.py' % i)
+        source = '\n\n\n'.join(make_block('f%d' % j, rng.randint(0, depth),
+                                          rng)
+                               for j in range(blocks))
+        with open(path, 'w') as fobj:
+            fobj.write(source + '\n')
+        paths.append(path)
+    return paths
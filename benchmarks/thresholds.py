@@ -0,0 +1,99 @@
+'''Compare the threshold evaluation with the per-block loop it replaced.
+
+Usage::
+
+    python benchmarks/thresholds.py [--modules N] [--blocks N]
+
+Synthetic results with ``modules * blocks`` blocks (one million by default)
+are checked against the ``-b A -m A -a A`` thresholds by the old loop, and
+by :func:`xenon.evaluation.evaluate` with every available backend. The time
+taken by the statistics is reported too.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from radon.complexity import cc_rank  # noqa: E402
+from xenon.blocks import Block  # noqa: E402
+from xenon.core import av, check  # noqa: E402
+from xenon.evaluation import BlockTable, evaluate, has_numpy  # noqa: E402
+
+
+class Thresholds(object):
+    absolute = modules = average = 'A'
+    averagenum = None
+    paths_in_front = False
+
+
+def legacy(args, logger, results):
+    '''The loop find_infractions used to run.'''
+    infractions, total_cc, total_blocks = 0, 0., 0
+    module_averages = []
+    for module, blocks in results.items():
+        module_cc = 0.
+        for block in blocks:
+            module_cc += block['complexity']
+            r = cc_rank(block['complexity'])
+            if check(r, args.absolute):
+                logger.error('block "%s:%s %s" has a rank of %s', module,
+                             block['lineno'], block['name'], r)
+                infractions += 1
+        module_averages.append((module, av(module_cc, len(blocks))))
+        total_cc += module_cc
+        total_blocks += len(blocks)
+    for module, ma in module_averages:
+        mar = cc_rank(ma)
+        if check(mar, args.modules):
+            logger.error('module %r has a rank of %s', module, mar)
+            infractions += 1
+    if check(cc_rank(av(total_cc, total_blocks)), args.average):
+        infractions += 1
+    return infractions
+
+
+def timed(func):
+    start = time.time()
+    result = func()
+    return round(time.time() - start, 4), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', type=int, default=20000)
+    parser.add_argument('--blocks', type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    # Mostly simple blocks, like real code bases
+    weights = [1] * 60 + [2] * 20 + [4] * 10 + [8] * 6 + [15] * 3 + [45]
+    results = dict(('pkg/mod%d.py' % i, [
+        Block('f%d' % j, 'function', None, j, j + 1, rng.choice(weights))
+        for j in range(args.blocks)]) for i in range(args.modules))
+    logger = logging.getLogger('bench')
+    logger.disabled = True
+    thresholds = Thresholds()
+
+    report = {'blocks': args.modules * args.blocks}
+    report['legacy'], expected = timed(
+        lambda: legacy(thresholds, logger, results))
+    report['table'], table = timed(lambda: BlockTable.from_results(results))
+    for backend in ['python'] + (['numpy'] if has_numpy() else []):
+        report[backend], found = timed(
+            lambda: evaluate(table, thresholds, logger, backend=backend))
+        if found != expected:
+            sys.exit('%s found %d infractions instead of %d' % (
+                backend, found, expected))
+        report[backend + '_stats'], _ = timed(lambda: table.stats(backend))
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
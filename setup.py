@@ -22,6 +22,7 @@ setup(name='xenon',
       packages=['xenon'],
       tests_require=['tox', 'httpretty'],
       install_requires=reqs,
+      extras_require={'numpy': ['numpy']},
       entry_points={'console_scripts': ['xenon = xenon:main']},
       classifiers=[
           'Development Status :: 4 - Beta',
@@ -2,18 +2,50 @@
 # import mock  # can't use mock because patches influences each other
 import os
 import sys
+import shutil
+import tempfile
+import io
+import gzip
+import json
+import logging
+import random
+import pickle
+import time
+import threading
+import subprocess
 import unittest
 import collections
+from xml.dom import minidom
 
 # Monkey-patch paramunittest for Python 3.10+
 if sys.version_info[:2] >= (3, 10):
     import collections.abc
     collections.Mapping = collections.abc.Mapping
 
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:  # pragma: no cover
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
 import httpretty
+import requests
 from paramunittest import parametrized
+from radon.cli import Config
+from radon.cli.harvest import CCHarvester
+from radon.cli.tools import cc_to_dict
+from radon.complexity import SCORE, cc_rank, cc_visit, sorted_results
 
-from xenon import core, api, main
+from xenon import (core, analyzer, api, main, parse_args, baseline, batch,
+                   discovery, evaluation, history, hotspots, policy,
+                   reporters, repository, run_command, server, snapshot,
+                   watch)
+from xenon.blocks import Block, to_dicts, to_json
+from xenon.cache import ResultCache, SegmentCache, blob_hash
+from xenon.prefetch import prefetch
+from xenon.spill import SpilledResults
+from xenon.timings import Timings, peak_rss
 
 
 Args = collections.namedtuple(
@@ -27,6 +59,22 @@ class CatchAll(object):
         return lambda *a, **kw: True
 
 
+class RecordingLogger(object):
+
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+
+    def error(self, msg, *args):
+        self.errors.append(msg % args)
+
+    def warning(self, msg, *args):
+        self.warnings.append(msg % args)
+
+    def log(self, level, msg, *args):
+        (self.errors if level >= 40 else self.warnings).append(msg % args)
+
+
 class Arguments(object):
     path = ['xenon']
     url = 'http://api.barium.cc/jobs'
@@ -42,6 +90,7 @@ class Arguments(object):
     modules = None
     averagenum = None
     paths_in_front = False
+    upload_retries = 0
 
 
 @parametrized(
@@ -140,6 +189,1774 @@ class InfractionsTestCase(unittest.TestCase):
         self.assertEqual(infr, self.infractions)
 
 
+class HarvestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config = core.Config()
+
+    def test_harvest(self):
+        config = Config(exclude=None, ignore=None, order=SCORE,
+                        no_assert=False, show_closures=False,
+                        min='A', max='F')
+        expected = CCHarvester(['xenon'], config)._to_dicts()
+        serial = core.harvest(['xenon'], self.config)
+        self.assertEqual(list(serial), list(expected))
+        fields = ('name', 'lineno', 'endline', 'complexity', 'rank', 'type')
+        for module, blocks in expected.items():
+            self.assertEqual(
+                [[b[f] for f in fields] for b in serial[module]],
+                [[b[f] for f in fields] for b in blocks])
+            self.assertEqual(to_dicts(serial[module]), blocks)
+
+    def test_legacy(self):
+        config = Config(exclude=None, ignore=None, order=SCORE,
+                        no_assert=False, show_closures=False,
+                        min='A', max='F')
+        expected = CCHarvester(['xenon'], config)._to_dicts()
+        legacy = core.iter_legacy(['xenon'], self.config)
+        self.assertEqual([(name, blocks) for name, blocks, _ in legacy],
+                         list(expected.items()))
+
+    def test_legacy_infractions(self):
+        args = Arguments()
+        args.absolute, args.modules, args.average = 'A', 'A', 'A'
+        infractions, results = core.analyze(args, CatchAll())
+        args.legacy_harvester = True
+        self.assertEqual(core.analyze(args, CatchAll())[0], infractions)
+
+    def test_harvest_parallel(self):
+        serial = core.harvest(['xenon'], self.config)
+        parallel = core.harvest(['xenon'], self.config, 2)
+        self.assertEqual(list(parallel.items()), list(serial.items()))
+
+    def test_analyze_jobs(self):
+        args = Arguments()
+        args.absolute, args.modules, args.average = 'A', 'A', 'A'
+        serial = core.analyze(args, CatchAll())
+        args.jobs = 2
+        self.assertEqual(core.analyze(args, CatchAll()), serial)
+
+    def test_resolve_jobs(self):
+        self.assertEqual(core.resolve_jobs(3), 3)
+        self.assertEqual(core.resolve_jobs(-1), 1)
+        self.assertTrue(core.resolve_jobs(0) >= 1)
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cache = ResultCache(self.root)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_blob_hash(self):
+        # Same as `git hash-object` on a file containing "hello\n"
+        self.assertEqual(blob_hash(b'hello\n'),
+                         'ce013625030ba8dba906f756967f9e9ca394464a')
+
+    def test_roundtrip(self):
+        self.assertIsNone(self.cache.get('ab' * 20))
+        blocks = [Block('f', 'function', None, 1, 2, 3)]
+        self.cache.set('ab' * 20, blocks)
+        self.assertEqual(self.cache.get('ab' * 20), blocks)
+        self.cache.set('cd' * 20, {'error': 'invalid syntax'})
+        self.assertEqual(self.cache.get('cd' * 20),
+                         {'error': 'invalid syntax'})
+
+    def test_settings(self):
+        self.cache.set('ab' * 20, [])
+        other = ResultCache(self.root, no_assert=True)
+        self.assertIsNone(other.get('ab' * 20))
+
+    def test_corrupted(self):
+        self.cache.set('ab' * 20, [])
+        with open(self.cache._entry('ab' * 20), 'w') as fobj:
+            fobj.write('[{')
+        self.assertIsNone(self.cache.get('ab' * 20))
+
+    def test_prune(self):
+        for i in range(10):
+            self.cache.set('%040x' % i, {'error': 'x' * 100})
+        size = sum(e[1] for e in self.cache.entries())
+        self.cache.max_size = size // 2
+        self.assertEqual(self.cache.prune(), 5)
+        self.assertEqual(self.cache.prune(), 0)
+
+    def test_prune_unchanged(self):
+        self.cache.set('%040x' % 1, [])
+        stale = os.path.join(os.path.dirname(self.cache._entry('%040x' % 1)),
+                             'stale.tmp')
+        with open(stale, 'w') as fobj:
+            fobj.write('x' * 100)
+        cache = ResultCache(self.cache.root, max_size=0)
+        self.assertEqual(cache.prune(), 0)
+        cache.written = True
+        self.assertEqual(cache.prune(), 2)
+        self.assertFalse(os.path.exists(stale))
+
+    def test_permissions(self):
+        self.cache.set('ab' * 20, [])
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = os.stat(self.cache._entry('ab' * 20)).st_mode & 0o777
+        self.assertEqual(mode, 0o666 & ~umask)
+
+    def test_harvest(self):
+        config = core.Config()
+        cold = core.harvest(['xenon'], config, cache=self.cache)
+        self.assertTrue(list(self.cache.entries()))
+        warm = core.harvest(['xenon'], config, cache=self.cache)
+        self.assertEqual(warm, cold)
+        self.assertEqual(cold, core.harvest(['xenon'], config))
+
+
+class BlockCacheTestCase(unittest.TestCase):
+
+    source = (b'import os\n\n\n@property\ndef f(x):\n    if x:\n'
+              b'        def g():\n            return x or 1\n'
+              b'        return g\n    return 0\n\n\n'
+              b'class A(object):\n    def m(self, y):\n'
+              b'        return [i for i in y if i]\n\n'
+              b'    class B:\n        def n(self):\n            pass\n\n\n'
+              b'if os.name:\n    def h(z):\n        return z and 2\n')
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_lru(self):
+        segments = SegmentCache(max_entries=2)
+        segments.set('a', 1)
+        segments.set('b', 2)
+        self.assertEqual(segments.get('a'), 1)
+        segments.set('c', 3)
+        # 'b' is the least recently used entry
+        self.assertIsNone(segments.get('b'))
+        self.assertEqual(list(segments.entries), ['a', 'c'])
+        self.assertEqual((segments.hits, segments.misses), (1, 1))
+
+    def test_save(self):
+        path = os.path.join(self.root, 'segments.lru')
+        segments = SegmentCache(path)
+        segments.set('a', [1, [[['f', 'function', None, 0, 1, 2]]]])
+        segments.save()
+        loaded = SegmentCache(path)
+        loaded.load()
+        self.assertEqual(loaded.entries, segments.entries)
+        with open(path, 'w') as fobj:
+            fobj.write('{')
+        corrupted = SegmentCache(path)
+        corrupted.load()
+        self.assertEqual(len(corrupted), 0)
+
+    def test_same_results(self):
+        for show_closures in (False, True):
+            segments = SegmentCache()
+            cold = core.analyze_source(self.source, False, show_closures)
+            for _ in range(2):
+                self.assertEqual(core.analyze_segments(
+                    self.source, False, show_closures, segments), cold)
+            # The import has no block, so it is never looked up
+            self.assertEqual((segments.hits, segments.misses), (3, 3))
+
+    def test_edit(self):
+        segments = SegmentCache()
+        core.analyze_segments(self.source, segments=segments)
+        # Shift everything down and edit a single function
+        edited = b'import sys\n' + self.source.replace(b'z and 2',
+                                                       b'z and 2 or 3')
+        self.assertEqual(core.analyze_segments(edited, segments=segments),
+                         core.analyze_source(edited))
+        self.assertEqual((segments.hits, segments.misses), (2, 4))
+
+    def test_error(self):
+        self.assertEqual(core.analyze_segments(b'def f(:\n',
+                                               segments=SegmentCache()),
+                         core.analyze_source(b'def f(:\n'))
+
+    def test_analyze(self):
+        args = Arguments()
+        args.cache_dir = self.root
+        args.block_cache = True
+        timings = Timings()
+        infractions, results = core.analyze(args, CatchAll(), timings=timings)
+        self.assertEqual(core.analyze(Arguments(), CatchAll()),
+                         (infractions, results))
+        self.assertTrue(timings.counters['block cache misses'])
+        self.assertTrue(os.path.exists(os.path.join(
+            ResultCache(self.root).path, 'segments.lru')))
+
+    def test_pickle(self):
+        cache = ResultCache(self.root)
+        cache.open_segments()
+        # Worker processes do not get the segments
+        self.assertIsNone(pickle.loads(pickle.dumps(cache)).segments)
+        self.assertIsNotNone(cache.segments)
+
+
+class DiffTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.oldwd = os.getcwd()
+        self.root = tempfile.mkdtemp()
+        os.chdir(self.root)
+        self.git('init', '-q')
+        self.write('a.py', 'def f(x):\n    if x:\n        return 1\n')
+        self.write('b.py', 'def g():\n    return 2\n')
+        self.git('add', '.')
+        self.git('commit', '-q', '-m', 'first')
+        self.write('b.py', 'def g(x):\n    return x + 2\n')
+        self.write('c.py', 'def h(x):\n    return x + 3\n')
+        self.config = core.Config()
+        self.cache = ResultCache('.cache')
+
+    def tearDown(self):
+        os.chdir(self.oldwd)
+        shutil.rmtree(self.root)
+
+    def git(self, *args):
+        repository.git('-c', 'user.name=x', '-c', 'user.email=x@x', *args)
+
+    def write(self, name, source):
+        with open(name, 'w') as fobj:
+            fobj.write(source)
+
+    def test_changed_files(self):
+        self.assertEqual(repository.changed_files('HEAD'),
+                         set(['b.py', 'c.py']))
+
+    def harvest_diff(self, cache=None):
+        results, background = {}, {}
+        filenames = core.Config().discovery().iter(['.'])
+        for name, blocks, bg in core.iter_diff(filenames, self.config, 'HEAD',
+                                               cache=cache):
+            (background if bg else results)[name] = blocks
+        return results, background
+
+    def test_iter_diff(self):
+        full = core.harvest(['.'], self.config, cache=self.cache)
+        results, background = self.harvest_diff(self.cache)
+        self.assertEqual(sorted(results), ['b.py', 'c.py'])
+        self.assertEqual(sorted(background), ['a.py'])
+        background.update(results)
+        self.assertEqual(background, full)
+
+    def test_iter_diff_no_cache(self):
+        results, background = self.harvest_diff()
+        self.assertEqual(sorted(results), ['b.py', 'c.py'])
+        self.assertEqual(sorted(background), ['a.py'])
+
+    def test_bad_revision(self):
+        args = Arguments()
+        args.url, args.path, args.diff_base = None, ['.'], 'no-such-ref'
+        with open(os.devnull, 'w') as devnull:
+            stderr, sys.stderr = sys.stderr, devnull
+            try:
+                with self.assertRaises(SystemExit) as cm:
+                    main(args)
+            finally:
+                sys.stderr = stderr
+        self.assertEqual(cm.exception.code, 2)
+
+    def test_average(self):
+        results, background = self.harvest_diff()
+        # The changed files alone have an average complexity of 1
+        args = Args(None, None, None, 1.2, False)
+        self.assertEqual(core.find_infractions(args, CatchAll(), results), 0)
+        self.assertEqual(core.find_infractions(args, CatchAll(), results,
+                                               background), 1)
+
+
+class StagedTestCase(unittest.TestCase):
+
+    # The same repository, with more changes staged
+    git = DiffTestCase.git
+    write = DiffTestCase.write
+    tearDown = DiffTestCase.tearDown
+
+    def setUp(self):
+        DiffTestCase.setUp(self)
+        complex_source = 'def g(x):\n' + '    if x: pass\n' * 12
+        self.write('b.py', complex_source)
+        self.write('d.py', 'def k():\n    return 4\n')
+        self.write('e.txt', 'not python')
+        self.git('add', 'b.py', 'd.py', 'e.txt')
+        # Only the staged content counts
+        self.write('b.py', 'def g():\n    return 2\n')
+        os.remove('d.py')
+        self.args = Arguments()
+        self.args.path = ['.']
+        self.args.staged = True
+        self.args.absolute = 'B'
+
+    def test_staged_blobs(self):
+        staged = repository.staged_blobs()
+        self.assertEqual([name for name, _ in staged],
+                         ['b.py', 'd.py', 'e.txt'])
+        self.assertEqual(repository.staged_blobs(['d.py']), staged[1:2])
+
+    def test_analyze(self):
+        logger = RecordingLogger()
+        infractions, results = core.analyze(self.args, logger)
+        self.assertEqual(sorted(results), ['b.py', 'd.py'])
+        self.assertEqual(results['b.py'][0]['complexity'], 13)
+        self.assertEqual(infractions, 1)
+        self.assertTrue('b.py' in logger.errors[0])
+
+    def test_cache(self):
+        self.args.cache_dir = '.cache'
+        first = core.analyze(self.args, CatchAll())
+        self.assertEqual(len(list(ResultCache('.cache').entries())), 2)
+        self.assertEqual(core.analyze(self.args, CatchAll()), first)
+
+    def test_exclude(self):
+        self.args.exclude = 'b.py'
+        _, results = core.analyze(self.args, CatchAll())
+        self.assertEqual(sorted(results), ['d.py'])
+
+    def test_parent(self):
+        # Files outside the current directory are checked too
+        os.mkdir('sub')
+        os.chdir('sub')
+        self.args.path = ['..']
+        infractions, results = core.analyze(self.args, CatchAll())
+        self.assertEqual(sorted(results), [os.path.join('..', 'b.py'),
+                                           os.path.join('..', 'd.py')])
+        self.assertEqual(infractions, 1)
+
+
+class StreamingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.args = Arguments()
+        self.args.absolute = 'A'
+
+    def test_checker(self):
+        logger = RecordingLogger()
+        checker = core.Checker(Args('A', None, 'A', None, False), logger)
+        self.assertEqual(checker.add('mod.py', [
+            dict(name='f', complexity=4, lineno=1),
+            dict(name='g', complexity=8, lineno=5),
+        ]), 2)
+        self.assertEqual(len(logger.errors), 2)
+        checker.add_background([dict(name='h', complexity=1, lineno=1)])
+        self.assertEqual(checker.finish(), 2)
+        self.assertEqual((checker.total_cc, checker.total_blocks), (13, 3))
+
+    def test_fail_fast(self):
+        full, results = core.analyze(self.args, CatchAll())
+        self.assertTrue(full > 1)
+        self.args.fail_fast = True
+        infractions, partial = core.analyze(self.args, CatchAll())
+        self.assertTrue(1 <= infractions < full)
+        self.assertTrue(len(partial) <= len(results))
+
+    def test_keep_results(self):
+        infractions, results = core.analyze(self.args, CatchAll())
+        self.assertEqual(core.analyze(self.args, CatchAll(), False),
+                         (infractions, {}))
+
+
+class PrefetchTestCase(unittest.TestCase):
+
+    def slow_read(self, name):
+        with self.lock:
+            self.reading += 1
+            self.most = max(self.most, self.reading)
+        time.sleep(.005)
+        with self.lock:
+            self.reading -= 1
+            self.read.append(name)
+        if name == 'bad':
+            raise IOError('cannot read')
+        return name.upper()
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.reading = self.most = 0
+        self.read = []
+
+    def test_order(self):
+        names = ['n%d' % i for i in range(50)]
+        self.assertEqual(list(prefetch(names, 4, read=self.slow_read)),
+                         [(n, n.upper()) for n in names])
+        self.assertTrue(1 < self.most <= 4)
+
+    def test_depth(self):
+        names = iter(['n%d' % i for i in range(50)])
+        contents = prefetch(names, 2, depth=3, read=self.slow_read)
+        next(contents)
+        # Only the files up to the depth have been submitted
+        self.assertEqual(len(list(names)), 50 - 3)
+        contents.close()
+
+    def test_error(self):
+        contents = prefetch(['a', 'bad', 'c'], 2, read=self.slow_read)
+        self.assertEqual(next(contents), ('a', 'A'))
+        self.assertRaises(IOError, next, contents)
+
+    def test_close(self):
+        contents = prefetch(['n%d' % i for i in range(100)], 1,
+                            read=self.slow_read)
+        next(contents)
+        contents.close()
+        # The pending reads were cancelled
+        self.assertTrue(len(self.read) < 100)
+
+    def test_analyze(self):
+        args = Arguments()
+        args.readers = 0
+        expected = core.analyze(args, CatchAll())
+        args.readers = 4
+        self.assertEqual(core.analyze(args, CatchAll()), expected)
+
+
+class SpillTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.results = core.harvest(['xenon'], core.Config())
+        self.results['broken.py'] = {'error': 'invalid syntax'}
+
+    def spilled(self, max_memory=10000):
+        spilled = SpilledResults(max_memory)
+        for module, blocks in self.results.items():
+            spilled[module] = blocks
+        return spilled
+
+    def test_items(self):
+        with self.spilled() as spilled:
+            self.assertTrue(0 < spilled.spilled < len(self.results))
+            self.assertEqual(len(spilled), len(self.results))
+            self.assertEqual(list(spilled.items()),
+                             list(self.results.items()))
+            self.assertEqual(list(spilled), list(self.results))
+            # Iterations do not interfere with each other
+            for (a, _), (b, _) in zip(spilled.items(), spilled.items()):
+                self.assertEqual(a, b)
+        self.assertEqual(len(spilled), 0)
+
+    def test_memory_bound(self):
+        spilled = self.spilled()
+        self.assertTrue(spilled.size <= spilled.max_memory)
+        spilled.close()
+
+    def test_payload(self):
+        spilled = self.spilled()
+        self.assertEqual(
+            ''.join(api.iter_payload('token', '12', 'ci', {'head': {}},
+                                     spilled)),
+            api.build_payload('token', '12', 'ci', {'head': {}},
+                              self.results))
+        spilled.close()
+
+    def test_analyze(self):
+        args = Arguments()
+        expected = core.analyze(args, CatchAll())
+        args.max_memory = .01
+        infractions, results = core.analyze(args, CatchAll())
+        self.assertTrue(isinstance(results, SpilledResults))
+        self.assertTrue(results.spilled)
+        self.assertEqual((infractions, dict(results.items())), expected)
+        results.close()
+
+    def test_peak_rss(self):
+        self.assertTrue(peak_rss() > 1024 * 1024)
+
+
+class ReportersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.args = Arguments()
+        self.args.absolute = 'A'
+        self.args.modules = 'A'
+        self.args.average = 'A'
+        self.args.format = ['%s:%s' % (name, self.path(name))
+                            for name in ('json', 'sarif', 'junit', 'github')]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, name):
+        return os.path.join(self.root, 'report.' + name)
+
+    def read(self, name):
+        with open(self.path(name)) as fobj:
+            return fobj.read()
+
+    def test_single_pass(self):
+        infractions, results = core.analyze(self.args, CatchAll())
+        self.assertTrue(infractions > 1)
+        report = json.loads(self.read('json'))
+        self.assertEqual(sorted(report['modules']), sorted(results))
+        self.assertEqual(sum(len(m['infractions'])
+                             for m in report['modules'].values()) +
+                         len(report['infractions']), infractions)
+        self.assertEqual(report['summary']['infractions'], infractions)
+        sarif = json.loads(self.read('sarif'))
+        self.assertEqual(len(sarif['runs'][0]['results']), infractions)
+        junit = minidom.parseString(self.read('junit'))
+        self.assertEqual(len(junit.getElementsByTagName('failure')),
+                         infractions)
+        self.assertEqual(self.read('github').count('::error '), infractions)
+
+    def test_fail_fast(self):
+        self.args.fail_fast = True
+        infractions, _ = core.analyze(self.args, CatchAll())
+        # The reports are still complete documents
+        self.assertEqual(json.loads(self.read('json'))['summary']
+                         ['infractions'], infractions)
+        json.loads(self.read('sarif'))
+        minidom.parseString(self.read('junit'))
+
+    def test_github_escaping(self):
+        stream = io.StringIO()
+        reporter = reporters.GitHubReporter(stream)
+        block = Block('f', 'function', None, 3, 5, 12)
+        reporter.module('a,b:c.py', [block], [reporters.Infraction(
+            'block', 'a,b:c.py', block, 'C', 'B')])
+        self.assertEqual(stream.getvalue(),
+                         '::error file=a%2Cb%3Ac.py,line=3,endLine=5,'
+                         'title=Xenon::block "f" has a rank of C (max B)\n')
+
+    def test_parse_format(self):
+        self.assertEqual(reporters.parse_format('github'), ('github', None))
+        self.assertEqual(reporters.parse_format('json:C:\\out.json'),
+                         ('json', 'C:\\out.json'))
+
+
+class AnalyzerTestCase(unittest.TestCase):
+
+    def test_same_infractions(self):
+        args = Arguments()
+        args.absolute = 'A'
+        args.modules = 'A'
+        args.average = 'A'
+        logger = RecordingLogger()
+        infractions, results = core.analyze(args, logger)
+        with analyzer.Analyzer(absolute='a', modules='a', average='a') as a:
+            report = a.check(['xenon'])
+        self.assertEqual(len(report.infractions), infractions)
+        self.assertEqual(report.results, results)
+        self.assertEqual(report.errors, {})
+        self.assertFalse(report.ok)
+        self.assertEqual(sorted('block "%s:%s %s" has a rank of %s' % (
+            i.module, i.block['lineno'], i.block['name'], i.value)
+            for i in report.infractions if i.kind == 'block'),
+            sorted(e for e in logger.errors if e.startswith('block')))
+        json.dumps(report.as_dict())
+
+    def test_sources(self):
+        with analyzer.Analyzer(absolute='A') as a:
+            report = a.check(sources=[
+                ('a.py', 'def f(a):\n    return a and 1 or 2\n'),
+                ('b.py', b'def g(:\n'),
+                ('c.py', 'x = 1\n'),
+            ])
+            self.assertEqual(list(report.results), ['a.py'])
+            self.assertEqual(report.results['a.py'][0].complexity, 3)
+            self.assertEqual(list(report.errors), ['b.py'])
+            self.assertTrue(report.ok)
+            self.assertEqual((report.blocks, report.rank), (1, 'A'))
+            a.average = 'A'
+            report = a.check(sources=[('e.py', 'def h(a):\n' +
+                                       '    if a: pass\n' * 6)])
+            self.assertEqual([i.kind for i in report.infractions],
+                             ['block', 'average'])
+            # The same content is not analyzed again, whatever its name
+            report = a.check(sources=[('d.py', b'def f(a):\n'
+                                       b'    return a and 1 or 2\n')])
+            self.assertEqual(a.memo.hits, 1)
+            self.assertEqual(report.results['d.py'][0].complexity, 3)
+
+    def test_pool_reused(self):
+        sources = [('m%d.py' % i, 'def f%d():\n    pass\n' % i)
+                   for i in range(8)]
+        a = analyzer.Analyzer(jobs=2)
+        try:
+            self.assertEqual(len(a.analyze(sources=sources)), 8)
+            pool = a.pool()
+            self.assertIsNotNone(pool)
+            sources = [(name, source + '\n') for name, source in sources]
+            self.assertEqual(len(a.analyze(sources=sources)), 8)
+            self.assertIs(a.pool(), pool)
+        finally:
+            a.close()
+        self.assertIsNone(a._pool)
+
+
+class TimingsTestCase(unittest.TestCase):
+
+    def test_stage(self):
+        timings = Timings()
+        for _ in range(2):
+            with timings.stage('parse'):
+                pass
+        self.assertEqual(timings.order, ['parse'])
+        self.assertEqual(len(timings.stages['parse']), 2)
+
+    def test_timed(self):
+        timings = Timings()
+        self.assertEqual(list(timings.timed('walk', range(3))), [0, 1, 2])
+        self.assertIn('walk', timings.stages)
+
+    def test_slowest(self):
+        timings = Timings()
+        for i, name in enumerate('abcd'):
+            timings.record_file(name, i, i / 2.)
+        self.assertEqual([f[2] for f in timings.slowest(2)], ['d', 'c'])
+        self.assertEqual(timings.stages['analysis'], [6, 3])
+        report = timings.as_dict(1)
+        self.assertEqual(report['files'], 4)
+        self.assertEqual(report['slowest'],
+                         [{'path': 'd', 'wall': 3, 'cpu': 1.5}])
+
+    def test_analyze(self):
+        timings = Timings()
+        infractions, results = core.analyze(Arguments(), CatchAll(),
+                                            timings=timings)
+        self.assertEqual(sorted(f[2] for f in timings.files),
+                         sorted(results))
+        for stage in ('discovery', 'analysis', 'checking'):
+            self.assertIn(stage, timings.stages)
+
+
+class BlockTestCase(unittest.TestCase):
+
+    source = 'class A:\n    def f(self, x):\n        def g():\n' \
+             '            pass\n        return x and g\n'
+
+    nested = ('class A:\n    class B:\n        def f(self):\n'
+              '            pass\n    def f(self, x):\n'
+              '        return x\n\nclass C(A):\n    def f(self):\n'
+              '        def g(y):\n            def h():\n'
+              '                return y or 1\n            return h\n'
+              '        return g\n')
+
+    def test_as_dict(self):
+        for block in cc_visit(self.source):
+            expected = cc_to_dict(block)
+            expected.pop('methods', None)
+            self.assertEqual(Block.from_radon(block).as_dict(), expected)
+
+    def test_to_dicts(self):
+        for source in (self.source, self.nested):
+            blocks = sorted_results(cc_visit(source), SCORE)
+            self.assertEqual(to_dicts(core.analyze_source(source)),
+                             [cc_to_dict(b) for b in blocks])
+            self.assertEqual(to_dicts([Block.from_radon(b) for b in blocks]),
+                             [cc_to_dict(b) for b in blocks])
+        error = {'error': 'invalid syntax'}
+        self.assertEqual(to_dicts(error), error)
+
+    def test_getitem(self):
+        block = Block('f', 'function', None, 1, 2, 3)
+        self.assertEqual(block['complexity'], 3)
+        self.assertEqual(block['rank'], 'A')
+        self.assertRaises(KeyError, lambda: block['methods'])
+
+    def test_pickle(self):
+        block = Block('f', 'method', 'A', 1, 2, 3)
+        self.assertEqual(pickle.loads(pickle.dumps(block)), block)
+        block = Block.from_radon(cc_visit(self.source)[1])
+        self.assertEqual(len(block.closures), 1)
+        self.assertEqual(pickle.loads(pickle.dumps(block)), block)
+
+    def test_payload(self):
+        block = Block('f', 'function', None, 1, 2, 3)
+        payload = json.loads(api.build_payload(None, '1', 'ci', {},
+                                               {'a.py': [block]}))
+        self.assertEqual(payload['cc_data'], {'a.py': [block.as_dict()]})
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        code = ('import sys, xenon.core; print(" ".join(m for m in '
+                '("radon.cli", "requests", "yaml", "multiprocessing", '
+                '"numpy") '
+                'if m in sys.modules))')
+        out = subprocess.Popen([sys.executable, '-c', code],
+                               stdout=subprocess.PIPE).communicate()[0]
+        self.assertEqual(out.strip(), b'')
+
+
+class DiscoveryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name in ('a.py', 'b.txt', 'pkg/c.py', 'pkg/tests/d.py',
+                     'node_modules/e.py', '.venv/f.py', 'pkg/.g.py'):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'w') as fobj:
+                fobj.write('x = 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def relative(self, filenames):
+        return sorted(os.path.relpath(f, self.root) for f in filenames)
+
+    def test_compile_patterns(self):
+        self.assertIsNone(discovery.compile_patterns(['']))
+        match = discovery.compile_patterns(['*/tests/*', 'setup.py'])
+        self.assertTrue(match('pkg/tests/a.py'))
+        self.assertTrue(match('setup.py'))
+        self.assertFalse(match('pkg/a.py'))
+
+    def test_same_as_radon(self):
+        from radon.cli.tools import iter_filenames
+
+        for exclude, ignore in ((None, None), ('*/tests/*', None),
+                                (None, 'node_modules,pkg'),
+                                ('*/a.py', 'tests')):
+            ours = list(discovery.iter_filenames([self.root], exclude,
+                                                 ignore))
+            radon = list(iter_filenames([self.root], exclude, ignore))
+            self.assertEqual(ours, radon)
+
+    def test_stats(self):
+        finder = discovery.Discovery('*/tests/*', 'node_modules')
+        found = self.relative(finder.iter([self.root]))
+        self.assertEqual(found, ['a.py', os.path.join('pkg', 'c.py')])
+        self.assertEqual(finder.stats, {'files': 2, 'skipped_files': 3,
+                                        'skipped_dirs': 2})
+
+    def test_files_and_stdin(self):
+        finder = discovery.Discovery()
+        path = os.path.join(self.root, 'a.py')
+        self.assertEqual(list(finder.iter([path])), [path])
+        self.assertEqual(list(finder.iter(['-'])), ['-'])
+        self.assertEqual(list(finder.iter([os.path.join(self.root,
+                                                        'b.txt')])), [])
+
+    def test_gitignore(self):
+        repository.git('init', '-q', cwd=self.root)
+        with open(os.path.join(self.root, '.gitignore'), 'w') as fobj:
+            fobj.write('pkg/tests/\n')
+        finder = discovery.Discovery(gitignore=True)
+        found = self.relative(finder.iter([self.root]))
+        self.assertEqual(found, ['a.py', os.path.join('node_modules', 'e.py'),
+                                 os.path.join('pkg', 'c.py')])
+        self.assertEqual(finder.stats['skipped_dirs'], 1)
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.root, 'manifest.yml')
+        self.source = os.path.abspath('xenon')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, text):
+        with open(self.manifest, 'w') as fobj:
+            fobj.write(text)
+
+    def test_load_manifest(self):
+        self.write('jobs: 3\ndefaults:\n  max_absolute: b\nrepos:\n'
+                   '  - one\n  - path: two\n    name: second\n'
+                   '    max_absolute: c\n    exclude: [a, b]\n')
+        repos, jobs = batch.load_manifest(self.manifest)
+        self.assertEqual(jobs, 3)
+        self.assertEqual([r.name for r in repos], ['one', 'second'])
+        self.assertEqual(repos[0].root, os.path.join(self.root, 'one'))
+        self.assertEqual([r.absolute for r in repos], ['B', 'C'])
+        self.assertEqual(repos[1].config.exclude, 'a,b')
+
+    def test_invalid_manifest(self):
+        self.write('repos:\n  - path: one\n    max_absolut: B\n')
+        self.assertRaises(batch.ManifestError, batch.load_manifest,
+                          self.manifest)
+        self.write('repos: one\n')
+        self.assertRaises(batch.ManifestError, batch.load_manifest,
+                          self.manifest)
+
+    def test_same_as_analyze(self):
+        args = Arguments()
+        args.absolute, args.modules = 'A', 'A'
+        expected, _ = core.analyze(args, CatchAll(), False)
+        repos = [batch.Repo('strict', self.source, max_absolute='a',
+                            max_modules='a'),
+                 batch.Repo('lenient', self.source, max_absolute='F'),
+                 batch.Repo('missing', os.path.join(self.root, 'nope'))]
+        for jobs in (1, 2):
+            report = batch.run(repos, jobs)
+            strict, lenient, missing = report['repos']
+            self.assertEqual(strict['infractions'], expected)
+            self.assertEqual(len(strict['messages']), expected)
+            self.assertEqual(strict['exit_code'], 1)
+            self.assertEqual(lenient['exit_code'], 0)
+            self.assertEqual(lenient['files'], strict['files'])
+            self.assertEqual(missing['exit_code'], 2)
+            self.assertEqual(report['exit_code'], 2)
+
+    def test_main(self):
+        self.write('repos:\n  - path: %s\n    max_absolute: F\n' %
+                   self.source)
+        output = os.path.join(self.root, 'report.json')
+        cache = os.path.join(self.root, 'cache')
+        self.assertEqual(batch.main([self.manifest, '-j', '1', '--cache-dir',
+                                     cache, '-o', output]), 0)
+        with open(output) as fobj:
+            report = json.load(fobj)
+        self.assertEqual(report['repos'][0]['name'], self.source)
+        self.assertTrue(os.path.isdir(cache))
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.results = core.harvest(['xenon'], core.Config())
+        self.results['broken.py'] = {'error': 'invalid syntax'}
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def dump(self, results):
+        buf = io.BytesIO()
+        snapshot.write(buf, results)
+        return buf.getvalue()
+
+    def test_roundtrip(self):
+        path = os.path.join(self.root, 'results.snap')
+        snapshot.save(path, self.results)
+        with snapshot.Snapshot.open(path) as snap:
+            self.assertEqual(snap.results(), self.results)
+            self.assertEqual(snap.n_modules, len(self.results))
+        data = self.dump(self.results)
+        self.assertEqual(snapshot.Snapshot(data).results(), self.results)
+        self.assertTrue(len(data) < len(json.dumps(self.results,
+                                                   default=to_json)) / 2)
+
+    def test_dictionaries(self):
+        blocks = [cc_to_dict(b) for b in cc_visit(
+            'class A:\n    def f(self):\n        pass\n')]
+        snap = snapshot.Snapshot(self.dump({'a.py': blocks}))
+        self.assertEqual([b.as_dict() for b in snap.results()['a.py']],
+                         [dict((k, b[k]) for k in b if k in (
+                             'name', 'type', 'classname', 'lineno',
+                             'endline', 'complexity', 'rank', 'col_offset',
+                             'closures'))
+                          for b in blocks])
+
+    def test_invalid(self):
+        data = self.dump(self.results)
+        self.assertRaises(snapshot.SnapshotError, snapshot.Snapshot, b'')
+        self.assertRaises(snapshot.SnapshotError, snapshot.Snapshot,
+                          b'Y' + data[1:])
+        self.assertRaises(snapshot.SnapshotError, snapshot.Snapshot,
+                          data[:len(data) // 2])
+
+    def test_diff(self):
+        old = {'a.py': [Block('f', 'function', None, 1, 2, 1),
+                        Block('f', 'function', None, 5, 6, 1),
+                        Block('m', 'method', 'C', 8, 9, 12)],
+               'b.py': [Block('g', 'function', None, 1, 2, 6)]}
+        new = {'a.py': [Block('f', 'function', None, 1, 2, 1),
+                        Block('f', 'function', None, 5, 6, 7),
+                        Block('m', 'method', 'D', 8, 9, 30),
+                        Block('m', 'method', 'C', 8, 9, 8)],
+               'b.py': [Block('g', 'function', None, 1, 2, 4),
+                        Block('h', 'function', None, 4, 5, 40)]}
+        worse = list(snapshot.diff(snapshot.Snapshot(self.dump(old)),
+                                   snapshot.Snapshot(self.dump(new))))
+        self.assertEqual([(m, b.lineno, b.name, o, n)
+                          for m, b, o, n in worse],
+                         [('a.py', 5, 'f', 'A', 'B')])
+
+    def test_commands(self):
+        args = Arguments()
+        args.url, args.absolute = None, 'A'
+        args.output_format = 'snapshot'
+        args.output = os.path.join(self.root, 'new.snap')
+        try:
+            main(args)
+        except SystemExit:
+            pass
+        old = os.path.join(self.root, 'old.snap')
+        results = dict((m, [Block(*(b.as_tuple()[:5] + (1,))) for b in bl])
+                       for m, bl in self.results.items()
+                       if not isinstance(bl, dict))
+        snapshot.save(old, results)
+        logger = logging.getLogger('xenon.diff')
+        self.assertEqual(snapshot.main([args.output, args.output], logger),
+                         0)
+        with self.assertLogs(logger, 'ERROR') as logs:
+            self.assertEqual(snapshot.main([old, args.output], logger), 1)
+        self.assertTrue(logs.output)
+        self.assertTrue(all('got worse' in line for line in logs.output))
+        with self.assertLogs(logger, 'ERROR') as logs:
+            self.assertEqual(snapshot.main([old, self.root], logger), 2)
+        self.assertIn(self.root, logs.output[0])
+
+
+def legacy_infractions(args, logger, results):
+    '''The per-block loop which used to implement find_infractions.'''
+    infractions, total_cc, total_blocks = 0, 0., 0
+    for module, blocks in results.items():
+        if isinstance(blocks, dict):
+            logger.warning('cannot parse %s: %s', module, blocks['error'])
+            continue
+        module_cc = 0.
+        for block in blocks:
+            module_cc += block['complexity']
+            r = cc_rank(block['complexity'])
+            if core.check(r, args.absolute):
+                logger.error('block "%s:%s %s" has a rank of %s', module,
+                             block['lineno'], block['name'], r)
+                infractions += 1
+        total_cc += module_cc
+        total_blocks += len(blocks)
+        mar = cc_rank(core.av(module_cc, len(blocks)))
+        if core.check(mar, args.modules):
+            logger.error('module %r has a rank of %s', module, mar)
+            infractions += 1
+    ar = cc_rank(core.av(total_cc, total_blocks))
+    if core.check(ar, args.average):
+        logger.error('average complexity is ranked %s', ar)
+        infractions += 1
+    return infractions
+
+
+class EvaluationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(0)
+        self.results = dict(
+            ('mod%d.py' % i, [Block('f%d' % j, 'function', None, j, j,
+                                    rng.choice([1, 2, 5, 6, 10, 11, 20, 21,
+                                                30, 31, 40, 41, 60]))
+                              for j in range(rng.randint(0, 6))])
+            for i in range(200))
+        self.results['broken.py'] = {'error': 'invalid syntax'}
+        self.backends = ['python'] + (['numpy'] if evaluation.has_numpy()
+                                      else [])
+
+    def test_rank_of(self):
+        for value in [0, 1, 4.9, 5, 5.1, 10, 10.5, 20, 21, 30, 30.01, 40,
+                      40.5, 100]:
+            self.assertEqual(evaluation.rank_of(value), cc_rank(value))
+
+    def test_rank_limit(self):
+        self.assertIsNone(evaluation.rank_limit(None))
+        self.assertIsNone(evaluation.rank_limit('F'))
+        self.assertEqual(evaluation.rank_limit('a'), 5)
+        self.assertEqual(evaluation.rank_limit('C'), 20)
+        self.assertEqual(evaluation.rank_limit('Z'), None)
+
+    def test_same_as_loop(self):
+        for thresholds in (('A', 'A', 'A'), ('B', 'C', 'F'),
+                           ('E', None, 'B'), (None, None, None)):
+            args = Args(thresholds[0], thresholds[2], thresholds[1], None,
+                        False)
+            expected = RecordingLogger()
+            count = legacy_infractions(args, expected, self.results)
+            for backend in self.backends:
+                logger = RecordingLogger()
+                table = evaluation.BlockTable.from_results(self.results)
+                self.assertEqual(evaluation.evaluate(table, args, logger,
+                                                     backend=backend), count)
+                self.assertEqual(logger.errors, expected.errors)
+                self.assertEqual(logger.warnings, expected.warnings)
+
+    def test_stats(self):
+        results = {'a.py': [Block('f', 'function', None, 1, 1, cc)
+                            for cc in (1, 2, 3, 4, 100)],
+                   'b.py': [], 'c.py': {'error': 'x'}}
+        background = {'d.py': [Block('g', 'function', None, 1, 1, 7)]}
+        table = evaluation.BlockTable.from_results(results, background)
+        for backend in self.backends:
+            stats = table.stats(backend)
+            self.assertEqual(sorted(stats['modules']), ['a.py'])
+            module = stats['modules']['a.py']
+            self.assertEqual(module['p50'], 3.)
+            self.assertAlmostEqual(module['p90'], 61.6)
+            self.assertEqual(module['ranks'], {'A': 4, 'B': 0, 'C': 0,
+                                               'D': 0, 'E': 0, 'F': 1})
+            self.assertEqual(stats['overall']['ranks']['B'], 1)
+            self.assertEqual(stats['overall']['p50'], 3.5)
+
+    @unittest.skipUnless(evaluation.has_numpy(), 'NumPy is not installed')
+    def test_numpy_percentiles(self):
+        import numpy
+
+        values = [b['complexity'] for blocks in self.results.values()
+                  if isinstance(blocks, list) for b in blocks]
+        stats = evaluation.BlockTable.from_results(self.results).stats(
+            'python')
+        for q in evaluation.PERCENTILES:
+            self.assertAlmostEqual(stats['overall']['p%d' % q],
+                                   numpy.percentile(values, q))
+        fast = evaluation.BlockTable.from_results(self.results).stats('numpy')
+        self.assertEqual(sorted(fast['modules']), sorted(stats['modules']))
+        for module, summary in stats['modules'].items():
+            self.assertEqual(fast['modules'][module]['ranks'],
+                             summary['ranks'])
+            for q in evaluation.PERCENTILES:
+                self.assertAlmostEqual(fast['modules'][module]['p%d' % q],
+                                       summary['p%d' % q])
+
+
+class PolicyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.index = policy.PolicyIndex([
+            {'path': 'tests/', 'max_absolute': 'c'},
+            {'path': 'legacy/**', 'max_absolute': 'F', 'max_modules': None},
+            {'path': '*/migrations/*.py', 'max_modules': 'D'},
+            {'path': 'tests/unit/test_core.py', 'max_absolute': 'B'},
+        ])
+        self.default = policy.Policy('A', 'A')
+
+    def resolve(self, module):
+        p = self.index.resolve(module, self.default)
+        return p.absolute, p.modules
+
+    def test_match(self):
+        self.assertEqual(self.index.match('tests/test_a.py'), [0])
+        self.assertEqual(self.index.match('./tests/unit/test_core.py'),
+                         [0, 3])
+        self.assertEqual(self.index.match('legacy/a/b.py'), [1])
+        self.assertEqual(self.index.match('app/migrations/0001.py'), [2])
+        self.assertEqual(self.index.match('app/migrations/0001.txt'), [])
+        self.assertEqual(self.index.match('legacy.py'), [])
+        self.assertEqual(self.index.match('testsuite/a.py'), [])
+        self.assertEqual(self.index.match(os.path.abspath('tests/a.py')),
+                         [0])
+
+    def test_resolve(self):
+        self.assertEqual(self.resolve('app/core.py'), ('A', 'A'))
+        self.assertEqual(self.resolve('tests/a.py'), ('C', 'A'))
+        # Later rules win, threshold by threshold
+        self.assertEqual(self.resolve('tests/unit/test_core.py'), ('B', 'A'))
+        self.assertEqual(self.resolve('legacy/x.py'), ('F', None))
+        self.assertEqual(self.resolve('legacy/migrations/1.py'), ('F', 'D'))
+        self.assertIs(self.index.resolve('tests/b.py', self.default),
+                      self.index.resolve('tests/c.py', self.default))
+        self.assertIs(self.index.resolve('app/core.py', self.default),
+                      self.default)
+
+    def test_invalid(self):
+        for rules in ('tests', [{'max_absolute': 'B'}],
+                      [{'path': 'a', 'max_absolute': 'G'}],
+                      [{'path': 'a', 'max_average': 'B'}],
+                      [{'path': 'a', 'absolute': 'B'}]):
+            self.assertRaises(policy.PolicyError, policy.PolicyIndex, rules)
+
+    def test_many_rules(self):
+        rules = [{'path': 'pkg%d/sub%d/' % (i, j), 'max_absolute': 'B'}
+                 for i in range(100) for j in range(20)]
+        rules.append({'path': 'pkg7/sub3/*.py', 'max_absolute': 'E'})
+        index = policy.PolicyIndex(rules)
+        self.assertEqual(len(index), 2001)
+        self.assertEqual(index.match('pkg7/sub3/mod.py'), [143, 2000])
+        self.assertEqual(index.match('pkg7/sub30/mod.py'), [])
+
+    def test_leading_globs(self):
+        # Globs indexed by a literal component, and more globs without one
+        # than an alternation holds, several of them matching
+        rules = [{'path': '*/migrations%d/*.py' % i, 'max_absolute': 'B'}
+                 for i in range(50)]
+        rules += [{'path': '**/test_%d*.py' % i, 'max_absolute': 'C'}
+                  for i in range(250)]
+        rules[230] = {'path': '*/migrations7', 'max_absolute': 'D'}
+        index = policy.PolicyIndex(rules)
+        self.assertEqual(index.match('app/migrations7/test_12.py'),
+                         [7, 51, 62, 230])
+        self.assertEqual(index.match('app/test_249.py'), [52, 74, 299])
+        self.assertEqual(index.match('test_2.py'), [])
+        self.assertEqual(index.match('app/migrations7.py'), [])
+
+    def test_evaluate(self):
+        rng = random.Random(0)
+        results = dict(
+            ('%s/mod%d.py' % (rng.choice(['tests', 'legacy', 'app']), i),
+             [Block('f%d' % j, 'function', None, j, j,
+                    rng.choice([1, 5, 6, 11, 21, 31, 41]))
+              for j in range(rng.randint(0, 6))])
+            for i in range(200))
+        args = Arguments()
+        args.absolute, args.modules = 'A', 'B'
+        args.policies = self.index
+        expected = RecordingLogger()
+        checker = core.Checker(args, expected)
+        for module, blocks in results.items():
+            checker.add(module, blocks)
+        count = checker.finish()
+        self.assertTrue(any('tests/' in e for e in expected.errors))
+        self.assertFalse(any('legacy/' in e and 'module' in e
+                             for e in expected.errors))
+        for backend in ['python'] + (['numpy'] if evaluation.has_numpy()
+                                     else []):
+            logger = RecordingLogger()
+            table = evaluation.BlockTable.from_results(results)
+            self.assertEqual(evaluation.evaluate(table, args, logger,
+                                                 backend=backend), count)
+            self.assertEqual(logger.errors, expected.errors)
+
+    def test_config_file(self):
+        root = tempfile.mkdtemp()
+        try:
+            config = os.path.join(root, '.xenon.yml')
+            with open(config, 'w') as fobj:
+                fobj.write('policies:\n  - path: xenon/core.py\n'
+                           '    max_absolute: F\n')
+            argv = sys.argv
+            sys.argv = ['xenon', 'xenon', '-b', 'B', '-c', config]
+            try:
+                args = parse_args()
+            finally:
+                sys.argv = argv
+            self.assertEqual(args.policies.resolve(
+                'xenon/core.py', policy.Policy('B')).absolute, 'F')
+        finally:
+            shutil.rmtree(root)
+
+
+class BaselineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'baseline')
+        self.results = {
+            'a.py': [Block('f', 'function', None, 1, 9, 12),
+                     Block('m', 'method', 'C', 10, 12, 2)],
+            'b.py': [Block('g', 'function', None, 1, 9, 25)],
+            'broken.py': {'error': 'invalid syntax'},
+        }
+        self.args = Args('A', 'A', 'A', None, False)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def infractions(self, results):
+        baseline.save(self.path, self.results)
+        logger = RecordingLogger()
+        with baseline.Baseline.open(self.path) as base:
+            count = core.find_infractions(self.args, logger, results,
+                                          baseline=base)
+        self.assertEqual(count, len(logger.errors))
+        return logger.errors
+
+    def test_lookup(self):
+        results = dict(('mod%d.py' % i, [Block('f%d' % j, 'function', None,
+                                               j, j, i % 30 + 1)
+                                         for j in range(20)])
+                       for i in range(500))
+        baseline.save(self.path, results)
+        with baseline.Baseline.open(self.path) as base:
+            self.assertEqual(len(base), 500 * 21 + 1)
+            for module, blocks in results.items():
+                for block in blocks:
+                    self.assertEqual(base.get(baseline.block_key(module,
+                                                                 block)),
+                                     block.rank)
+            self.assertIsNone(base.get(b'mod1.py\0g'))
+            self.assertEqual(base.get(baseline.module_key('mod2.py')), 'A')
+
+    def test_unchanged(self):
+        self.assertEqual(self.infractions(self.results), [])
+
+    def test_worse_and_new(self):
+        results = dict(self.results)
+        results['a.py'] = [Block('f', 'function', None, 1, 9, 12),
+                           Block('m', 'method', 'C', 10, 12, 11),
+                           Block('m', 'method', 'D', 14, 19, 2)]
+        results['b.py'] = [Block('g', 'function', None, 1, 9, 35)]
+        results['c.py'] = [Block('h', 'function', None, 1, 9, 6)]
+        self.assertEqual(self.infractions(results), [
+            'block "a.py:10 m" has a rank of C',
+            'block "b.py:1 g" has a rank of E',
+            "module 'b.py' has a rank of E",
+            'block "c.py:1 h" has a rank of B',
+            "module 'c.py' has a rank of B",
+        ])
+
+    def test_averagenum(self):
+        # The baseline tolerates the rank of the average, not its value
+        self.args = Args(None, None, None, 1.5, False)
+        self.assertEqual(self.infractions(self.results),
+                         ['total average complexity is 13.0'])
+
+    def test_invalid(self):
+        with open(self.path, 'wb') as fobj:
+            fobj.write(b'not a baseline')
+        self.assertRaises(baseline.BaselineError, baseline.Baseline.open,
+                          self.path)
+
+    def test_commands(self):
+        args = Arguments()
+        args.url, args.absolute, args.modules = None, 'A', 'A'
+        args.baseline = self.path
+        args.update_baseline = True
+        self.assertRaises(SystemExit, main, args)
+        self.assertTrue(os.path.isfile(self.path))
+        logger = RecordingLogger()
+        args.update_baseline = False
+        self.assertEqual(core.analyze(args, logger, False), (0, {}))
+        args.baseline = os.path.join(self.root, 'missing')
+        logger = RecordingLogger()
+        self.assertTrue(core.analyze(args, logger, False)[0] > 0)
+        self.assertEqual(len(logger.warnings), 1)
+
+    def test_update_with_format(self):
+        argv = sys.argv
+        sys.argv = ['xenon', '.', '--baseline', self.path,
+                    '--update-baseline', '--format', 'json']
+        try:
+            with open(os.devnull, 'w') as devnull:
+                stderr, sys.stderr = sys.stderr, devnull
+                try:
+                    self.assertRaises(SystemExit, parse_args)
+                finally:
+                    sys.stderr = stderr
+        finally:
+            sys.argv = argv
+
+    def test_unchecked(self):
+        args = Arguments()
+        args.absolute, args.fail_fast = 'A', True
+        args.policies = policy.PolicyIndex([{'path': 'a.py',
+                                             'max_absolute': 'F'}])
+        args.format = ['json']
+        unchecked = baseline.Unchecked(args)
+        self.assertIsNone(unchecked.absolute)
+        self.assertIsNone(unchecked.format)
+        self.assertIsNone(unchecked.policies)
+        self.assertFalse(unchecked.fail_fast)
+
+
+class ServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write('a.py', 'def f(x):\n    return x\n')
+        self.write('b.py', self.complex_function('g'))
+
+    def complex_function(self, name):
+        return 'def %s(x):\n%s    return x\n' % (
+            name, ''.join('    if x == %d:\n        x += 1\n' % i
+                          for i in range(6)))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, source):
+        with open(os.path.join(self.root, name), 'w') as fobj:
+            fobj.write(source)
+        # Make sure the modification is visible to the polling watcher
+        os.utime(os.path.join(self.root, name),
+                 (0, os.path.getmtime(os.path.join(self.root, name)) + 1))
+
+    def check(self, workspace, args):
+        expected = core.find_infractions(
+            args, CatchAll(), core.harvest([self.root], core.Config()))
+        response = workspace.query(dict(args._asdict()))
+        self.assertEqual(response['infractions'], expected)
+        return expected
+
+    def run_workspace(self, watcher):
+        workspace = server.Workspace([self.root], core.Config(),
+                                     watcher=watcher)
+        self.assertEqual(workspace.analyzed, 2)
+        args = Args('A', None, None, None, False)
+        self.assertEqual(self.check(workspace, args), 1)
+        self.write('a.py', self.complex_function('f'))
+        self.write('c.py', self.complex_function('h'))
+        self.assertEqual(self.check(workspace, args), 3)
+        self.assertEqual(workspace.analyzed, 4)
+        os.remove(os.path.join(self.root, 'b.py'))
+        self.assertEqual(self.check(workspace, args), 2)
+
+    def test_polling(self):
+        self.run_workspace(watch.PollingWatcher())
+
+    @unittest.skipUnless(sys.platform.startswith('linux'), 'inotify only')
+    def test_inotify(self):
+        self.run_workspace(watch.InotifyWatcher([self.root]))
+
+    def test_paths(self):
+        workspace = server.Workspace([self.root], core.Config(),
+                                     watcher=watch.PollingWatcher())
+        paths = [os.path.abspath(os.path.join(self.root, 'b.py'))]
+        self.assertEqual(list(workspace.results(paths)),
+                         [os.path.join(self.root, 'b.py')])
+
+    def test_policies(self):
+        workspace = server.Workspace([self.root], core.Config(),
+                                     watcher=watch.PollingWatcher())
+        request = {'absolute': 'A', 'cwd': self.root,
+                   'policies': [{'path': 'b.py', 'max_absolute': 'F'}]}
+        self.assertEqual(workspace.query(request)['infractions'], 0)
+        request['cwd'] = os.path.dirname(self.root)
+        self.assertEqual(workspace.query(request)['infractions'], 1)
+
+    def test_outside(self):
+        workspace = server.Workspace([os.path.join(self.root, 'a.py')],
+                                     core.Config(),
+                                     watcher=watch.PollingWatcher())
+        request = {'absolute': 'A',
+                   'paths': [os.path.join(self.root, 'b.py')]}
+        self.assertRaises(ValueError, workspace.query, request)
+
+    def test_client_names(self):
+        workspace = server.Workspace([self.root], core.Config(),
+                                     watcher=watch.PollingWatcher())
+        os.mkdir(os.path.join(self.root, 'sub'))
+        name = '..'
+        response = workspace.query({'absolute': 'A', 'paths': [self.root],
+                                    'names': [name]})
+        oldwd = os.getcwd()
+        os.chdir(os.path.join(self.root, 'sub'))
+        try:
+            # A cold run from the directory of the client
+            logger = RecordingLogger()
+            core.find_infractions(Args('A', None, None, None, False), logger,
+                                  core.harvest([name], core.Config()))
+        finally:
+            os.chdir(oldwd)
+        self.assertEqual([m for _, m in response['messages']],
+                         logger.errors)
+        self.assertIn(os.path.join(name, 'b.py'), logger.errors[0])
+
+    def test_unreachable(self):
+        args = Arguments()
+        args.url, args.path, args.absolute = None, [self.root], 'A'
+        args.server = os.path.join(self.root, 'missing.sock')
+        with open(os.devnull, 'w') as devnull:
+            stderr, sys.stderr = sys.stderr, devnull
+            try:
+                with self.assertRaises(SystemExit) as cm:
+                    main(args)
+            finally:
+                sys.stderr = stderr
+        self.assertEqual(cm.exception.code, 2)
+
+    def test_config(self):
+        workspace = server.Workspace([self.root], core.Config(),
+                                     watcher=watch.PollingWatcher())
+        request = {'absolute': 'A', 'exclude': None, 'ignore': '',
+                   'no_assert': False}
+        self.assertEqual(workspace.query(request)['infractions'], 1)
+        request['no_assert'] = True
+        self.assertRaises(ValueError, workspace.query, request)
+
+    def test_incompatible_options(self):
+        argv = sys.argv
+        sys.argv = ['xenon', self.root, '--server', 'sock', '--fail-fast']
+        try:
+            with open(os.devnull, 'w') as devnull:
+                stderr, sys.stderr = sys.stderr, devnull
+                try:
+                    self.assertRaises(SystemExit, parse_args)
+                finally:
+                    sys.stderr = stderr
+        finally:
+            sys.argv = argv
+
+    def test_command_named_path(self):
+        oldwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            os.mkdir('history')
+            # Not a subcommand: it returns instead of exiting
+            self.assertIsNone(run_command(['history']))
+        finally:
+            os.chdir(oldwd)
+
+    def test_socket(self):
+        address = os.path.join(self.root, 'xenon.sock')
+        workspace = server.Workspace([self.root], core.Config(),
+                                     watcher=watch.PollingWatcher())
+        srv = server.Server(address, workspace)
+        thread = threading.Thread(target=srv.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        try:
+            args = Arguments()
+            args.server, args.path, args.absolute = address, [self.root], 'A'
+            logger = RecordingLogger()
+            self.assertEqual(server.check(args, logger), 1)
+            self.assertEqual(server.query(address, {'command': 'stop'}),
+                             {'stopped': True})
+        finally:
+            thread.join(5)
+            srv.server_close()
+        self.assertEqual(len(logger.errors), 1)
+
+
+class RepositoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.git('init', '-q')
+        self.git('checkout', '-q', '-b', 'feature')
+        with open(os.path.join(self.root, 'a.py'), 'w') as fobj:
+            fobj.write('x = 1\n')
+        self.git('add', 'a.py')
+        self.git('commit', '-q', '-m', 'First line\nsecond line\n\nBody')
+        self.git('remote', 'add', 'origin', 'https://example.com/repo.git')
+        repository.Repository._repositories.clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        repository.Repository._repositories.clear()
+
+    def git(self, *args):
+        return repository.git('-c', 'user.name=Some One',
+                              '-c', 'user.email=one@example.com', *args,
+                              cwd=self.root)
+
+    def expected(self):
+        return repository.read_head(self.root)
+
+    def test_gitrepo(self):
+        oldwd = os.getcwd()
+        data = repository.gitrepo(os.path.join(self.root, 'a.py'))
+        self.assertEqual(os.getcwd(), oldwd)
+        self.assertEqual(data['head'], self.expected())
+        self.assertEqual(data['head']['message'], 'First line second line')
+        self.assertEqual(data['head']['author_name'], 'Some One')
+        self.assertEqual(data['branch'], 'feature')
+        self.assertEqual(data['remotes'], [
+            {'name': 'origin', 'url': 'https://example.com/repo.git'}])
+
+    def test_encoding(self):
+        message = os.path.join(self.root, 'message')
+        with open(message, 'wb') as fobj:
+            fobj.write(u'caf\xe9\n'.encode('latin-1'))
+        self.git('-c', 'i18n.commitEncoding=latin-1', 'commit', '-q',
+                 '--allow-empty', '-F', message)
+        head = repository.gitrepo(self.root)['head']
+        self.assertEqual(head['message'], u'caf\xe9')
+        self.assertEqual(head, self.expected())
+
+    def test_packed(self):
+        self.git('gc', '-q')
+        self.assertFalse(os.path.exists(os.path.join(self.root, '.git',
+                                                     'refs', 'heads',
+                                                     'feature')))
+        self.assertEqual(repository.gitrepo(self.root)['head'],
+                         self.expected())
+
+    def test_detached(self):
+        self.git('checkout', '-q', '--detach')
+        data = repository.gitrepo(self.root)
+        self.assertEqual(data['branch'], 'HEAD')
+        self.assertEqual(data['head'], self.expected())
+
+    def test_memoized(self):
+        repository.gitrepo(self.root)
+        repo = repository.Repository.open(os.path.join(self.root, 'a.py'))
+        self.assertEqual(repo.worktree, self.root)
+        self.assertEqual(len(repo._commits), 1)
+        old_git = repository.git
+        repository.git = None
+        try:
+            data = repository.gitrepo(self.root)
+        finally:
+            repository.git = old_git
+        self.assertEqual(data['head'], self.expected())
+
+    def test_no_repository(self):
+        shutil.rmtree(os.path.join(self.root, '.git'))
+        self.assertRaises(subprocess.CalledProcessError,
+                          repository.gitrepo, self.root)
+
+
+class HistoryTestCase(unittest.TestCase):
+
+    files = [
+        {'a.py': 'def f(x):\n    return x\n', 'b.py': 'x = 1\n'},
+        {'b.py': 'def g(x):\n' + '    if x:\n        return 1\n' * 5},
+        {'c.py': 'def f(x):\n    return x\n', 'a.py': None},
+        {'pkg/d.py': 'def h(:\n', 'c.py': 'def f(x):\n    return x\n'},
+    ]
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.git('init', '-q')
+        for i, files in enumerate(self.files):
+            for name, source in files.items():
+                path = os.path.join(self.root, name)
+                if source is None:
+                    os.remove(path)
+                    continue
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'w') as fobj:
+                    fobj.write(source)
+            self.git('add', '-A')
+            # Commits without changes are kept in the series
+            self.git('commit', '-q', '--allow-empty', '-m', 'commit %d' % i)
+        self.args = Args('A', 'A', 'A', None, False)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def git(self, *args):
+        return repository.git('-c', 'user.name=Some One',
+                              '-c', 'user.email=one@example.com', *args,
+                              cwd=self.root)
+
+    def series(self, rev_range, cache=None):
+        return list(history.history(rev_range, self.root, core.Config(),
+                                    self.args, cache=cache))
+
+    def test_catfile(self):
+        sha = self.git('rev-parse', 'HEAD:c.py').strip()
+        with repository.CatFile(self.root) as cat_file:
+            self.assertEqual(cat_file.read(sha), b'def f(x):\n    return x\n')
+            self.assertRaises(KeyError, cat_file.read, '0' * 40)
+
+    def test_series(self):
+        points = self.series('HEAD')
+        self.assertEqual([p['subject'] for p in points],
+                         ['commit %d' % i for i in range(4)])
+        self.assertEqual([(p['modules'], p['blocks'], p['average'])
+                          for p in points],
+                         [(1, 1, 1), (2, 2, 3.5), (2, 2, 3.5), (2, 2, 3.5)])
+        self.assertEqual(points[0]['ranks'], {'a.py': 'A', 'b.py': 'A'})
+        self.assertEqual(points[2]['ranks'], {'a.py': None, 'c.py': 'A'})
+        # The module which cannot be parsed has no rank
+        self.assertEqual(points[3]['ranks'], {'pkg/d.py': None})
+        # g and b.py have a rank of B
+        self.assertEqual([p['infractions'] for p in points], [0, 2, 2, 2])
+
+    def test_range(self):
+        points = self.series('HEAD~2..HEAD')
+        self.assertEqual(len(points), 2)
+        # The first point lists the modules inherited from the parent
+        self.assertEqual(sorted(points[0]['ranks']),
+                         ['a.py', 'b.py', 'c.py'])
+        self.assertEqual(points[0]['blocks'], 2)
+
+    def test_unique_blobs(self):
+        root = tempfile.mkdtemp()
+        try:
+            cache = ResultCache(root)
+            self.series('HEAD', cache)
+            # f is the same blob in a.py and c.py
+            self.assertEqual(len(list(cache.entries())), 4)
+        finally:
+            shutil.rmtree(root)
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    '''Store the decoded bodies of the requests, answering with the
+    statuses queued in ``server.statuses`` (200 when there are none).'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+            if not size:
+                break
+        body = b''.join(chunks)
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        self.server.requests.append((self.client_address, body))
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        reply = b'{"message": "ok"}'
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, *args):
+        pass
+
+
+class RecordingServer(ThreadingMixIn, HTTPServer):
+    # Connections are kept alive, so each one needs its own thread
+    daemon_threads = True
+
+
+class HotspotsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.oldwd = os.getcwd()
+        self.root = tempfile.mkdtemp()
+        os.chdir(self.root)
+        self.git('init', '-q')
+        self.commit({'a.py': 'def f(x):\n    return x\n',
+                     'b.py': 'def g(x):\n' + '    if x: pass\n' * 5})
+        self.commit({'a.py': 'def f(x):\n' + '    if x: pass\n' * 2})
+        self.commit({'a.py': 'def f(x):\n' + '    if x: pass\n' * 3,
+                     'data.bin': '\0\1\2',
+                     'sp ace.py': 'def h():\n    pass\n'})
+        # Never committed
+        self.write('new.py', 'def k(x):\n    return x and 1\n')
+
+    def tearDown(self):
+        os.chdir(self.oldwd)
+        shutil.rmtree(self.root)
+
+    def git(self, *args):
+        repository.git('-c', 'user.name=x', '-c', 'user.email=x@x', *args)
+
+    def write(self, name, source):
+        with open(name, 'w') as fobj:
+            fobj.write(source)
+
+    def commit(self, files):
+        for name, source in files.items():
+            self.write(name, source)
+        self.git('add', '.')
+        self.git('commit', '-q', '-m', 'commit')
+
+    def test_numstat(self):
+        changes = sorted(repository.iter_numstat(chunk_size=7))
+        self.assertEqual(changes, [('a.py', 1, 0), ('a.py', 2, 0),
+                                   ('a.py', 2, 1), ('b.py', 6, 0),
+                                   ('data.bin', None, None),
+                                   ('sp ace.py', 2, 0)])
+        self.assertEqual(list(repository.iter_numstat(paths=['b.py'])),
+                         [('b.py', 6, 0)])
+
+    def test_ranking(self):
+        spots = hotspots.hotspots(['.'], core.Config())
+        self.assertEqual([(s.module, s.block['name'], s.commits, s.score)
+                          for s in spots],
+                         [('a.py', 'f', 3, 12), ('b.py', 'g', 1, 6),
+                          ('sp ace.py', 'h', 1, 1)])
+        self.assertEqual(spots[0].lines, 6)
+        spots = hotspots.hotspots(['.'], core.Config(), top=1)
+        self.assertEqual([s.module for s in spots], ['a.py'])
+        spots = hotspots.hotspots(['.'], core.Config(), rev='HEAD~1')
+        self.assertEqual([(s.module, s.commits) for s in spots],
+                         [('a.py', 2), ('b.py', 1)])
+
+    def test_bounded_heap(self):
+        rng = random.Random(0)
+        results = [('m%d.py' % i, [Block('f%d' % j, 'function', None, j, j,
+                                         rng.randint(1, 12))
+                                   for j in range(rng.randint(0, 5))])
+                   for i in range(300)]
+        churn = dict((module, [rng.randint(0, 4), 0])
+                     for module, _ in results)
+        everything = [(block['complexity'] * churn[module][0], module,
+                       block['name'])
+                      for module, blocks in results for block in blocks
+                      if churn[module][0]]
+        # sorted() is stable: equal scores keep the order of the results
+        everything.sort(key=lambda spot: -spot[0])
+        for top in (0, 1, 10, 5000):
+            spots = hotspots.rank_hotspots(results, churn, top)
+            self.assertEqual([(s.score, s.module, s.block['name'])
+                              for s in spots], everything[:top])
+
+    def test_main(self):
+        path = os.path.join(self.root, 'out.json')
+        self.assertEqual(hotspots.main(['-n', '2', '--json', '--no-cache',
+                                        '-o', path]), 0)
+        with open(path) as fobj:
+            report = json.load(fobj)
+        self.assertEqual([s['module'] for s in report['hotspots']],
+                         ['a.py', 'b.py'])
+        self.assertEqual(report['hotspots'][0]['rank'], 'A')
+        self.assertEqual(hotspots.main(['--rev', 'nope', '--no-cache']), 2)
+
+
+class UploadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = RecordingServer(('127.0.0.1', 0), RecordingHandler)
+        self.server.requests, self.server.statuses = [], []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/jobs' % self.server.server_port
+        self.cc_data = core.harvest(['xenon'], core.Config())
+        self.git = {'head': {'id': 'abc'}, 'branch': 'master'}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def post(self, **kwargs):
+        return api.post(self.url, 'token', '12', 'travis-ci', self.git,
+                        self.cc_data, backoff=0, **kwargs)
+
+    def expected(self):
+        return api.build_payload('token', '12', 'travis-ci', self.git,
+                                 self.cc_data).encode('utf-8')
+
+    def test_payload(self):
+        # The payload of Radon's harvester, which Xenon used to send
+        config = Config(exclude=None, ignore=None, order=SCORE,
+                        no_assert=False, show_closures=False,
+                        min='A', max='F')
+        cc_data = CCHarvester(['xenon'], config)._to_dicts()
+        self.assertEqual(
+            json.loads(api.build_payload('token', '12', 'travis-ci',
+                                         self.git, self.cc_data)),
+            json.loads(json.dumps({
+                'service_job_id': '12', 'service_name': 'travis-ci',
+                'git': self.git, 'cc_data': cc_data,
+                'repo_token': 'token'})))
+        self.assertEqual(
+            api.build_payload('token', '12', 'travis-ci', self.git,
+                              {'a.py': [Block('f', 'function', None, 1, 2,
+                                              3)]}),
+            json.dumps({'service_job_id': '12', 'service_name': 'travis-ci',
+                        'git': self.git, 'cc_data': {'a.py': [
+                            Block('f', 'function', None, 1, 2, 3)]},
+                        'repo_token': 'token'}, default=to_json))
+
+    def test_gzip_chunks(self):
+        pieces = [blob_hash(str(i).encode('ascii')) for i in range(5000)]
+        chunks = list(api.gzip_chunks(pieces, size=1024))
+        self.assertTrue(len(chunks) > 1)
+        data = gzip.GzipFile(fileobj=io.BytesIO(b''.join(chunks))).read()
+        self.assertEqual(data, b''.join(api.encode_chunks(pieces)))
+
+    def test_streamed(self):
+        for compress in (True, False):
+            response = self.post(compress=compress)
+            self.assertEqual(response.json(), {'message': 'ok'})
+        self.assertEqual([body for _, body in self.server.requests],
+                         [self.expected()] * 2)
+
+    def test_connection_reuse(self):
+        session = requests.Session()
+        for _ in range(3):
+            self.post(session=session)
+        clients = set(client for client, _ in self.server.requests)
+        self.assertEqual(len(clients), 1)
+
+    def test_retries(self):
+        self.server.statuses = [503, 502]
+        response = self.post(retries=3)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.requests[-1][1], self.expected())
+        self.server.statuses = [500, 500]
+        self.assertEqual(self.post(retries=1).status_code, 500)
+
+    def test_connection_errors(self):
+        url = self.url
+        self.tearDown()
+        self.setUp()
+        self.url = url
+        self.assertRaises(requests.ConnectionError, self.post, retries=2)
+
+
 class APITestCase(unittest.TestCase):
 
     def _exit_code(self):
@@ -8,15 +8,44 @@ import os
 import sys
 import logging
 
+#: The subcommands, mapped to the modules implementing them. Every module has
+#: a ``main(argv)`` function returning the exit code.
+COMMANDS = {
+    'batch': 'xenon.batch',
+    'diff': 'xenon.snapshot',
+    'history': 'xenon.history',
+    'hotspots': 'xenon.hotspots',
+    'serve': 'xenon.server',
+}
+
+
+#: The formats accepted by ``--output-format``: ``log`` only logs the
+#: infractions.
+OUTPUT_FORMATS = ('log', 'snapshot')
+
+#: The options which have no effect when the server checks the thresholds
+#: (the exclude and ignore patterns and --no-assert are checked by the
+#: server instead).
+SERVER_INCOMPATIBLE = (
+    ('baseline', '--baseline'),
+    ('format', '--format'),
+    ('diff_base', '--diff-base'),
+    ('staged', '--staged'),
+    ('fail_fast', '--fail-fast'),
+    ('gitignore', '--gitignore'),
+    ('url', '--url'),
+)
+
 
 def parse_args():
     '''Parse arguments from the command line and read the config file (for the
     REPO_TOKEN value).
     '''
-    import yaml
     import argparse
 
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(
+        epilog='Other commands (run `xenon <command> -h` for help): ' +
+        ', '.join(sorted(COMMANDS)))
     parser.add_argument('-v', '--version', action='version',
                         version=__version__)
     parser.add_argument('path', help='Directory containing source files to '
@@ -36,31 +65,141 @@ def parse_args():
                         help='Comma separated list of patterns to ignore. If '
                         'they are directories, Xenon won\'t even descend into '
                         'them')
+    parser.add_argument('--gitignore', dest='gitignore', action='store_true',
+                        help='Skip the files ignored by Git (uses git '
+                        'ls-files)')
     parser.add_argument('-u', '--url', metavar='<URL>', dest='url',
                         help='Where to send the JSON data through a POST '
                         'request.')
+    parser.add_argument('--upload-timeout', metavar='<float>',
+                        dest='upload_timeout', type=float, default=30.,
+                        help='Seconds to wait for the server when sending the '
+                        'data (default: %(default)s)')
+    parser.add_argument('--upload-retries', metavar='<int>',
+                        dest='upload_retries', type=int, default=3,
+                        help='How many times to send the data again if the '
+                        'server cannot be reached or fails (default: '
+                        '%(default)s)')
+    parser.add_argument('--no-compress', dest='no_compress',
+                        action='store_true', help='Do not compress the data '
+                        'sent to the server')
     parser.add_argument('--no-assert', dest='no_assert', action='store_true',
                         help='Do not count `assert` statements when computing '
                         'complexity')
     parser.add_argument('-c', '--config-file', metavar='<path>', dest='config',
                         default='.xenon.yml', help='Xenon config file '
                         '(default: %(default)s)')
+    parser.add_argument('--output-format', dest='output_format',
+                        choices=OUTPUT_FORMATS, default='log',
+                        help='Besides logging the infractions, write the '
+                        'results in this format (default: %(default)s)')
+    parser.add_argument('-o', '--output', metavar='<path>', dest='output',
+                        help='Where to write the results when an output '
+                        'format is given')
+    parser.add_argument('--format', metavar='<name[:path]>', dest='format',
+                        action='append', help='Also report the infractions in '
+                        'this format (json, sarif, junit or github), to the '
+                        'given path or to the standard output. Can be '
+                        'repeated, all the reports come from the same '
+                        'analysis')
     parser.add_argument('--paths-in-front', dest='paths_in_front', action='store_true',
                         help='Print block and module complexity with log line starting with their path')
+    parser.add_argument('-j', '--jobs', metavar='<int>', dest='jobs', type=int,
+                        default=1, help='Number of processes used to analyze '
+                        'the files, 0 means one per CPU (default: '
+                        '%(default)s)')
+    parser.add_argument('--readers', metavar='<int>', dest='readers',
+                        type=int, default=4, help='Number of threads reading '
+                        'the files ahead of the analysis when a single '
+                        'process is used, 0 disables them (default: '
+                        '%(default)s)')
+    parser.add_argument('--cache-dir', metavar='<path>', dest='cache_dir',
+                        default='.xenon_cache', help='Directory where the '
+                        'results of unchanged files are cached (default: '
+                        '%(default)s)')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                        help='Do not read nor write the results cache')
+    parser.add_argument('--block-cache', dest='block_cache',
+                        action='store_true', help='Also cache the blocks of '
+                        'every top-level function and class, so that only the '
+                        'edited ones are analyzed again in changed files')
+    parser.add_argument('--block-cache-size', metavar='<int>',
+                        dest='block_cache_size', type=int, default=50000,
+                        help='Number of functions and classes kept in the '
+                        'block cache (default: %(default)s)')
+    parser.add_argument('--diff-base', metavar='<ref>', dest='diff_base',
+                        help='Check the block and module thresholds only on '
+                        'the files changed with respect to this Git revision')
+    parser.add_argument('--staged', dest='staged', action='store_true',
+                        help='Only check the Python files staged for the next '
+                        'commit below the given paths, as they are in the Git '
+                        'index rather than on disk')
+    parser.add_argument('--fail-fast', dest='fail_fast', action='store_true',
+                        help='Stop at the first module with an infraction')
+    parser.add_argument('--timings', metavar='<int>', dest='timings',
+                        type=int, nargs='?', const=10, help='Report the time '
+                        'spent in every stage and the slowest files (10 by '
+                        'default)')
+    parser.add_argument('--profile', metavar='<path>', dest='profile',
+                        help='Profile the run with cProfile and write the '
+                        'statistics to this file, to be read with pstats')
+    parser.add_argument('--legacy-harvester', dest='legacy_harvester',
+                        action='store_true', help='Analyze the files through '
+                        'Radon\'s harvester, like older versions did: slower, '
+                        'only meant for comparisons')
+    parser.add_argument('--stats', dest='stats', action='store_true',
+                        help='Report the 50th, 90th and 99th percentiles of '
+                        'the complexity and the number of blocks of every '
+                        'rank')
+    parser.add_argument('--max-memory', metavar='<MB>', dest='max_memory',
+                        type=float, help='Keep at most this many megabytes of '
+                        'results in memory for the upload, the snapshot or '
+                        'the baseline, writing the rest to a temporary file, '
+                        'and report the peak memory used')
+    parser.add_argument('--baseline', metavar='<path>', dest='baseline',
+                        help='Only report the blocks and modules which are '
+                        'new or got worse since this baseline was written')
+    parser.add_argument('--update-baseline', dest='update_baseline',
+                        action='store_true', help='Write the current results '
+                        'to the --baseline file instead of checking them')
+    parser.add_argument('--server', metavar='<socket>', dest='server',
+                        help='Ask the `xenon serve` process listening on this '
+                        'socket to check the thresholds, instead of '
+                        'analyzing the files')
 
     args = parser.parse_args()
+    if args.update_baseline and not args.baseline:
+        parser.error('--update-baseline requires --baseline')
+    if args.update_baseline and args.format:
+        parser.error('--update-baseline cannot be used with --format')
+    if args.staged and args.diff_base:
+        parser.error('--staged cannot be used with --diff-base')
+    if args.server:
+        for dest, option in SERVER_INCOMPATIBLE:
+            if getattr(args, dest):
+                parser.error('--server cannot be used with %s' % option)
+        if args.output_format != 'log':
+            parser.error('--server cannot be used with --output-format')
+    if args.format:
+        from xenon.reporters import REPORTERS, parse_format
+        for value in args.format:
+            if parse_format(value)[0] not in REPORTERS:
+                parser.error('unknown format %r, choose among %s' % (
+                    value, ', '.join(sorted(REPORTERS))))
     # normalize the rank
     for attr in ('absolute', 'modules', 'average'):
         val = getattr(args, attr, None)
         if val is None:
             continue
         setattr(args, attr, val.upper())
-    try:
-        with open(args.config, 'r') as f:
-            yml = yaml.safe_load(f)
-    except (getattr(__builtins__, 'FileNotFoundError', IOError),
-            yaml.YAMLError):
-        yml = {}
+    yml = load_config(args.config)
+    args.policies = None
+    if yml.get('policies'):
+        from xenon.policy import PolicyIndex, PolicyError
+        try:
+            args.policies = PolicyIndex(yml['policies'])
+        except PolicyError as e:
+            parser.error('%s: %s' % (args.config, e))
     args.repo_token = yml.get('repo_token',
                               os.environ.get('BARIUM_REPO_TOKEN', ''))
     args.service_name = yml.get('service_name', 'travis-ci')
@@ -68,15 +207,69 @@ def parse_args():
     return args
 
 
+def load_config(path):
+    '''Load the YAML config file at *path*. If it does not exist, an empty
+    dictionary is returned without even importing the YAML parser.'''
+    if not os.path.isfile(path):
+        return {}
+    import yaml
+
+    try:
+        with open(path, 'r') as f:
+            return yaml.safe_load(f) or {}
+    except (IOError, yaml.YAMLError):
+        return {}
+
+
 def main(args=None):
     '''Entry point for the command line program. ``sys.exit`` is called at the
-    end.
+    end. The exit code is 2 if Git cannot tell which files to analyze, e.g.
+    when ``--diff-base`` is not a valid revision, or if the server given with
+    ``--server`` cannot answer.
     '''
-    from xenon.api import post
-    from xenon.core import analyze
-    from xenon.repository import gitrepo
+    import subprocess
+    from xenon.timings import Timings, NullTimings
 
+    if args is None:
+        run_command(sys.argv[1:])
     args = args or parse_args()
+    logger = setup_logging(args)
+    if args.url and len(args.path) > 1:
+        logger.error(
+            '-u, --url cannot be used when multiple paths are specified',
+        )
+        sys.exit(1)
+    if getattr(args, 'server', None):
+        from xenon.server import check
+        try:
+            infractions = check(args, logger)
+        except (RuntimeError, OSError, ValueError) as e:
+            logger.error('cannot query the server: %s', e)
+            sys.exit(2)
+        sys.exit(1 if infractions else 0)
+    profile = getattr(args, 'profile', None)
+    profiler = start_profiler() if profile else None
+    show_timings = getattr(args, 'timings', None)
+    timings = Timings() if show_timings is not None else NullTimings()
+    try:
+        with timings.stage('total'):
+            errors, exit_code = run(args, logger, timings)
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error('cannot analyze the files: %s', e)
+        sys.exit(2)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(profile)
+        logger.info('profile written to %s', profile)
+    if show_timings is not None:
+        timings.log(logger, show_timings)
+    if errors:
+        exit_code = 1
+    sys.exit(exit_code)
+
+
+def setup_logging(args):
+    '''Configure the logging as requested by *args* and return the logger.'''
     if args.paths_in_front:
         # Skip the level and module name to have log line starting with message
         # When using xenon in PyCharm terminal, one can benefit from
@@ -84,27 +277,110 @@ def main(args=None):
         logging.basicConfig(level=logging.INFO, format='%(message)s')
     else:
         logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger('xenon')
-    if args.url and len(args.path) > 1:
-        logger.error(
-            '-u, --url cannot be used when multiple paths are specified',
-        )
-        sys.exit(1)
-    errors, cc_data = analyze(args, logger)
+    return logging.getLogger('xenon')
+
+
+def run(args, logger, timings):
+    '''Analyze the files, then write and send the results as requested by
+    *args*. Return the number of infractions and the exit code of the
+    upload.'''
+    from xenon.core import analyze
+
+    if getattr(args, 'update_baseline', False):
+        from xenon.baseline import update
+        update(args, logger, timings)
+        return 0, 0
+    output_format = getattr(args, 'output_format', 'log')
+    stats = getattr(args, 'stats', False)
+    # The results are only needed in memory when they have to be sent,
+    # written or summarized
+    errors, cc_data = analyze(args, logger, timings=timings,
+                              keep_results=bool(args.url) or stats or
+                              output_format != 'log')
     exit_code = 0
-    if args.url:
+    try:
+        if stats:
+            from xenon.evaluation import log_stats
+            log_stats(logger, cc_data)
+        if output_format != 'log':
+            write_output(args, logger, cc_data, timings)
+        if args.url:
+            exit_code = upload(args, logger, cc_data, timings)
+    finally:
+        # Results spilled to disk (see --max-memory) live in a temporary file
+        if hasattr(cc_data, 'close'):
+            cc_data.close()
+    if getattr(args, 'max_memory', None):
+        log_peak_memory(logger, args.max_memory)
+    return errors, exit_code
+
+
+def log_peak_memory(logger, max_memory):
+    '''Log the peak memory used by the process, and the budget of the results
+    in megabytes.'''
+    from xenon.timings import peak_rss
+
+    peak = peak_rss()
+    if peak is not None:
+        logger.info('peak memory: %.1fMB (results limited to %sMB)',
+                    peak / 1024. / 1024, max_memory)
+
+
+def run_command(argv):
+    '''If *argv* starts with one of the :data:`COMMANDS`, run it and exit.
+    An existing path named like a command is analyzed instead.'''
+    if argv and argv[0] in COMMANDS and not os.path.exists(argv[0]):
+        import importlib
+
+        module = importlib.import_module(COMMANDS[argv[0]])
+        sys.exit(module.main(argv[1:]))
+
+
+def write_output(args, logger, cc_data, timings):
+    '''Write *cc_data* in the format selected by *args*, to ``args.output``
+    or to the standard output.'''
+    from xenon.snapshot import save, write
+
+    with timings.stage('output'):
+        if args.output:
+            save(args.output, cc_data)
+            logger.info('results written to %s', args.output)
+        else:
+            write(getattr(sys.stdout, 'buffer', sys.stdout), cc_data)
+
+
+def upload(args, logger, cc_data, timings):
+    '''Send *cc_data* to the URL specified in *args*. The exit code is
+    returned.'''
+    from xenon.api import post, DEFAULT_TIMEOUT, DEFAULT_RETRIES
+    from xenon.repository import gitrepo
+
+    with timings.stage('git'):
+        git = gitrepo(args.path[0])
+    with timings.stage('upload'):
         response = post(
             url=args.url,
             repo_token=args.repo_token,
             service_job_id=args.service_job_id,
             service_name=args.service_name,
-            git=gitrepo(args.path[0]),
-            cc_data=cc_data
+            git=git,
+            cc_data=cc_data,
+            timeout=getattr(args, 'upload_timeout', DEFAULT_TIMEOUT),
+            retries=getattr(args, 'upload_retries', DEFAULT_RETRIES),
+            compress=not getattr(args, 'no_compress', False),
         )
-        logger.info('HTTP: %s', response.status_code)
-        logger.info('HTTP: %s', response.text)
-        if 'error' in response.json():
-            exit_code = 3
-    if errors:
-        exit_code = 1
-    sys.exit(exit_code)
+    logger.info('HTTP: %s', response.status_code)
+    logger.info('HTTP: %s', response.text)
+    if 'error' in response.json():
+        return 3
+    return 0
+
+
+def start_profiler():
+    '''Start and return a :class:`cProfile.Profile` object. Only the main
+    process is profiled.'''
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
@@ -0,0 +1,243 @@
+'''This module is the programmatic interface of Xenon.
+
+:func:`~xenon.core.analyze` takes command line arguments and logs the
+infractions, and every call pays again for the settings, the patterns, the
+caches and the worker processes. An :class:`Analyzer` sets all of them up
+once and keeps them across calls, so a single process can check many trees
+or snippets one after the other::
+
+    from xenon.analyzer import Analyzer
+
+    with Analyzer(absolute='B', modules='A', average='A', jobs=4) as xenon:
+        report = xenon.check(['src'])
+        report = xenon.check(sources=[('snippet.py', source)])
+        for infraction in report.infractions:
+            print(infraction.module, infraction.message)
+
+Nothing is logged: :meth:`Analyzer.check` returns a :class:`Report`, with
+the blocks of every module and the infractions as
+:class:`~xenon.reporters.Infraction` objects. The modules analyzed are
+remembered by the hash of their content, so unchanged files and snippets are
+not analyzed again by later calls.
+'''
+
+import itertools
+import collections
+
+from xenon.blocks import to_dicts
+from xenon.cache import ResultCache, SegmentCache, blob_hash
+from xenon.core import Config, Checker, map_files, resolve_jobs
+from xenon.prefetch import DEFAULT_READERS, prefetch
+from xenon.reporters import Reporter
+
+#: Default number of modules whose results are kept in memory.
+DEFAULT_MAX_MODULES = 10000
+
+
+class Report(object):
+    '''The outcome of :meth:`Analyzer.check`.
+
+    :attr:`results` maps the modules to the list of their blocks, as
+    :class:`~xenon.blocks.Block` objects, in the order they were analyzed,
+    while :attr:`errors` maps the modules which cannot be parsed to the
+    error message. :attr:`infractions` holds the
+    :class:`~xenon.reporters.Infraction` objects, module after module and
+    then the ones of the average complexity. The blocks are shared with later
+    reports, and must not be modified.
+    '''
+
+    def __init__(self, results, errors, infractions, summary):
+        self.results = results
+        self.errors = errors
+        self.infractions = infractions
+        #: The number of blocks analyzed.
+        self.blocks = summary['blocks']
+        #: The average complexity of the blocks, and its rank.
+        self.complexity = summary['complexity']
+        self.rank = summary['rank']
+
+    @property
+    def ok(self):
+        '''Whether no threshold was exceeded.'''
+        return not self.infractions
+
+    def as_dict(self):
+        '''Return the report as a JSON-serializable dictionary.'''
+        return {
+            'modules': dict((module, to_dicts(blocks))
+                            for module, blocks in self.results.items()),
+            'errors': self.errors,
+            'infractions': [i.as_dict() for i in self.infractions],
+            'summary': {'blocks': self.blocks, 'complexity': self.complexity,
+                        'rank': self.rank,
+                        'infractions': len(self.infractions)},
+        }
+
+    def __repr__(self):
+        return '<Report: %d modules, %d infractions>' % (
+            len(self.results), len(self.infractions))
+
+
+class Analyzer(object):
+    '''Analyze files and sources, and check them against the thresholds.
+
+    *absolute*, *modules* and *average* are the rank thresholds of the
+    blocks, of the modules and of the average complexity, while *averagenum*
+    is the numeric threshold of the average complexity; ``None`` means no
+    threshold. *policies* is a list of per-path rules overriding the block
+    and module thresholds, like in the configuration file (see
+    :mod:`xenon.policy`). *exclude*, *ignore*, *gitignore* and *no_assert*
+    have the same meaning as the command line options.
+
+    When *jobs* is greater than one (``0`` means one per CPU) the modules
+    are analyzed by a pool of processes, started with the first analysis
+    and kept until :meth:`close` is called. The files are read by *readers*
+    threads. The results of the last *max_modules* modules are kept in
+    memory, and if *cache_dir* is given the results are also cached there,
+    like by the command line program.
+    '''
+
+    # Not used, but Checker expects it like in the command line arguments
+    paths_in_front = False
+
+    def __init__(self, absolute=None, modules=None, average=None,
+                 averagenum=None, policies=None, exclude=None, ignore=None,
+                 no_assert=False, gitignore=False, jobs=1,
+                 readers=DEFAULT_READERS, cache_dir=None,
+                 max_modules=DEFAULT_MAX_MODULES):
+        self.absolute = _rank(absolute)
+        self.modules = _rank(modules)
+        self.average = _rank(average)
+        self.averagenum = averagenum
+        self.policies = None
+        if policies:
+            from xenon.policy import PolicyIndex
+            self.policies = PolicyIndex(policies)
+        self.config = Config(exclude, ignore, no_assert, gitignore=gitignore)
+        self.discovery = self.config.discovery()
+        self.jobs = resolve_jobs(jobs)
+        self.readers = readers
+        self.cache = None
+        if cache_dir:
+            self.cache = ResultCache(cache_dir, no_assert)
+        #: The results of the modules analyzed so far, by content hash.
+        self.memo = SegmentCache(None, max_modules)
+        self._pool = None
+
+    def analyze(self, paths=(), sources=()):
+        '''Analyze the Python files found in *paths* and the ``(filename,
+        source)`` pairs in *sources*, where *source* is text or bytes.
+        Return a dictionary mapping every module with blocks to their list,
+        or to ``{'error': message}`` if it cannot be parsed.
+
+        The files are hashed and analyzed as they are read, so only the
+        ones waiting for a worker process are held in memory.'''
+        modules = iter(sources)
+        if paths:
+            modules = itertools.chain(
+                prefetch(self.discovery.iter(paths), max(1, self.readers)),
+                modules)
+        # [name, key, blocks] for every module, in order
+        entries = []
+        missing = collections.deque()
+        tasks = self._tasks(modules, entries, missing)
+        pool = None
+        if self.jobs > 1:
+            # The pool needs all the tasks anyway
+            tasks = list(tasks)
+            pool = self.pool(len(tasks))
+        for _, blocks, _, _ in map_files(tasks, self.jobs, pool):
+            entry = missing.popleft()
+            entry[2] = blocks
+            self.memo.set(entry[1], blocks)
+        return dict((name, blocks) for name, _, blocks in entries if blocks)
+
+    def _tasks(self, modules, entries, missing):
+        '''Yield the tasks analyzing the *modules* whose results are not in
+        memory. An entry is added to *entries* for every module, and to
+        *missing* for the ones analyzed.'''
+        for name, data in modules:
+            key = blob_hash(data if isinstance(data, bytes)
+                            else data.encode('utf-8'))
+            entry = [name, key, self.memo.get(key)]
+            entries.append(entry)
+            if entry[2] is None:
+                missing.append(entry)
+                yield (name, self.config.no_assert, False,
+                       self.cache if isinstance(data, bytes) else None, data)
+
+    def check(self, paths=(), sources=()):
+        '''Analyze *paths* and *sources* like :meth:`analyze`, and check the
+        results against the thresholds. Return a :class:`Report`.'''
+        results = self.analyze(paths, sources)
+        collector = _Collector()
+        checker = Checker(self, _NullLogger(), reporters=[collector])
+        for module, blocks in results.items():
+            checker.add(module, blocks)
+        checker.finish()
+        errors = dict((module, blocks['error'])
+                      for module, blocks in results.items()
+                      if isinstance(blocks, dict))
+        for module in errors:
+            del results[module]
+        return Report(results, errors, collector.infractions,
+                      collector.summary)
+
+    def pool(self, tasks=2):
+        '''Return the pool of worker processes, starting it if needed, or
+        ``None`` if a single process is used or there are less than two
+        *tasks*.'''
+        if self.jobs < 2 or tasks < 2:
+            return None
+        if self._pool is None:
+            import multiprocessing
+            self._pool = multiprocessing.Pool(self.jobs)
+        return self._pool
+
+    def close(self):
+        '''Stop the worker processes and trim the cache directory.'''
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        if self.cache is not None:
+            self.cache.prune()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _Collector(Reporter):
+    '''A reporter keeping the infractions and the summary in memory.'''
+
+    def __init__(self):
+        Reporter.__init__(self, None)
+        self.infractions = []
+        self.summary = None
+
+    def module(self, module, blocks, infractions):
+        self.infractions.extend(infractions)
+
+    def end(self, infractions, summary):
+        Reporter.end(self, infractions, summary)
+        self.infractions.extend(infractions)
+        self.summary = summary
+
+    def close(self):
+        pass
+
+
+class _NullLogger(object):
+    '''A logger-like object discarding the messages of the checker.'''
+
+    def error(self, msg, *args):
+        pass
+
+    warning = info = error
+
+
+def _rank(value):
+    return value.upper() if value else None
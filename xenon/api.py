@@ -1,31 +1,161 @@
-'''This module contains some helper functions to communicate with an API.'''
+'''This module contains some helper functions to communicate with an API.
+
+The payload is never held in memory as a whole: it is serialized a piece at a
+time, compressed with gzip on the fly and sent with chunked transfer
+encoding. Requests go through a shared :class:`requests.Session`, so that
+connections are reused, and they are retried with exponential backoff on
+connection errors, timeouts and server errors.
+'''
 
 import json
+import time
+import zlib
+
 import requests
 
+from xenon.blocks import to_dicts, to_json
+
+#: Seconds to wait for the connection and for every read from the server.
+DEFAULT_TIMEOUT = 30.
+#: How many times a failed request is sent again.
+DEFAULT_RETRIES = 3
+#: Seconds to wait before the first retry, doubled at every attempt.
+DEFAULT_BACKOFF = .5
+#: Size of the compressed chunks sent to the server.
+CHUNK_SIZE = 64 * 1024
+
+_session = None
+
 
-def post(url, repo_token, service_job_id, service_name, git, cc_data):
+def get_session():
+    '''Return the session shared by all the requests.'''
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
+
+
+def post(url, repo_token, service_job_id, service_name, git, cc_data,
+         timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+         backoff=DEFAULT_BACKOFF, compress=True, session=None):
     '''Send a POST request to the specified url.
 
     *repo_token* is the repository token. It can be ``None``.
     *service_job_id* is the CI's job id.
     *service_name* is the name of the service on which the script is running.
     *git* is a dictionary containing Git-related data.
-    *cc_data* is the actual CC data.
+    *cc_data* is the actual CC data: it maps the modules to their blocks,
+    which are sent as Radon's dictionaries (see
+    :func:`~xenon.blocks.to_dicts`).
+
+    The request times out after *timeout* seconds without an answer, and it
+    is sent again up to *retries* times if it fails or if the server answers
+    with a 5xx status, waiting *backoff* seconds before the first retry and
+    twice as much before every following one. The response of the last
+    attempt is returned, while the last error is raised if no response was
+    ever received. If *compress* is ``True``, the body is compressed with
+    gzip. *session* defaults to the one returned by :func:`get_session`.
     '''
-    payload = build_payload(repo_token, service_job_id, service_name, git,
+    session = session or get_session()
+    headers = {'Content-Type': 'application/json'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    attempt = 0
+    while True:
+        # The body is a generator, so it has to be created for every attempt
+        body = iter_payload(repo_token, service_job_id, service_name, git,
                             cc_data)
-    return requests.post(url, data=payload)
+        body = gzip_chunks(body) if compress else encode_chunks(body)
+        try:
+            response = session.post(url, data=body, headers=headers,
+                                    timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= retries:
+                raise
+        else:
+            if response.status_code < 500 or attempt >= retries:
+                return response
+        time.sleep(backoff * 2 ** attempt)
+        attempt += 1
 
 
 def build_payload(repo_token, service_job_id, service_name, git, cc_data):
     '''Construct a payload from the given data.'''
+    return ''.join(iter_payload(repo_token, service_job_id, service_name, git,
+                                cc_data))
+
+
+def iter_payload(repo_token, service_job_id, service_name, git, cc_data):
+    '''Yield the payload built from the given data a piece at a time. The
+    pieces add up to the same JSON document :func:`build_payload` returns.'''
     content = {
         'service_job_id': service_job_id,
         'service_name': service_name,
         'git': git,
-        'cc_data': cc_data,
+        'cc_data': _RadonResults(cc_data),
     }
     if repo_token is not None:
         content['repo_token'] = repo_token
-    return json.dumps(content)
+    return _iter_object(json.JSONEncoder(default=to_json), content)
+
+
+class _RadonResults(object):
+    '''The mapping *results*, whose blocks are converted by
+    :func:`~xenon.blocks.to_dicts` a module at a time.'''
+
+    def __init__(self, results):
+        self.results = results
+
+    def items(self):
+        return ((module, to_dicts(blocks))
+                for module, blocks in self.results.items())
+
+
+def _iter_object(encoder, content):
+    '''Encode the dictionary *content* like ``encoder.iterencode`` does, but
+    also accept mappings which are not dictionaries (e.g. the
+    :class:`~xenon.spill.SpilledResults`), which are encoded an item at a
+    time.'''
+    yield '{'
+    for i, (key, value) in enumerate(content.items()):
+        yield '%s%s: ' % (', ' if i else '', encoder.encode(key))
+        if hasattr(value, 'items') and not isinstance(value, dict):
+            pieces = _iter_object(encoder, value)
+        else:
+            pieces = encoder.iterencode(value)
+        for piece in pieces:
+            yield piece
+    yield '}'
+
+
+def encode_chunks(pieces, size=CHUNK_SIZE):
+    '''Encode the text *pieces* as UTF-8, joining them into chunks of about
+    *size* bytes.'''
+    buf, buffered = [], 0
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        buf.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b''.join(buf)
+            buf, buffered = [], 0
+    if buf:
+        yield b''.join(buf)
+
+
+def gzip_chunks(pieces, size=CHUNK_SIZE, level=6):
+    '''Compress the text *pieces* into a gzip stream, yielding chunks of
+    about *size* bytes.'''
+    # A window size of 16 + 15 makes zlib write the gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    buf, buffered = [], 0
+    for data in encode_chunks(pieces, size):
+        out = compressor.compress(data)
+        if out:
+            buf.append(out)
+            buffered += len(out)
+        if buffered >= size:
+            yield b''.join(buf)
+            buf, buffered = [], 0
+    buf.append(compressor.flush())
+    yield b''.join(buf)
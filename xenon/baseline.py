@@ -0,0 +1,226 @@
+'''This module implements the baselines used by ``--baseline``, which let
+Xenon be adopted on legacy code: only the blocks and modules that are new, or
+whose rank got worse since the baseline was recorded, count as infractions.
+
+A baseline is an open-addressing hash table stored in a file, which is
+memory-mapped and never parsed: every lookup reads a couple of slots, so
+checking a block costs the same with ten or with a million entries in the
+baseline. The file starts with the header (see :data:`HEADER`), followed by
+the slots (see :data:`SLOT`) and by the bytes of the keys. Keys are:
+
+* ``module + '\\0' + name`` for blocks, where *name* is qualified with the
+  class name for methods;
+* ``module + '\\0'`` for modules;
+* the empty string for the average complexity.
+
+When several blocks in a module share the same name, the worst rank is kept.
+'''
+
+import os
+import zlib
+import struct
+
+from radon.complexity import cc_rank
+
+from xenon.core import av
+from xenon.cache import write_atomically
+
+MAGIC = b'XENBASE\0'
+VERSION = 1
+#: Magic, version, number of slots and of entries.
+HEADER = struct.Struct('<8sIII')
+#: Hash, key offset, key length and rank of an entry.
+SLOT = struct.Struct('<IIIB3x')
+EMPTY = 0xffffffff
+RANKS = 'ABCDEF'
+AVERAGE = b''
+
+
+class BaselineError(ValueError):
+    '''Raised when a file is not a valid baseline.'''
+
+
+def block_key(module, block):
+    '''Return the key of *block*, found in *module*.'''
+    try:
+        classname = block['classname']
+    except KeyError:
+        classname = None
+    name = block['name']
+    if classname and block['type'] == 'method':
+        name = '%s.%s' % (classname, name)
+    return ('%s\0%s' % (os.path.normpath(module), name)).encode('utf-8')
+
+
+def module_key(module):
+    '''Return the key of *module*.'''
+    return ('%s\0' % os.path.normpath(module)).encode('utf-8')
+
+
+def _hash(key):
+    return zlib.crc32(key) & 0xffffffff
+
+
+class Baseline(object):
+    '''A baseline read from *data*, any object supporting the buffer
+    protocol. Use :meth:`open` to memory-map a file.'''
+
+    def __init__(self, data):
+        self._data = data
+        if len(data) < HEADER.size:
+            raise BaselineError('truncated baseline')
+        magic, version, self.n_slots, self.n_entries = \
+            HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or \
+                self.n_slots & (self.n_slots - 1) or \
+                len(data) < HEADER.size + self.n_slots * SLOT.size:
+            raise BaselineError('not a baseline, or unsupported version')
+
+    @classmethod
+    def open(cls, path):
+        '''Memory-map the baseline at *path*.'''
+        import mmap
+
+        with open(path, 'rb') as fobj:
+            try:
+                data = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                data = fobj.read()
+        return cls(data)
+
+    def close(self):
+        if hasattr(self._data, 'close'):
+            self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.n_entries
+
+    def get(self, key):
+        '''Return the rank recorded for *key*, or ``None``.'''
+        if not self.n_slots:
+            return None
+        h = _hash(key)
+        mask = self.n_slots - 1
+        i = h & mask
+        while True:
+            slot_h, offset, length, rank = SLOT.unpack_from(
+                self._data, HEADER.size + i * SLOT.size)
+            if offset == EMPTY:
+                return None
+            if slot_h == h and self._data[offset:offset + length] == key:
+                return RANKS[rank]
+            i = (i + 1) & mask
+
+    def tolerates(self, key, rank):
+        '''Check whether *rank* is not worse than the one recorded for
+        *key*.'''
+        recorded = self.get(key)
+        return recorded is not None and rank <= recorded
+
+    def tolerates_block(self, module, block, rank):
+        '''Check whether *block*, found in *module*, is not worse than in
+        the baseline.'''
+        return self.tolerates(block_key(module, block), rank)
+
+    def tolerates_module(self, module, rank):
+        return self.tolerates(module_key(module), rank)
+
+    def tolerates_average(self, rank):
+        return self.tolerates(AVERAGE, rank)
+
+
+def entries(results):
+    '''Return a dictionary mapping the keys of all the blocks and modules in
+    *results* (and of the average complexity) to the index of their
+    rank.'''
+    table = {}
+    total_cc, total_blocks = 0., 0
+    for module, blocks in results.items():
+        if isinstance(blocks, dict):
+            continue
+        module_cc = 0.
+        for block in blocks:
+            key = block_key(module, block)
+            rank = RANKS.index(cc_rank(block['complexity']))
+            table[key] = max(rank, table.get(key, 0))
+            module_cc += block['complexity']
+        table[module_key(module)] = RANKS.index(
+            cc_rank(av(module_cc, len(blocks))))
+        total_cc += module_cc
+        total_blocks += len(blocks)
+    table[AVERAGE] = RANKS.index(cc_rank(av(total_cc, total_blocks)))
+    return table
+
+
+def write(fobj, results):
+    '''Write the baseline of *results* to the binary file *fobj*.'''
+    table = entries(results)
+    n_slots = 8
+    while n_slots < 2 * len(table):
+        n_slots *= 2
+    slots = [None] * n_slots
+    keys = []
+    offset = HEADER.size + n_slots * SLOT.size
+    for key, rank in table.items():
+        h = _hash(key)
+        i = h & (n_slots - 1)
+        while slots[i] is not None:
+            i = (i + 1) & (n_slots - 1)
+        slots[i] = SLOT.pack(h, offset, len(key), rank)
+        keys.append(key)
+        offset += len(key)
+    empty = SLOT.pack(0, EMPTY, 0, 0)
+    fobj.write(HEADER.pack(MAGIC, VERSION, n_slots, len(table)))
+    fobj.write(b''.join(slot or empty for slot in slots))
+    fobj.write(b''.join(keys))
+
+
+def save(path, results):
+    '''Write the baseline of *results* to *path*, atomically.'''
+    write_atomically(path, lambda fobj: write(fobj, results))
+
+
+def open_baseline(args, logger):
+    '''Return the :class:`Baseline` selected by *args*, or ``None``. A
+    missing baseline is reported, and every block is checked.'''
+    path = getattr(args, 'baseline', None)
+    if not path or getattr(args, 'update_baseline', False):
+        return None
+    try:
+        return Baseline.open(path)
+    except (IOError, OSError, BaselineError) as e:
+        logger.warning('cannot read the baseline (%s), run with '
+                       '--update-baseline to create it', e)
+        return None
+
+
+class Unchecked(object):
+    '''The arguments in *args*, without any threshold nor policy, without
+    reports and without stopping at the first infraction.'''
+
+    absolute = modules = average = averagenum = policies = format = None
+    fail_fast = False
+
+    def __init__(self, args):
+        self._args = args
+
+    def __getattr__(self, name):
+        return getattr(self._args, name)
+
+
+def update(args, logger, timings=None):
+    '''Analyze the files specified in *args* and write the results to the
+    baseline at ``args.baseline``. The thresholds are not checked, since
+    nothing can be worse than itself.'''
+    from xenon.core import analyze
+
+    _, results = analyze(Unchecked(args), logger, timings=timings)
+    save(args.baseline, results)
+    logger.info('baseline written to %s', args.baseline)
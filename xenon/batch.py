@@ -0,0 +1,240 @@
+'''This module implements ``xenon batch``, which checks many repositories in a
+single process.
+
+The repositories are listed in a YAML manifest, each one with its own
+thresholds and patterns. The files of all of them are analyzed by the same
+pool of worker processes, so the throughput is bound by the number of cores
+rather than by the startup of one process per repository. A single report
+holds the infractions and the exit code of every repository.
+
+An example manifest::
+
+    jobs: 0
+    defaults:
+      max_absolute: B
+      max_modules: A
+    repos:
+      - path: services/billing
+        max_average: A
+        exclude: "*/migrations/*"
+      - name: auth
+        path: services/auth
+        paths: [src]
+        ignore: vendor,build
+'''
+
+import os
+import sys
+import json
+import logging
+
+from xenon.core import Config, Checker, map_files, resolve_jobs
+from xenon.cache import ResultCache
+
+#: The keys accepted in every repository entry, besides ``path``, ``name``
+#: and ``paths``.
+SETTINGS = ('max_absolute', 'max_modules', 'max_average', 'max_average_num',
+            'exclude', 'ignore', 'no_assert', 'gitignore')
+
+
+class ManifestError(ValueError):
+    '''Raised when the manifest is not valid.'''
+
+
+class Repo(object):
+    '''A repository listed in the manifest. It has the same threshold
+    attributes as the command line arguments, so that it can be given to
+    :class:`~xenon.core.Checker`.'''
+
+    paths_in_front = False
+
+    def __init__(self, name, root, paths=None, **settings):
+        unknown = set(settings) - set(SETTINGS)
+        if unknown:
+            raise ManifestError('unknown settings for %s: %s' % (
+                name, ', '.join(sorted(unknown))))
+        self.name = name
+        self.root = root
+        self.paths = [os.path.normpath(os.path.join(root, p))
+                      for p in paths or ['.']]
+        self.absolute = _rank(settings.get('max_absolute'))
+        self.modules = _rank(settings.get('max_modules'))
+        self.average = _rank(settings.get('max_average'))
+        self.averagenum = settings.get('max_average_num')
+        self.config = Config(
+            exclude=_patterns(settings.get('exclude')),
+            ignore=_patterns(settings.get('ignore')),
+            no_assert=bool(settings.get('no_assert')),
+            gitignore=bool(settings.get('gitignore')),
+        )
+
+    def __repr__(self):
+        return 'Repo(%r, %r)' % (self.name, self.root)
+
+
+class RepoLogger(object):
+    '''A logger-like object which stores the messages of a repository and
+    forwards them to *logger*, prefixed with the repository name.'''
+
+    def __init__(self, name, logger=None):
+        self.name = name
+        self.logger = logger
+        self.messages = []
+
+    def log(self, level, msg, *args):
+        message = msg % args
+        self.messages.append([logging.getLevelName(level).lower(), message])
+        if self.logger is not None:
+            self.logger.log(level, '%s: %s', self.name, message)
+
+    def error(self, msg, *args):
+        self.log(logging.ERROR, msg, *args)
+
+    def warning(self, msg, *args):
+        self.log(logging.WARNING, msg, *args)
+
+    def info(self, msg, *args):
+        self.log(logging.INFO, msg, *args)
+
+
+def load_manifest(path):
+    '''Read the manifest at *path*. Return the list of :class:`Repo` objects
+    and the number of jobs it asks for (``None`` if unspecified). Relative
+    repository paths are relative to the manifest directory.'''
+    import yaml
+
+    try:
+        with open(path, 'r') as fobj:
+            manifest = yaml.safe_load(fobj) or {}
+    except (IOError, yaml.YAMLError) as e:
+        raise ManifestError('cannot read %s: %s' % (path, e))
+    if not isinstance(manifest, dict) or \
+            not isinstance(manifest.get('repos'), list):
+        raise ManifestError('%s must have a list of repos' % path)
+    base = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get('defaults') or {}
+    repos = []
+    for entry in manifest['repos']:
+        if isinstance(entry, str):
+            entry = {'path': entry}
+        if not isinstance(entry, dict) or 'path' not in entry:
+            raise ManifestError('every repo needs a path: %r' % (entry,))
+        settings = dict(defaults)
+        settings.update(entry)
+        root = os.path.join(base, settings.pop('path'))
+        name = settings.pop('name', None) or entry['path']
+        repos.append(Repo(name, os.path.normpath(root), **settings))
+    return repos, manifest.get('jobs')
+
+
+def run(repos, jobs=1, cache_dir=None, logger=None):
+    '''Analyze all the *repos* with a single pool of *jobs* processes, and
+    return the report as a dictionary. The results are cached in
+    *cache_dir*, which is shared by all the repositories.'''
+    checkers, tasks, owners, report = [], [], [], []
+    caches = {}
+    for repo in repos:
+        entry = {'name': repo.name, 'path': repo.root, 'files': 0,
+                 'infractions': 0, 'exit_code': 0, 'messages': []}
+        report.append(entry)
+        checker = Checker(repo, RepoLogger(repo.name, logger))
+        checkers.append(checker)
+        if not os.path.isdir(repo.root):
+            checker.logger.error('no such directory: %s', repo.root)
+            entry['exit_code'] = 2
+            continue
+        cache = _open_cache(caches, cache_dir, repo.config)
+        for name in repo.config.discovery().iter(repo.paths):
+            tasks.append((name, repo.config.no_assert, False, cache))
+            owners.append(len(report) - 1)
+    results = map_files(tasks, resolve_jobs(jobs))
+    for owner, (name, blocks, _, _) in zip(owners, results):
+        report[owner]['files'] += 1
+        if blocks:
+            module = os.path.relpath(name, repos[owner].root)
+            checkers[owner].add(module, blocks)
+    for entry, checker in zip(report, checkers):
+        if entry['exit_code'] == 0:
+            entry['infractions'] = checker.finish()
+            entry['exit_code'] = 1 if entry['infractions'] else 0
+        entry['messages'] = checker.logger.messages
+    for cache in caches.values():
+        cache.prune()
+    return {
+        'repos': report,
+        'exit_code': max([e['exit_code'] for e in report] or [0]),
+    }
+
+
+def _open_cache(caches, cache_dir, config):
+    '''Return the cache for the settings in *config*, opening it once.'''
+    if not cache_dir:
+        return None
+    key = (config.no_assert, config.show_closures)
+    if key not in caches:
+        caches[key] = ResultCache(cache_dir, *key)
+    return caches[key]
+
+
+def parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='xenon batch', description='Check many repositories, listed in '
+        'a YAML manifest, with a single pool of processes.')
+    parser.add_argument('manifest', help='Path of the YAML manifest')
+    parser.add_argument('-j', '--jobs', metavar='<int>', dest='jobs',
+                        type=int, help='Number of processes used to analyze '
+                        'the files, 0 means one per CPU (default: the value '
+                        'in the manifest, or 0)')
+    parser.add_argument('--cache-dir', metavar='<path>', dest='cache_dir',
+                        default='.xenon_cache', help='Directory where the '
+                        'results of unchanged files are cached, shared by '
+                        'all the repositories (default: %(default)s)')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                        help='Do not read nor write the results cache')
+    parser.add_argument('-o', '--output', metavar='<path>', dest='output',
+                        help='Write the JSON report to this file instead of '
+                        'the standard output')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    '''Entry point of ``xenon batch``. The exit code is the highest exit
+    code among the repositories: 1 if any of them has infractions, 2 if any
+    cannot be analyzed.'''
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger('xenon')
+    try:
+        repos, jobs = load_manifest(args.manifest)
+    except ManifestError as e:
+        logger.error('%s', e)
+        return 2
+    if args.jobs is not None:
+        jobs = args.jobs
+    report = run(repos, jobs or 0,
+                 None if args.no_cache else args.cache_dir, logger)
+    output = json.dumps(report, indent=2, sort_keys=True) + '\n'
+    if args.output:
+        with open(args.output, 'w') as fobj:
+            fobj.write(output)
+    else:
+        sys.stdout.write(output)
+    return report['exit_code']
+
+
+def _rank(value):
+    return value.upper() if value else None
+
+
+def _patterns(value):
+    '''Patterns can be given either as a list or as a comma-separated
+    string, like on the command line.'''
+    if isinstance(value, (list, tuple)):
+        return ','.join(value)
+    return value
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,151 @@
+'''This module contains the compact representation of the blocks found by
+Radon.
+
+Radon's own command line interface converts every block into a dictionary
+holding many fields Xenon never reads. :class:`Block` only keeps the ones
+needed to check the thresholds and to build the JSON payload, and uses
+``__slots__``, which makes it several times smaller than a dictionary. Blocks
+still support ``block['complexity']`` style access, so they can be used
+wherever the dictionaries were, and :func:`to_dicts` converts the blocks of a
+module back into Radon's dictionaries, with the methods nested in their class.
+'''
+
+from radon.complexity import cc_rank
+from radon.visitors import Function
+
+
+class Block(object):
+    '''A function, method or class, along with its cyclomatic complexity.
+    The *closures* of a function are blocks too, or their tuples (see
+    :meth:`as_tuple`).'''
+
+    __slots__ = ('name', 'type', 'classname', 'lineno', 'endline',
+                 'complexity', 'col_offset', 'closures')
+
+    def __init__(self, name, type, classname, lineno, endline, complexity,
+                 col_offset=None, closures=()):
+        self.name = name
+        self.type = type
+        self.classname = classname
+        self.lineno = lineno
+        self.endline = endline
+        self.complexity = complexity
+        self.col_offset = col_offset
+        self.closures = ()
+        if closures:
+            self.closures = tuple(c if isinstance(c, Block) else Block(*c)
+                                  for c in closures)
+
+    @classmethod
+    def from_radon(cls, block):
+        '''Build a :class:`Block` from a block returned by
+        :func:`radon.complexity.cc_visit`.'''
+        closures = ()
+        if isinstance(block, Function):
+            kind = 'method' if block.is_method else 'function'
+            classname = block.classname
+            closures = [cls.from_radon(c) for c in block.closures]
+        else:
+            kind, classname = 'class', None
+        return cls(block.name, kind, classname, block.lineno, block.endline,
+                   block.complexity, block.col_offset, closures)
+
+    @property
+    def rank(self):
+        return cc_rank(self.complexity)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __eq__(self, other):
+        return (isinstance(other, Block) and
+                self.as_tuple() == other.as_tuple())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'Block(%s)' % ', '.join(repr(v) for v in self.as_tuple())
+
+    def __getstate__(self):
+        return self.as_tuple()
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def as_tuple(self):
+        '''Return the fields of the block as a tuple, in the order of the
+        constructor arguments. The closures are tuples as well.'''
+        return (self.name, self.type, self.classname, self.lineno,
+                self.endline, self.complexity, self.col_offset,
+                tuple(c.as_tuple() for c in self.closures))
+
+    def as_dict(self):
+        '''Convert the block into a dictionary, e.g. for JSON dumping. The
+        dictionary is the one Radon's ``cc_to_dict`` builds, except that the
+        ``methods`` of a class are only known to :func:`to_dicts`.'''
+        result = {
+            'type': self.type,
+            'rank': self.rank,
+            'name': self.name,
+            'lineno': self.lineno,
+        }
+        for key in ('col_offset', 'endline', 'classname'):
+            value = getattr(self, key)
+            if value is not None:
+                result[key] = value
+        result['complexity'] = self.complexity
+        if self.type != 'class':
+            result['closures'] = [c.as_dict() for c in self.closures]
+        return result
+
+
+def to_dicts(blocks):
+    '''Convert the *blocks* of a module into the dictionaries of Radon's
+    ``cc_to_dict``: the methods of every class are nested in it, as well as
+    listed on their own. Dictionaries and errors are returned as they are.'''
+    if isinstance(blocks, dict):
+        return blocks
+    methods = {}
+    for block in blocks:
+        if isinstance(block, Block) and block.type == 'method':
+            methods.setdefault(block.classname, []).append(block)
+    result = []
+    for block in blocks:
+        if not isinstance(block, Block):
+            result.append(block)
+            continue
+        entry = block.as_dict()
+        if block.type == 'class':
+            # Radon lists the methods in the order they are defined
+            entry['methods'] = [
+                m.as_dict() for m in sorted(methods.get(block.name, ()),
+                                            key=lambda m: m.lineno)
+                if block.lineno <= m.lineno <= block.endline]
+        result.append(entry)
+    return result
+
+
+def encode(blocks):
+    '''Convert the results of a file into a JSON-serializable object.'''
+    if isinstance(blocks, dict):
+        return blocks
+    return [b.as_tuple() for b in blocks]
+
+
+def decode(data):
+    '''The inverse of :func:`encode`.'''
+    if isinstance(data, dict):
+        return data
+    return [Block(*fields) for fields in data]
+
+
+def to_json(obj):
+    '''A ``default`` function for :func:`json.dumps`, which converts blocks
+    into dictionaries.'''
+    if isinstance(obj, Block):
+        return obj.as_dict()
+    raise TypeError('%r is not JSON serializable' % (obj,))
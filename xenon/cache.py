@@ -0,0 +1,267 @@
+'''This module implements the on-disk cache holding the per-file results of
+the complexity analysis.
+
+Entries are keyed by the Git blob hash of the file content, and they live in
+a directory specific to the Radon version and to the analysis settings, so
+that changing any of them never yields stale results. Every entry is written
+to a temporary file first and then renamed into place: since renames are
+atomic, several processes (e.g. parallel CI jobs on a shared workspace) can
+safely use the same cache directory.
+
+When a file changed, :class:`SegmentCache` saves most of the work anyway: it
+holds the blocks of every top-level statement, keyed by the hash of its
+source, so only the statements that were edited are visited again.
+'''
+
+import os
+import json
+import errno
+import hashlib
+import collections
+
+import radon
+
+from xenon.blocks import encode, decode
+
+#: Bump this number whenever the format of the entries changes.
+CACHE_VERSION = 4
+#: Default upper bound for the size of the cache directory, in bytes.
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+#: Default number of top-level statements kept by the segment cache.
+DEFAULT_MAX_SEGMENTS = 50000
+
+
+def blob_hash(data):
+    '''Return the hash Git would assign to a blob holding the bytes *data*.'''
+    header = ('blob %d\0' % len(data)).encode('ascii')
+    return hashlib.sha1(header + data).hexdigest()
+
+
+class ResultCache(object):
+    '''A size-bounded, content-addressed cache of analysis results.
+
+    *root* is the cache directory, while *no_assert* and *show_closures* are
+    the analysis settings the cached results depend on. When the directory
+    grows beyond *max_size* bytes, :meth:`prune` evicts the least recently
+    used entries; it does nothing when no entry was written, so warm runs do
+    not walk the cache directory.
+    '''
+
+    def __init__(self, root, no_assert=False, show_closures=False,
+                 max_size=DEFAULT_MAX_SIZE):
+        self.root = root
+        self.max_size = max_size
+        settings = 'xenon-%d radon-%s no_assert=%s show_closures=%s' % (
+            CACHE_VERSION, radon.__version__, bool(no_assert),
+            bool(show_closures))
+        digest = hashlib.sha1(settings.encode('ascii')).hexdigest()[:16]
+        self.path = os.path.join(root, digest)
+        #: The :class:`SegmentCache` used for the files not in this cache,
+        #: if any.
+        self.segments = None
+        #: Whether entries may have been written since the cache was opened.
+        self.written = False
+
+    def __getstate__(self):
+        # The worker processes may write entries this process cannot see
+        self.written = True
+        # The segment cache is not sent to the worker processes
+        state = self.__dict__.copy()
+        state['segments'] = None
+        return state
+
+    def open_segments(self, max_entries=DEFAULT_MAX_SEGMENTS):
+        '''Load the segment cache stored along with the results, and use it
+        from now on. It is returned.'''
+        self.segments = SegmentCache(os.path.join(self.path, 'segments.lru'),
+                                     max_entries)
+        self.segments.load()
+        return self.segments
+
+    def _entry(self, key):
+        return os.path.join(self.path, key[:2], key[2:] + '.json')
+
+    def get(self, key):
+        '''Return the results stored under *key*, or ``None`` if there are
+        none. Corrupted entries are treated as missing.'''
+        entry = self._entry(key)
+        try:
+            with open(entry, 'r') as fobj:
+                value = decode(json.load(fobj))
+        except (IOError, OSError, ValueError, TypeError):
+            return None
+        try:
+            # Refresh the modification time, which is used for the eviction
+            os.utime(entry, None)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        '''Store *value* under *key*. Errors are silently ignored, as a cache
+        that cannot be written must never break the analysis.'''
+        entry = self._entry(key)
+        data = json.dumps(encode(value), separators=(',', ':'))
+        try:
+            self._ensure_dir(os.path.dirname(entry))
+            write_atomically(entry,
+                             lambda fobj: fobj.write(data.encode('utf-8')))
+        except (IOError, OSError):
+            pass
+        self.written = True
+
+    def _ensure_dir(self, path):
+        if not os.path.isdir(self.root):
+            _makedirs(self.root)
+            # Keep the cache out of version control and of backups
+            with open(os.path.join(self.root, '.gitignore'), 'w') as fobj:
+                fobj.write('*\n')
+            with open(os.path.join(self.root, 'CACHEDIR.TAG'), 'w') as fobj:
+                fobj.write('Signature: 8a477f597d28d172789f06886806bc55\n')
+        _makedirs(path)
+
+    def entries(self):
+        '''Yield ``(mtime, size, path)`` for every entry in the cache,
+        including the temporary files left behind by interrupted writes.'''
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(('.json', '.tmp')):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def prune(self):
+        '''Remove the least recently used entries until the cache size is
+        within the limit. The number of removed entries is returned.'''
+        if not self.written:
+            return 0
+        entries = list(self.entries())
+        size = sum(e[1] for e in entries)
+        removed = 0
+        if size <= self.max_size:
+            return removed
+        entries.sort()
+        for _, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                # Another process evicted it first
+                pass
+            size -= entry_size
+        return removed
+
+
+class SegmentCache(object):
+    '''An LRU cache of the blocks of top-level statements.
+
+    Keys are the hashes of the source of the statements (see
+    :func:`segment_hash`), while values are opaque JSON-serializable objects.
+    At most *max_entries* entries are kept, evicting the least recently used
+    ones. The entries are loaded from and saved to the file at *path*, in
+    one go, and the :attr:`hits` and :attr:`misses` counters are kept.
+    '''
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_SEGMENTS):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = self.misses = 0
+        self.changed = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        '''Return the value stored under *key*, or ``None``.'''
+        try:
+            # Move the entry to the end, where the most recent ones are
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.changed = True
+
+    def load(self):
+        '''Read the entries from the file. A missing or corrupted file
+        leaves the cache empty.'''
+        try:
+            with open(self.path, 'rb') as fobj:
+                entries = json.loads(fobj.read().decode('utf-8'),
+                                     object_pairs_hook=collections.OrderedDict)
+        except (IOError, OSError, ValueError):
+            return
+        if isinstance(entries, dict):
+            self.entries = entries
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def save(self):
+        '''Write the entries to the file, if they changed. Errors are
+        silently ignored, like in :meth:`ResultCache.set`.'''
+        if not self.changed or self.path is None:
+            return
+        data = json.dumps(self.entries, separators=(',', ':'))
+        try:
+            _makedirs(os.path.dirname(self.path))
+            write_atomically(self.path,
+                             lambda fobj: fobj.write(data.encode('utf-8')))
+        except (IOError, OSError):
+            return
+        self.changed = False
+
+
+def segment_hash(source):
+    '''Return the key of the top-level statement whose source is the bytes
+    *source*.'''
+    return hashlib.sha1(source).hexdigest()
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def write_atomically(path, write):
+    '''Call *write* with a binary file object, and atomically move what it
+    wrote to *path*. The file gets the default permissions.'''
+    import binascii
+
+    # Unlike mkstemp, os.open applies the umask, which cannot be read
+    # without changing it for every thread
+    tmp = '%s.%s.tmp' % (path, binascii.hexlify(os.urandom(8)).decode())
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    fd = os.open(tmp, flags, 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as fobj:
+            write(fobj)
+        _replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def _replace(src, dst):
+    '''Atomically rename *src* to *dst*, overwriting it.'''
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:  # pragma: no cover
+        os.rename(src, dst)
@@ -1,15 +1,41 @@
 '''This module contains Xenon's main functionality. Only the
-:func:`~xenon.core.analyze` function should be used directly.
+:func:`~xenon.core.analyze` function should be used directly, or the
+:class:`~xenon.analyzer.Analyzer` class from other programs. Xenon's other
+modules analyze their files in parallel through :func:`map_files` and
+:func:`parallel_map`.
 '''
 
-from radon.complexity import cc_rank, SCORE
-from radon.cli import Config
-from radon.cli.harvest import CCHarvester
+import os
+import ast
 
+# Radon's command line interface is not imported, since it pulls in many
+# modules Xenon does not need and slows down the startup
+from radon.complexity import (cc_rank, cc_visit, add_inner_blocks,
+                              sorted_results, SCORE)
 
-def analyze(args, logger):
+from xenon.blocks import Block
+from xenon.cache import (ResultCache, DEFAULT_MAX_SEGMENTS, blob_hash,
+                         segment_hash)
+from xenon.discovery import Discovery
+from xenon.evaluation import BlockTable, evaluate, rank_of
+from xenon.policy import Policy
+from xenon.prefetch import DEFAULT_READERS, prefetch, read_file
+from xenon.timings import NullTimings, wall_clock, cpu_clock
+
+#: The statements which define blocks (Python 2 has no coroutines).
+SEGMENT_NODES = (ast.FunctionDef,
+                 getattr(ast, 'AsyncFunctionDef', ast.FunctionDef),
+                 ast.ClassDef)
+
+
+def analyze(args, logger, keep_results=True, timings=None):
     '''Analyze the files as specified in *args*. Logging is done through the
-    given *logger*.
+    given *logger*, as soon as every file has been analyzed.
+
+    A ``(infractions, results)`` tuple is returned. If *keep_results* is
+    ``False``, only running totals are kept in memory and *results* is
+    empty. The time spent in every stage is recorded in *timings*, an
+    optional :class:`~xenon.timings.Timings` object.
     The *args* object should have the following attributes:
 
         * ``path``: a list of files to analyze.
@@ -19,19 +45,489 @@ def analyze(args, logger):
             towards increasing the cyclomatic complexity.
         * ``absolute``, ``modules`` and ``average``: the threshold for the
             complexity.
+        * ``jobs`` (optional): the number of worker processes to use. ``0``
+            means one per CPU, while ``1`` (the default) disables the pool.
+        * ``readers`` (optional): the number of threads reading the files
+            ahead of the analysis when ``jobs`` is ``1``, ``0`` to read them
+            one at a time.
+        * ``cache_dir`` and ``no_cache`` (optional): the directory holding
+            the results cache, and whether not to use it at all. Without a
+            ``cache_dir`` no cache is used.
+        * ``block_cache`` and ``block_cache_size`` (optional): whether to
+            also cache the blocks of every top-level statement, so that only
+            the edited ones are visited again in the files which changed, and
+            how many statements to keep.
+        * ``diff_base`` (optional): a Git revision. When given, only the files
+            changed with respect to it are checked against the ``absolute``
+            and ``modules`` thresholds, while the others only count towards
+            the average complexity.
+        * ``staged`` (optional): if ``True``, only the Python files staged
+            in the Git index below ``path`` are checked, as they are staged
+            rather than as they are on disk. The average complexity is the one
+            of these files.
+        * ``fail_fast`` (optional): if ``True``, stop at the first module with
+            an infraction.
+        * ``gitignore`` (optional): if ``True``, skip the files ignored by
+            Git.
+        * ``max_memory`` (optional): the number of megabytes the results
+            can take in memory. Beyond that they are written to a temporary
+            file, and *results* is a :class:`~xenon.spill.SpilledResults`
+            object rather than a dictionary.
+        * ``format`` (optional): a list of ``name`` or ``name:path``
+            values, selecting the reporters which write the infractions in
+            machine-readable formats (see :mod:`xenon.reporters`) to the
+            given paths, or to the standard output.
+        * ``baseline`` (optional): the path of a baseline written by
+            :func:`xenon.baseline.update`. Blocks and modules whose rank is
+            not worse than in the baseline are not infractions.
     '''
     config = Config(
         exclude=args.exclude,
         ignore=args.ignore,
-        order=SCORE,
         no_assert=args.no_assert,
         show_closures=False,
-        min='A',
-        max='F',
+        gitignore=getattr(args, 'gitignore', False),
     )
-    h = CCHarvester(args.path, config)
-    results = h._to_dicts()
-    return find_infractions(args, logger, results), results
+    timings = timings or NullTimings()
+    baseline = None
+    if getattr(args, 'baseline', None):
+        from xenon.baseline import open_baseline
+        baseline = open_baseline(args, logger)
+    reporters = ()
+    if getattr(args, 'format', None):
+        from xenon.reporters import open_reporters
+        reporters = open_reporters(args.format)
+    checker = Checker(args, logger, baseline, reporters)
+    try:
+        return _check_all(args, config, checker, keep_results, timings)
+    finally:
+        # Reports are ended even when stopping at the first infraction
+        checker.close()
+        if baseline is not None:
+            baseline.close()
+
+
+def _check_all(args, config, checker, keep_results, timings):
+    '''Analyze the files and feed the results to *checker*. The return
+    value is the same as the one of :func:`analyze`.'''
+    cache = open_cache(args, config)
+    fail_fast = getattr(args, 'fail_fast', False)
+    results = new_results(args) if keep_results else {}
+    discovery = config.discovery()
+    stream = iter_results(args, config, cache, timings, discovery)
+    try:
+        for name, blocks, background in stream:
+            if keep_results:
+                results[name] = blocks
+            with timings.stage('checking'):
+                if background:
+                    checker.add_background(blocks)
+                elif checker.add(name, blocks) and fail_fast:
+                    return checker.infractions, results
+    finally:
+        stream.close()
+        for name, count in discovery.stats.items():
+            timings.record_count(name, count)
+    if cache is not None:
+        with timings.stage('cache'):
+            cache.prune()
+            segments = cache.segments
+            if segments is not None:
+                segments.save()
+        if segments is not None:
+            checker.logger.info('block cache: %d hits, %d misses',
+                                segments.hits, segments.misses)
+            timings.record_count('block cache hits', segments.hits)
+            timings.record_count('block cache misses', segments.misses)
+    with timings.stage('checking'):
+        return checker.finish(), results
+
+
+def new_results(args):
+    '''Return the empty mapping collecting the results. When
+    ``args.max_memory`` is set it is a :class:`~xenon.spill.SpilledResults`
+    object holding at most that many megabytes in memory.'''
+    max_memory = getattr(args, 'max_memory', None)
+    if not max_memory:
+        return {}
+    from xenon.spill import SpilledResults
+    return SpilledResults(max_memory * 1024 * 1024)
+
+
+def iter_results(args, config, cache=None, timings=None, discovery=None):
+    '''Analyze the files specified in *args* (see :func:`analyze`), yielding
+    a ``(module, blocks, background)`` tuple as soon as every file has been
+    analyzed. *background* is ``True`` for modules that only count towards
+    the average complexity. The time spent is recorded in *timings*, while
+    the files are found by *discovery*, a
+    :class:`~xenon.discovery.Discovery` object.'''
+    if getattr(args, 'legacy_harvester', False):
+        return iter_legacy(args.path, config)
+    jobs = resolve_jobs(getattr(args, 'jobs', 1))
+    discovery = discovery or config.discovery()
+    filenames = discovery.iter(args.path)
+    if timings is not None:
+        filenames = timings.timed('discovery', filenames)
+    if getattr(args, 'staged', False):
+        return iter_staged(args.path, config, jobs, cache, timings,
+                           discovery)
+    diff_base = getattr(args, 'diff_base', None)
+    readers = getattr(args, 'readers', DEFAULT_READERS)
+    if diff_base:
+        return iter_diff(filenames, config, diff_base, jobs, cache, timings,
+                         readers)
+    return ((name, blocks, False) for name, blocks
+            in iter_harvest(filenames, config, jobs, cache, timings,
+                            readers))
+
+
+def iter_legacy(paths, config):
+    '''Analyze the files found in *paths* through Radon's ``CCHarvester``,
+    like Xenon used to do, yielding the same tuples as :func:`iter_results`.
+    The blocks are the dictionaries built by Radon. This is only meant to
+    compare the results with the ones of :func:`iter_harvest`.'''
+    from radon.cli import Config as RadonConfig
+    from radon.cli.harvest import CCHarvester
+    from radon.cli.tools import cc_to_dict
+
+    h = CCHarvester(paths, RadonConfig(
+        exclude=config.exclude, ignore=config.ignore, order=SCORE,
+        no_assert=config.no_assert, show_closures=config.show_closures,
+        min='A', max='F'))
+    for name, data in h.results:
+        if 'error' in data:
+            yield name, data, False
+        elif data:
+            yield name, [cc_to_dict(b) for b in data], False
+
+
+class Config(object):
+    '''The settings of the analysis: *exclude*, *ignore* and *gitignore*
+    select the files, as in :class:`~xenon.discovery.Discovery`, while
+    *no_assert* and *show_closures* are passed to Radon.'''
+
+    def __init__(self, exclude=None, ignore=None, no_assert=False,
+                 show_closures=False, gitignore=False):
+        self.exclude = exclude
+        self.ignore = ignore
+        self.no_assert = no_assert
+        self.show_closures = show_closures
+        self.gitignore = gitignore
+
+    def discovery(self):
+        '''Return a new :class:`~xenon.discovery.Discovery` object finding
+        the files to analyze.'''
+        return Discovery(self.exclude, self.ignore, self.gitignore)
+
+
+def open_cache(args, config):
+    '''Return the :class:`~xenon.cache.ResultCache` selected by *args*, or
+    ``None`` if caching is disabled.'''
+    cache_dir = getattr(args, 'cache_dir', None)
+    if getattr(args, 'no_cache', False) or not cache_dir:
+        return None
+    cache = ResultCache(cache_dir, config.no_assert, config.show_closures)
+    if getattr(args, 'block_cache', False):
+        cache.open_segments(getattr(args, 'block_cache_size',
+                                    DEFAULT_MAX_SEGMENTS))
+    return cache
+
+
+def resolve_jobs(jobs):
+    '''Return the actual number of worker processes for *jobs*: ``None`` and
+    ``0`` mean one process per CPU.'''
+    if not jobs:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    return max(1, jobs)
+
+
+def harvest(paths, config, jobs=1, cache=None):
+    '''Analyze the files found in *paths*, returning a dictionary with the
+    same structure as the one built by Radon's ``CCHarvester``.'''
+    filenames = config.discovery().iter(paths)
+    return dict(iter_harvest(filenames, config, jobs, cache))
+
+
+def iter_harvest(filenames, config, jobs=1, cache=None, timings=None,
+                 readers=0):
+    '''Analyze the given *filenames*, yielding a ``(filename, blocks)``
+    tuple for every file with at least one block, where *blocks* is the list
+    of its blocks converted to dictionaries, or a dictionary with an
+    ``error`` key.
+
+    When *jobs* is greater than one the files are spread over a pool of
+    processes, each one analyzing a single file at a time. The results are
+    still yielded in the order of *filenames*, so they are identical to the
+    ones of a serial run. *cache* is an optional
+    :class:`~xenon.cache.ResultCache`, while *timings* is an optional
+    :class:`~xenon.timings.Timings` object recording the time spent on every
+    file.
+
+    In a single process, the files are read ahead by *readers* threads (see
+    :func:`~xenon.prefetch.prefetch`), so that the analysis does not wait for
+    slow filesystems. Worker processes read their own files.
+    '''
+    if jobs < 2 and readers > 0:
+        tasks = ((name, config.no_assert, config.show_closures, cache, data)
+                 for name, data in prefetch(filenames, readers))
+    else:
+        # Only the values the workers need are sent over
+        tasks = ((name, config.no_assert, config.show_closures, cache)
+                 for name in filenames)
+    for name, blocks, wall, cpu in map_files(tasks, jobs):
+        if timings is not None:
+            timings.record_file(name, wall, cpu)
+        if blocks:
+            yield name, blocks
+
+
+def iter_diff(filenames, config, base, jobs=1, cache=None, timings=None,
+              readers=0):
+    '''Analyze the given *filenames*, yielding the same tuples as
+    :func:`iter_results`. Only the files that changed with respect to the
+    *base* Git revision are yielded with *background* set to ``False``.
+
+    The results of the unchanged files are taken from *cache* without reading
+    them, since their content is the blob recorded in the *base* tree; only
+    the files missing from the cache are analyzed.
+    '''
+    from xenon.repository import changed_files, tree_blobs
+
+    timings = timings or NullTimings()
+    with timings.stage('git'):
+        changed = changed_files(base)
+        blobs = tree_blobs(base)
+    fresh, missing = [], set()
+    for name in filenames:
+        key = os.path.normpath(os.path.relpath(name))
+        if key in changed or key not in blobs:
+            fresh.append(name)
+            continue
+        blocks = cache.get(blobs[key]) if cache is not None else None
+        if blocks is None:
+            missing.add(name)
+        elif blocks:
+            yield name, blocks, True
+    filenames = fresh + sorted(missing)
+    for name, blocks in iter_harvest(filenames, config, jobs, cache,
+                                     timings, readers):
+        yield name, blocks, name in missing
+
+
+def iter_staged(paths, config, jobs=1, cache=None, timings=None,
+                discovery=None):
+    '''Analyze the Python files staged in the Git index below *paths*,
+    yielding the same tuples as :func:`iter_results`. Only the files added or
+    modified since ``HEAD`` are analyzed, and their staged content is read
+    from the object store, so the cost is proportional to the commit rather
+    than to the tree. The files are selected by *discovery*, as if *paths*
+    were walked: the ignore patterns only apply below them.'''
+    from xenon.repository import CatFile, staged_blobs
+
+    timings = timings or NullTimings()
+    discovery = discovery or config.discovery()
+    with timings.stage('git'):
+        staged = []
+        for name, sha in staged_blobs(paths):
+            relpath = _relative_to(name, paths or ['.'])
+            if relpath is not None and \
+                    discovery.accepts(relpath.replace(os.sep, '/')):
+                staged.append((name, sha))
+    discovery.stats['files'] += len(staged)
+    found, tasks = {}, []
+    with timings.stage('git'):
+        with CatFile() as cat_file:
+            for name, sha in staged:
+                blocks = cache.get(sha) if cache is not None else None
+                if blocks is None:
+                    tasks.append((name, config.no_assert,
+                                  config.show_closures, cache,
+                                  cat_file.read(sha)))
+                else:
+                    found[name] = blocks
+    for name, blocks, wall, cpu in map_files(tasks, jobs):
+        timings.record_file(name, wall, cpu)
+        found[name] = blocks
+    for name, _ in staged:
+        if found[name]:
+            yield name, found[name], False
+
+
+def _relative_to(name, paths):
+    '''Return the path of the file *name* relative to the first of *paths*
+    containing it (its base name if it is one of them), or ``None``.'''
+    for path in paths:
+        relpath = os.path.relpath(name, path)
+        if relpath == os.curdir:
+            return os.path.basename(name)
+        if relpath != os.pardir and \
+                not relpath.startswith(os.pardir + os.sep):
+            return relpath
+    return None
+
+
+def map_files(files, jobs=1, pool=None):
+    '''Analyze every one of *files* with :func:`harvest_file`, using *jobs*
+    processes (see :func:`parallel_map`). The items of *files* are tuples of
+    the arguments of :func:`harvest_file`, e.g. ``(name, no_assert,
+    show_closures, cache)``. Yield a ``(name, blocks, wall, cpu)`` tuple for
+    every file, in order, with the wall-clock and CPU time spent on it.'''
+    return parallel_map(_harvest_task, files, jobs, pool)
+
+
+def parallel_map(func, tasks, jobs, pool=None):
+    '''Apply *func* to every one of *tasks*, yielding the results in order.
+    With more than one of *jobs*, the tasks are run by a pool of processes,
+    so *func* has to be a module-level function and the tasks have to be
+    picklable. If *pool* is given, it is used instead of a new pool and it is
+    left running.'''
+    if jobs > 1:
+        tasks = list(tasks)
+    if jobs < 2 or len(tasks) < 2:
+        for task in tasks:
+            yield func(task)
+        return
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    if pool is not None:
+        for result in pool.imap(func, tasks, chunksize):
+            yield result
+        return
+    import multiprocessing
+
+    pool = multiprocessing.Pool(min(jobs, len(tasks)))
+    try:
+        for result in pool.imap(func, tasks, chunksize):
+            yield result
+    finally:
+        # All the results have been consumed, unless we stopped early
+        pool.terminate()
+        pool.join()
+
+
+def _harvest_task(task):
+    '''Worker function: analyze a single file with the given settings. The
+    wall and CPU time spent are returned along with the results.'''
+    wall, cpu = wall_clock(), cpu_clock()
+    blocks = harvest_file(*task)
+    return task[0], blocks, wall_clock() - wall, cpu_clock() - cpu
+
+
+def harvest_file(name, no_assert=False, show_closures=False, cache=None,
+                 data=None):
+    '''Analyze a single file, returning the list of its blocks as
+    :class:`~xenon.blocks.Block` objects, or a dictionary with an ``error``
+    key if the file cannot be parsed. If *cache* is given, unchanged files are
+    not analyzed again. The file is read unless its content is given as
+    *data*.'''
+    if data is None:
+        data = read_file(name)
+    if cache is None or name == '-':
+        return analyze_source(data, no_assert, show_closures)
+    key = blob_hash(data)
+    result = cache.get(key)
+    if result is None:
+        result = analyze_source(data, no_assert, show_closures,
+                                cache.segments)
+        cache.set(key, result)
+    return result
+
+
+def analyze_source(source, no_assert=False, show_closures=False,
+                   segments=None):
+    '''Compute the complexity of the blocks in *source*, which can be either
+    text or the raw bytes of a file. The return value is the same as the one
+    of :func:`harvest_file`. If *segments* is given, it is used through
+    :func:`analyze_segments`.'''
+    if segments is not None and isinstance(source, bytes):
+        return analyze_segments(source, no_assert, show_closures, segments)
+    try:
+        blocks = cc_visit(source, no_assert=no_assert)
+        if show_closures:
+            blocks = add_inner_blocks(blocks)
+        return [Block.from_radon(b)
+                for b in sorted_results(blocks, order=SCORE)]
+    except Exception as e:
+        return {'error': str(e)}
+
+
+def analyze_segments(source, no_assert=False, show_closures=False,
+                     segments=None):
+    '''Like :func:`analyze_source`, but the blocks of every top-level
+    statement are looked up in *segments*, a
+    :class:`~xenon.cache.SegmentCache`, and only the statements missing from
+    it are visited. *source* must be bytes. The results are the same as the
+    ones of :func:`analyze_source`.'''
+    if b'\r' in source:
+        source = source.replace(b'\r\n', b'\n')
+        if b'\r' in source:
+            # Lone carriage returns end lines for Python, but not for us
+            return analyze_source(source, no_assert, show_closures)
+    try:
+        tree = ast.parse(source)
+    except Exception as e:
+        return {'error': str(e)}
+    lines = source.split(b'\n')
+    functions, classes = [], []
+    for node in tree.body:
+        if not isinstance(node, SEGMENT_NODES) and not any(
+                isinstance(child, SEGMENT_NODES) for child in ast.walk(node)):
+            # Statements without blocks do not need a visit
+            continue
+        if getattr(node, 'end_lineno', None) is None:  # pragma: no cover
+            # Python < 3.8 does not record where statements end
+            return analyze_source(source, no_assert, show_closures)
+        start = min([node.lineno] +
+                    [d.lineno for d in getattr(node, 'decorator_list', ())])
+        key = segment_hash(b'\n'.join(lines[start - 1:node.end_lineno]))
+        entry = segments.get(key)
+        if entry is None:
+            try:
+                entry = _visit_segment(node, start, no_assert, show_closures)
+            except Exception as e:
+                return {'error': str(e)}
+            segments.set(key, entry)
+        n_functions, groups = entry
+        for i, group in enumerate(groups):
+            blocks = [Block(*_shift(fields, start)) for fields in group]
+            (functions if i < n_functions else classes).append(blocks)
+    groups = functions + classes
+    if show_closures:
+        # add_inner_blocks() reverses the order of the blocks
+        groups.reverse()
+    # sorted() is stable, so blocks with the same complexity keep the order
+    # of analyze_source()
+    return sorted((block for group in groups for block in group),
+                  key=lambda block: -block.complexity)
+
+
+def _visit_segment(node, start, no_assert, show_closures):
+    '''Visit the top-level statement *node*, starting at line *start*.
+    Return the number of functions it defines and the blocks of every
+    function, class and method, in the order of Radon's visitor. Line
+    numbers are relative to *start*.'''
+    from radon.visitors import ComplexityVisitor
+
+    module = ast.Module(body=[node], type_ignores=[])
+    visitor = ComplexityVisitor.from_ast(module, no_assert=no_assert)
+    groups = []
+    for block in visitor.blocks:
+        # add_inner_blocks() expands every block on its own
+        expanded = add_inner_blocks([block]) if show_closures else [block]
+        groups.append([_shift(Block.from_radon(b).as_tuple(), -start)
+                       for b in expanded])
+    return len(visitor.functions), groups
+
+
+def _shift(fields, offset):
+    '''Add *offset* to the line numbers of the block whose fields are
+    *fields* (see :meth:`~xenon.blocks.Block.as_tuple`) and of its
+    closures.'''
+    (name, kind, classname, lineno, endline, complexity, col_offset,
+     closures) = fields
+    return (name, kind, classname, lineno + offset, endline + offset,
+            complexity, col_offset,
+            tuple(_shift(closure, offset) for closure in closures))
 
 
 def av(n, m):
@@ -44,54 +540,173 @@ def check(rank, default=None):
     return rank > default.upper() if default is not None else False
 
 
-def find_infractions(args, logger, results):
+def find_infractions(args, logger, results, background=None, baseline=None):
     '''Analyze the results and find if the thresholds are surpassed.
 
     *args* and *logger* are the same as in :func:`~xenon.core.analyze`, while
     *results* is a dictionary holding the results of the complexity analysis.
+    The optional *background* dictionary has the same structure, but its
+    blocks only count towards the average complexity. Only the blocks and
+    modules that got worse with respect to *baseline*, an optional
+    :class:`~xenon.baseline.Baseline`, are infractions.
 
     The number of infractions with respect to the threshold values is returned.
     '''
-    infractions = 0
-    module_averages = []
-    total_cc = 0.
-    total_blocks = 0
-    for module, blocks in results.items():
-        module_cc = 0.
+    table = BlockTable.from_results(results, background)
+    return evaluate(table, args, logger, baseline)
+
+
+class Checker(object):
+    '''Check the results of the analysis against the thresholds as soon as
+    they are produced.
+
+    *args* and *logger* are the same as in :func:`~xenon.core.analyze`.
+    Infractions are logged immediately, and only running totals are kept to
+    compute the average complexity. The block and module thresholds of every
+    module come from ``args.policies``, a :class:`~xenon.policy.PolicyIndex`,
+    if any. What is not worse than in *baseline* (a
+    :class:`~xenon.baseline.Baseline`) is tolerated. Every module added,
+    along with its infractions, is also passed to the *reporters* (see
+    :mod:`xenon.reporters`), which are ended by :meth:`finish` or
+    :meth:`close`.
+    '''
+
+    def __init__(self, args, logger, baseline=None, reporters=()):
+        self.args = args
+        self.logger = logger
+        self.baseline = baseline
+        self.reporters = list(reporters)
+        self.policy = Policy(args.absolute, args.modules)
+        self.policies = getattr(args, 'policies', None)
+        self.infractions = 0
+        self.total_cc = 0.
+        self.total_blocks = 0
+        #: The infractions found in the current module, as
+        #: :class:`~xenon.reporters.Infraction` objects.
+        self.found = []
+
+    def add(self, module, blocks):
+        '''Check the *blocks* of *module* against the block and module
+        thresholds. Return the number of infractions found.'''
+        self.found = []
         if isinstance(blocks, dict) and blocks.get('error'):
-            logger.warning('cannot parse %s: %s', module, blocks['error'])
-            continue
+            self.logger.warning('cannot parse %s: %s', module, blocks['error'])
+            self._report(module, blocks)
+            return 0
+        policy = self.policy_of(module)
+        infractions = 0
+        module_cc = 0.
         for block in blocks:
             module_cc += block['complexity']
-            r = cc_rank(block['complexity'])
-            if check(r, args.absolute):
-                if args.paths_in_front:
-                    logger.error('%s:%s "%s" block has a rank of %s', module,
-                            block['lineno'], block['name'], r)
-                else:
-                    logger.error('block "%s:%s %s" has a rank of %s', module,
-                            block['lineno'], block['name'], r)
-                infractions += 1
-        module_averages.append((module, av(module_cc, len(blocks))))
-        total_cc += module_cc
-        total_blocks += len(blocks)
-
-    av_cc = av(total_cc, total_blocks)
-    ar = cc_rank(av_cc)
-
-    if args.averagenum is not None and av_cc > args.averagenum:
-        logger.error('total average complexity is %s', av_cc)
-        infractions += 1
-
-    if check(ar, args.average):
-        logger.error('average complexity is ranked %s', ar)
-        infractions += 1
-    for module, ma in module_averages:
-        mar = cc_rank(ma)
-        if check(mar, args.modules):
-            if args.paths_in_front:
-                logger.error('%r module has a rank of %s', module, mar)
-            else:
-                logger.error('module %r has a rank of %s', module, mar)
-            infractions += 1
-    return infractions
+            infractions += self._check_block(module, block, policy)
+        self.total_cc += module_cc
+        self.total_blocks += len(blocks)
+        infractions += self._check_module(module, av(module_cc, len(blocks)),
+                                          policy)
+        self.infractions += infractions
+        self._report(module, blocks)
+        return infractions
+
+    def policy_of(self, module):
+        '''Return the :class:`~xenon.policy.Policy` of *module*.'''
+        if self.policies is None:
+            return self.policy
+        return self.policies.resolve(module, self.policy)
+
+    def _report(self, module, blocks):
+        for reporter in self.reporters:
+            reporter.module(module, blocks, self.found)
+
+    def add_background(self, blocks):
+        '''Count *blocks* towards the average complexity only.'''
+        if not isinstance(blocks, dict):
+            self.total_cc += sum(block['complexity'] for block in blocks)
+            self.total_blocks += len(blocks)
+
+    def finish(self):
+        '''Check the average complexity and return the total number of
+        infractions.'''
+        args, logger = self.args, self.logger
+        av_cc = av(self.total_cc, self.total_blocks)
+        ar = cc_rank(av_cc)
+        self.found = []
+
+        if args.averagenum is not None and av_cc > args.averagenum:
+            logger.error('total average complexity is %s', av_cc)
+            self._found('total average', None, None, av_cc, args.averagenum)
+            self.infractions += 1
+
+        # The baseline records the rank of the average, not its value
+        tolerated = self.baseline is not None and \
+            self.baseline.tolerates_average(ar)
+        if not tolerated and check(ar, args.average):
+            logger.error('average complexity is ranked %s', ar)
+            self._found('average', None, None, ar, args.average)
+            self.infractions += 1
+        self.close(self.found)
+        return self.infractions
+
+    def summary(self):
+        '''Return the number of blocks, their average complexity and its rank,
+        and the number of infractions.'''
+        av_cc = av(self.total_cc, self.total_blocks)
+        return {'blocks': self.total_blocks, 'complexity': av_cc,
+                'rank': cc_rank(av_cc), 'infractions': self.infractions}
+
+    def close(self, infractions=()):
+        '''End the reports with the *infractions* of the whole code base, and
+        close them. Only the first call has an effect.'''
+        reporters, self.reporters = self.reporters, []
+        for reporter in reporters:
+            reporter.end(list(infractions), self.summary())
+            reporter.close()
+
+    def _found(self, kind, module, block, value, threshold):
+        if self.reporters:
+            from xenon.reporters import Infraction
+            self.found.append(Infraction(kind, module, block, value,
+                                         threshold))
+
+    def _check_block(self, module, block, policy):
+        if policy.block_limit is None or \
+                block['complexity'] <= policy.block_limit:
+            return 0
+        return self.report_block(module, block, rank_of(block['complexity']),
+                                 policy.absolute)
+
+    def report_block(self, module, block, r, threshold=None):
+        '''Log the infraction of *block*, whose rank is *r*, unless the
+        baseline tolerates it. *threshold* is the rank it exceeds, by default
+        the one in the arguments. Return the number of infractions.'''
+        if self.baseline is not None and \
+                self.baseline.tolerates_block(module, block, r):
+            return 0
+        if self.args.paths_in_front:
+            self.logger.error('%s:%s "%s" block has a rank of %s', module,
+                              block['lineno'], block['name'], r)
+        else:
+            self.logger.error('block "%s:%s %s" has a rank of %s', module,
+                              block['lineno'], block['name'], r)
+        self._found('block', module, block, r,
+                    threshold or self.args.absolute)
+        return 1
+
+    def _check_module(self, module, ma, policy):
+        if policy.module_limit is None or ma <= policy.module_limit:
+            return 0
+        return self.report_module(module, rank_of(ma), policy.modules)
+
+    def report_module(self, module, mar, threshold=None):
+        '''Log the infraction of *module*, whose rank is *mar*, unless the
+        baseline tolerates it. *threshold* is the rank it exceeds, by default
+        the one in the arguments. Return the number of infractions.'''
+        if self.baseline is not None and \
+                self.baseline.tolerates_module(module, mar):
+            return 0
+        if self.args.paths_in_front:
+            self.logger.error('%r module has a rank of %s', module, mar)
+        else:
+            self.logger.error('module %r has a rank of %s', module, mar)
+        self._found('module', module, None, mar,
+                    threshold or self.args.modules)
+        return 1
@@ -0,0 +1,201 @@
+'''This module finds the files to analyze. It follows the same rules as
+Radon's command line interface, without having to import it, but it is
+faster on large trees: all the patterns are compiled into a single regular
+expression, and ignored directories are pruned before their content is even
+listed.
+'''
+
+import os
+import re
+import fnmatch
+
+
+def compile_patterns(patterns):
+    '''Compile the glob *patterns* into a single regular expression, and
+    return its ``match`` method. ``None`` is returned if there are no
+    patterns.'''
+    patterns = [p for p in patterns if p]
+    if not patterns:
+        return None
+    regex = '|'.join('(?:%s)' % fnmatch.translate(os.path.normcase(p))
+                     for p in patterns)
+    return re.compile(regex).match
+
+
+def split_patterns(exclude=None, ignore=None):
+    '''Split the comma-separated *exclude* and *ignore* patterns into lists.
+    Hidden directories are always ignored.'''
+    exclude = exclude.split(',') if exclude else []
+    ignore = ['.*'] + (ignore.split(',') if ignore else [])
+    return exclude, ignore
+
+
+class Discovery(object):
+    '''Find the Python files to analyze.
+
+    *exclude* is a comma-separated list of glob patterns matched against
+    every file path, while *ignore* is a comma-separated list of glob
+    patterns matched against every directory name: if any pattern matches,
+    the directory is not explored. If *gitignore* is ``True``, the files
+    ignored by Git are skipped as well.
+
+    The number of files found and of the files and directories skipped is
+    available in :attr:`stats` once the iteration is over.
+    '''
+
+    def __init__(self, exclude=None, ignore=None, gitignore=False):
+        exclude, ignore = split_patterns(exclude, ignore)
+        self.excluded = compile_patterns(exclude)
+        self.ignored = compile_patterns(ignore)
+        self.gitignore = gitignore
+        self.stats = {'files': 0, 'skipped_files': 0, 'skipped_dirs': 0}
+
+    def iter(self, paths):
+        '''Yield all the Python files found in *paths*. If *paths* is
+        ``['-']``, standard input is implied and ``'-'`` is yielded as is.'''
+        if set(paths) == set(('-',)):
+            yield '-'
+            return
+        for path in paths:
+            if os.path.isfile(path):
+                files = self._check_file(path)
+            elif self.gitignore:
+                files = self._git_files(path)
+            else:
+                files = self._walk(path)
+            for filename in files:
+                self.stats['files'] += 1
+                yield filename
+
+    def accepts(self, relpath):
+        '''Check whether the file *relpath*, a path relative to the root of
+        the analysis with ``/`` separators (e.g. from a Git tree), would be
+        found when walking the root. Only the extension is checked, since
+        there is no file to read the shebang from.'''
+        parts = relpath.split('/')
+        if any(self._is_ignored(name) for name in parts[:-1]):
+            return False
+        return (parts[-1].endswith('.py') and not parts[-1].startswith('.')
+                and not self._is_excluded(os.path.normpath(relpath)))
+
+    def _check_file(self, path):
+        if is_python_file(path) and not self._is_excluded(path):
+            return [path]
+        self.stats['skipped_files'] += 1
+        return []
+
+    def _is_excluded(self, path):
+        return (self.excluded is not None and
+                self.excluded(os.path.normcase(path)) is not None)
+
+    def _is_ignored(self, name):
+        return self.ignored(os.path.normcase(name)) is not None
+
+    def _accept(self, path, name):
+        '''Check whether the file *path*, whose basename is *name*, has to
+        be analyzed.'''
+        if (name.startswith('.') or self._is_excluded(path) or
+                not is_python_file(path)):
+            self.stats['skipped_files'] += 1
+            return False
+        return True
+
+    def _walk(self, start):
+        '''Walk the tree below *start* in the same order as
+        :func:`os.walk`, without descending into ignored directories.'''
+        stack = [start]
+        while stack:
+            top = stack.pop()
+            try:
+                entries = list(_scandir(top))
+            except OSError:
+                continue
+            subdirs = []
+            for entry in entries:
+                if _is_dir(entry):
+                    if self._is_ignored(entry.name):
+                        self.stats['skipped_dirs'] += 1
+                    elif not entry.is_symlink():
+                        subdirs.append(entry.path)
+                    continue
+                path = os.path.normpath(entry.path)
+                if self._accept(path, entry.name):
+                    yield path
+            stack.extend(reversed(subdirs))
+
+    def _git_files(self, start):
+        '''List the files below *start* which are not ignored by Git.'''
+        from xenon.repository import git
+
+        out = git('ls-files', '--cached', '--others', '--exclude-standard',
+                  '-z', cwd=start)
+        pruned = set()
+        for relpath in out.split('\0'):
+            if not relpath:
+                continue
+            parts = relpath.split('/')
+            if self._has_ignored_dir(parts[:-1], pruned):
+                continue
+            path = os.path.normpath(os.path.join(start, relpath))
+            if os.path.isfile(path) and self._accept(path, parts[-1]):
+                yield path
+
+    def _has_ignored_dir(self, dirs, pruned):
+        for i in range(len(dirs)):
+            prefix = tuple(dirs[:i + 1])
+            if prefix in pruned:
+                return True
+            if self._is_ignored(dirs[i]):
+                pruned.add(prefix)
+                self.stats['skipped_dirs'] += 1
+                return True
+        return False
+
+
+def iter_filenames(paths, exclude=None, ignore=None):
+    '''Yield all the Python files found in *paths*. See :class:`Discovery`
+    for the meaning of the arguments.'''
+    return Discovery(exclude, ignore).iter(paths)
+
+
+def is_python_file(filename):
+    '''Check whether *filename* is a Python source file, either because of its
+    extension or because of its shebang line.'''
+    if filename.endswith('.py'):
+        return True
+    try:
+        with open(filename) as fobj:
+            first_line = fobj.readline()
+    except Exception:
+        return False
+    return first_line.startswith('#!') and 'python' in first_line
+
+
+def _scandir(path):
+    '''Return the entries of the directory *path*. ``os.scandir`` is used
+    when available.'''
+    if hasattr(os, 'scandir'):
+        return os.scandir(path)
+    else:  # pragma: no cover
+        return [_Entry(path, name) for name in os.listdir(path)]
+
+
+def _is_dir(entry):
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+class _Entry(object):  # pragma: no cover
+    '''A minimal stand-in for ``os.DirEntry``, for Python 2.'''
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+
+    def is_dir(self):
+        return os.path.isdir(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
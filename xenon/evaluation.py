@@ -0,0 +1,333 @@
+'''This module checks the thresholds on the whole results at once.
+
+The results are flattened into a :class:`BlockTable`: the complexities of
+all the blocks in a single numeric array, along with the offset of the first
+block of every module. Ranks are never computed block by block: a rank
+threshold is turned into the highest complexity it allows, and the blocks
+above it are found with a single comparison over the array. Module averages
+come from the cumulative sums of the complexities.
+
+When NumPy is installed it is used for all of this, otherwise the same
+operations are performed by plain Python on :mod:`array` objects. The table
+also provides percentiles and rank histograms of the complexity, overall and
+per module.
+'''
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+#: The highest complexity of every rank but ``F``, as in
+#: :func:`radon.complexity.cc_rank`.
+RANK_LIMITS = (5, 10, 20, 30, 40)
+RANKS = 'ABCDEF'
+#: The percentiles computed by :meth:`BlockTable.stats`.
+PERCENTILES = (50, 90, 99)
+
+
+def rank_of(value):
+    '''Return the rank of the complexity *value*, like
+    :func:`radon.complexity.cc_rank`.'''
+    return RANKS[bisect_left(RANK_LIMITS, value)]
+
+
+def rank_limit(rank):
+    '''Return the highest complexity allowed by the threshold *rank*, or
+    ``None`` if there is no limit.'''
+    if rank is None:
+        return None
+    # The number of ranks not worse than the threshold
+    allowed = bisect_right(RANKS, rank.upper())
+    if not allowed:
+        return -1
+    return RANK_LIMITS[allowed - 1] if allowed <= len(RANK_LIMITS) else None
+
+
+def has_numpy():
+    '''Check whether NumPy can be used.'''
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class BlockTable(object):
+    '''The results of the analysis, as flat arrays.
+
+    :attr:`complexities` holds the complexity of every block, module after
+    module, and the blocks of the *i*-th module are the ones between
+    ``starts[i]`` and ``starts[i + 1]``. Modules which could not be parsed
+    are kept in :attr:`errors`, while *background* blocks only count towards
+    the overall statistics. If *keep_blocks* is ``False`` the blocks
+    themselves are not kept, which is enough for :meth:`stats`.
+    '''
+
+    def __init__(self, keep_blocks=True):
+        self.keep_blocks = keep_blocks
+        self.modules = []
+        self.blocks = []
+        self.starts = array('l', [0])
+        self.complexities = array('d')
+        self.errors = {}
+        self.background = array('d')
+
+    @classmethod
+    def from_results(cls, results, background=None, keep_blocks=True):
+        '''Build the table of a results dictionary, as returned by
+        :func:`~xenon.core.harvest`.'''
+        table = cls(keep_blocks)
+        for module, blocks in results.items():
+            table.add(module, blocks)
+        for blocks in (background or {}).values():
+            table.add_background(blocks)
+        return table
+
+    def add(self, module, blocks):
+        if isinstance(blocks, dict):
+            if blocks.get('error'):
+                self.errors[len(self.modules)] = blocks['error']
+            blocks = []
+        self.modules.append(module)
+        self.blocks.append(blocks if self.keep_blocks else None)
+        self.complexities.extend(b['complexity'] for b in blocks)
+        self.starts.append(len(self.complexities))
+
+    def add_background(self, blocks):
+        if not isinstance(blocks, dict):
+            self.background.extend(b['complexity'] for b in blocks)
+
+    def __len__(self):
+        return len(self.complexities)
+
+    def backend(self, name=None):
+        '''Return the backend called *name* (``'numpy'`` or ``'python'``).
+        By default NumPy is used when available.'''
+        if name is None:
+            name = 'numpy' if has_numpy() else 'python'
+        return (NumpyBackend if name == 'numpy' else PythonBackend)(self)
+
+    def stats(self, backend=None, percentiles=PERCENTILES):
+        '''Return the percentiles of the complexity and the number of blocks
+        of every rank, both overall and for every module.'''
+        backend = self.backend(backend)
+        modules = dict((module, summary) for module, summary in
+                       zip(self.modules, backend.module_summaries(percentiles))
+                       if summary is not None)
+        overall = backend.summary(0, len(self), percentiles,
+                                  self.background)
+        return {'overall': overall, 'modules': modules}
+
+
+class PythonBackend(object):
+    '''The operations on a :class:`BlockTable`, in plain Python.'''
+
+    def __init__(self, table):
+        self.table = table
+
+    def blocks_above(self, limit):
+        '''Return the indices of the blocks more complex than *limit*.'''
+        return [i for i, cc in enumerate(self.table.complexities)
+                if cc > limit]
+
+    def blocks_above_each(self, limits):
+        '''Return the indices of the blocks more complex than the limit of
+        their module, ``None`` meaning no limit.'''
+        cx, starts = self.table.complexities, self.table.starts
+        above = []
+        for i, limit in enumerate(limits):
+            if limit is not None:
+                above.extend(j for j in range(starts[i], starts[i + 1])
+                             if cx[j] > limit)
+        return above
+
+    def module_averages(self):
+        '''Return the average complexity of every module, 0 for the empty
+        ones.'''
+        cx, starts = self.table.complexities, self.table.starts
+        return [sum(cx[starts[i]:starts[i + 1]]) /
+                (starts[i + 1] - starts[i])
+                if starts[i + 1] > starts[i] else 0
+                for i in range(len(starts) - 1)]
+
+    def total(self):
+        '''Return the sum of the complexities and the number of blocks,
+        background included.'''
+        table = self.table
+        return (sum(table.complexities) + sum(table.background),
+                len(table.complexities) + len(table.background))
+
+    def module_summaries(self, percentiles):
+        '''Return the summary of every module, ``None`` for the empty
+        ones.'''
+        starts = self.table.starts
+        return [self.summary(starts[i], starts[i + 1], percentiles)
+                if starts[i + 1] > starts[i] else None
+                for i in range(len(starts) - 1)]
+
+    def summary(self, start, end, percentiles, extra=()):
+        '''Return the percentiles and the rank histogram of the blocks
+        between *start* and *end*, plus the *extra* complexities.'''
+        values = sorted(self.table.complexities[start:end])
+        if extra:
+            values = sorted(values + list(extra))
+        summary = dict(('p%d' % q, _percentile(values, q))
+                       for q in percentiles)
+        summary['ranks'] = _histogram(values)
+        return summary
+
+
+class NumpyBackend(PythonBackend):
+    '''The operations on a :class:`BlockTable`, vectorized with NumPy.'''
+
+    def __init__(self, table):
+        import numpy
+
+        PythonBackend.__init__(self, table)
+        self.np = numpy
+        # Views on the arrays, nothing is copied
+        self.cx = numpy.frombuffer(table.complexities, dtype=numpy.float64) \
+            if len(table.complexities) else numpy.zeros(0)
+        self.starts = numpy.frombuffer(table.starts, dtype=numpy.dtype('l'))
+
+    def blocks_above(self, limit):
+        return self.np.flatnonzero(self.cx > limit).tolist()
+
+    def blocks_above_each(self, limits):
+        np = self.np
+        limits = np.array([np.inf if limit is None else limit
+                           for limit in limits], dtype=np.float64)
+        limits = np.repeat(limits, np.diff(self.starts))
+        return np.flatnonzero(self.cx > limits).tolist()
+
+    def module_averages(self):
+        np = self.np
+        sums = np.concatenate(([0.], np.cumsum(self.cx)))
+        counts = np.diff(self.starts)
+        totals = sums[self.starts[1:]] - sums[self.starts[:-1]]
+        return np.where(counts > 0, totals / np.maximum(counts, 1),
+                        0).tolist()
+
+    def total(self):
+        background = self.table.background
+        return (float(self.cx.sum()) + sum(background),
+                len(self.cx) + len(background))
+
+    def module_summaries(self, percentiles):
+        # Sort the complexities of every module at once, by sorting on the
+        # module index first
+        np = self.np
+        counts = np.diff(self.starts)
+        owners = np.repeat(np.arange(len(counts)), counts)
+        values = self.cx[np.lexsort((self.cx, owners))]
+        starts = self.starts[:-1]
+        last = np.maximum(counts - 1, 0)
+        points = []
+        for q in percentiles:
+            pos = last * (q / 100.)
+            low = np.floor(pos).astype(int)
+            high = np.minimum(low + 1, last)
+            if len(values):
+                lows = values[np.minimum(starts + low, len(values) - 1)]
+                highs = values[np.minimum(starts + high, len(values) - 1)]
+            else:
+                lows = highs = np.zeros(len(counts))
+            points.append((lows + (highs - lows) * (pos - low)).tolist())
+        ranks = np.bincount(
+            owners * len(RANKS) + np.searchsorted(RANK_LIMITS, self.cx),
+            minlength=len(counts) * len(RANKS)).reshape(-1, len(RANKS))
+        summaries = []
+        for i, count in enumerate(counts.tolist()):
+            if not count:
+                summaries.append(None)
+                continue
+            summary = dict(('p%d' % q, point[i])
+                           for q, point in zip(percentiles, points))
+            summary['ranks'] = dict(zip(RANKS, ranks[i].tolist()))
+            summaries.append(summary)
+        return summaries
+
+    def summary(self, start, end, percentiles, extra=()):
+        np = self.np
+        values = self.cx[start:end]
+        if len(extra):
+            values = np.concatenate((values, np.frombuffer(extra)))
+        if not len(values):
+            return PythonBackend.summary(self, 0, 0, percentiles)
+        points = np.percentile(values, percentiles)
+        summary = dict(('p%d' % q, float(p))
+                       for q, p in zip(percentiles, points))
+        counts = np.bincount(np.searchsorted(RANK_LIMITS, values),
+                             minlength=len(RANKS))
+        summary['ranks'] = dict(zip(RANKS, counts.tolist()))
+        return summary
+
+
+def evaluate(table, args, logger, baseline=None, backend=None):
+    '''Check the blocks in *table* against the thresholds in *args*, logging
+    the infractions through *logger* exactly like
+    :class:`~xenon.core.Checker` does. Return the number of infractions.
+
+    When *args* has per-path ``policies``, every module gets its own limits,
+    and the blocks above them are still found in a single pass.'''
+    from xenon.core import Checker
+
+    ops = table.backend(backend)
+    checker = Checker(args, logger, baseline)
+    if checker.policies is None:
+        policies = [checker.policy] * len(table.modules)
+        limit = checker.policy.block_limit
+        above = ops.blocks_above(limit) if limit is not None else []
+    else:
+        policies = [checker.policy_of(module) for module in table.modules]
+        above = ops.blocks_above_each([p.block_limit for p in policies])
+    averages = None
+    if any(p.module_limit is not None for p in set(policies)):
+        averages = ops.module_averages()
+    pos = 0
+    for i, module in enumerate(table.modules):
+        if i in table.errors:
+            checker.logger.warning('cannot parse %s: %s', module,
+                                   table.errors[i])
+            continue
+        start, end = table.starts[i], table.starts[i + 1]
+        policy = policies[i]
+        while pos < len(above) and above[pos] < end:
+            block = table.blocks[i][above[pos] - start]
+            checker.infractions += checker.report_block(
+                module, block, rank_of(table.complexities[above[pos]]),
+                policy.absolute)
+            pos += 1
+        if averages is not None and policy.module_limit is not None and \
+                averages[i] > policy.module_limit:
+            checker.infractions += checker.report_module(
+                module, rank_of(averages[i]), policy.modules)
+    checker.total_cc, checker.total_blocks = ops.total()
+    return checker.finish()
+
+
+def log_stats(logger, results, backend=None):
+    '''Log the overall statistics of *results* through *logger*.'''
+    table = BlockTable.from_results(results, keep_blocks=False)
+    overall = table.stats(backend)['overall']
+    logger.info('stats: %s', ', '.join('p%d %.1f' % (q, overall['p%d' % q])
+                                       for q in PERCENTILES))
+    logger.info('stats: %s', ', '.join('%s %d' % (r, overall['ranks'][r])
+                                       for r in RANKS))
+
+
+def _percentile(values, q):
+    '''Return the *q*-th percentile of the sorted *values*, interpolating
+    linearly like NumPy does by default.'''
+    if not values:
+        return 0.
+    pos = (len(values) - 1) * q / 100.
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return float(values[low] + (values[high] - values[low]) * (pos - low))
+
+
+def _histogram(values):
+    counts = dict.fromkeys(RANKS, 0)
+    for value in values:
+        counts[rank_of(value)] += 1
+    return counts
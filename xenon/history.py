@@ -0,0 +1,247 @@
+'''This module implements ``xenon history``, which follows the complexity of
+the code base commit after commit.
+
+Nothing is checked out: the commits and the files they change come from a
+single ``git log``, and the files are read from the object store by a single
+``git cat-file --batch`` process. Every distinct blob is analyzed once, no
+matter how many commits contain it, and its results go through the usual
+cache, which is keyed by the very same hash. The aggregates of every commit
+are then updated with the files it changed only, so the cost of the scan is
+about the cost of analyzing the unique blobs.
+
+The time series is written as JSON lines, one per commit, oldest first. Each
+line holds the hash, timestamp and subject of the commit, the number of
+modules and blocks, the average complexity and its rank, the number of
+infractions of the thresholds, and in ``ranks`` the rank of the modules
+which changed (all of them in the first line), ``null`` for the ones removed
+or which cannot be parsed.
+'''
+
+import sys
+import json
+import logging
+
+from radon.complexity import cc_rank
+
+from xenon.core import Config, analyze_source, av, open_cache, resolve_jobs
+from xenon.evaluation import rank_limit
+
+_cat_files = {}
+
+
+def blob_stats(blocks, block_limit):
+    '''Return the sum of the complexity of *blocks*, their number and how
+    many of them are more complex than *block_limit*, or ``None`` if the
+    module cannot be parsed.'''
+    if isinstance(blocks, dict):
+        return None
+    complexities = [block['complexity'] for block in blocks]
+    above = 0
+    if block_limit is not None:
+        above = sum(1 for cc in complexities if cc > block_limit)
+    return sum(complexities), len(complexities), above
+
+
+def _blob_task(task):
+    '''Worker function: read the blob *sha* with the ``cat-file`` process of
+    the repository in *cwd*, started once per process, and analyze it.'''
+    from xenon.repository import CatFile
+
+    cwd, sha, no_assert = task
+    cat_file = _cat_files.get(cwd)
+    if cat_file is None:
+        cat_file = _cat_files[cwd] = CatFile(cwd)
+    return sha, analyze_source(cat_file.read(sha), no_assert)
+
+
+def analyze_blobs(blobs, cwd, config, block_limit=None, jobs=1,
+                  cache=None):
+    '''Analyze the blobs whose hashes are in *blobs*, in the repository
+    in *cwd*. Return a dictionary mapping every hash to its statistics (see
+    :func:`blob_stats`): the blocks themselves are not kept.'''
+    from xenon.core import parallel_map
+
+    stats = {}
+    missing = []
+    for sha in blobs:
+        blocks = cache.get(sha) if cache is not None else None
+        if blocks is None:
+            missing.append(sha)
+        else:
+            stats[sha] = blob_stats(blocks, block_limit)
+    tasks = ((cwd, sha, config.no_assert) for sha in missing)
+    try:
+        for sha, blocks in parallel_map(_blob_task, tasks, jobs):
+            stats[sha] = blob_stats(blocks, block_limit)
+            if cache is not None:
+                cache.set(sha, blocks)
+    finally:
+        cat_file = _cat_files.pop(cwd, None)
+        if cat_file is not None:
+            cat_file.close()
+    return stats
+
+
+class Series(object):
+    '''The aggregates of the files of a commit, updated a file at a time.
+    *block_limit* and *module_limit* are the highest complexities allowed,
+    *average* the highest rank of the average complexity.'''
+
+    def __init__(self, block_limit=None, module_limit=None, average=None):
+        self.block_limit = block_limit
+        self.module_limit = module_limit
+        self.average = average
+        self.files = {}
+        self.total_cc = 0.
+        self.total_blocks = 0
+        self.modules = 0
+        self.infractions = 0
+
+    def _account(self, stats, sign):
+        if stats is None:
+            return
+        cc, blocks, above = stats
+        self.total_cc += sign * cc
+        self.total_blocks += sign * blocks
+        # Like in the results of the analysis, modules without blocks are
+        # not counted
+        self.modules += sign if blocks else 0
+        self.infractions += sign * above
+        if self.module_limit is not None and av(cc, blocks) > \
+                self.module_limit:
+            self.infractions += sign
+
+    def update(self, path, stats):
+        '''Replace the statistics of the file *path* (see
+        :func:`blob_stats`). *stats* is ``None`` when the file was removed
+        or cannot be parsed. Return the new rank of the module.'''
+        self._account(self.files.pop(path, None), -1)
+        if stats is None:
+            return None
+        self.files[path] = stats
+        self._account(stats, 1)
+        return cc_rank(av(stats[0], stats[1]))
+
+    def point(self):
+        '''Return the aggregates of the current files.'''
+        average = av(self.total_cc, self.total_blocks)
+        rank = cc_rank(average)
+        infractions = self.infractions
+        if self.average is not None and rank > self.average:
+            infractions += 1
+        return {'modules': self.modules, 'blocks': self.total_blocks,
+                'average': round(average, 4), 'rank': rank,
+                'infractions': infractions}
+
+
+def history(rev_range, cwd, config, args, jobs=1, cache=None):
+    '''Yield the point of the time series of every commit in *rev_range*
+    (see the module documentation). The files below *cwd* are analyzed, and
+    *args* holds the ``absolute``, ``modules`` and ``average``
+    thresholds.'''
+    from xenon.repository import iter_history, tree_blobs
+
+    discovery = config.discovery()
+    commits = list(iter_history(rev_range, cwd))
+    if not commits:
+        return
+    initial = {}
+    if commits[0][1] is not None:
+        initial = tree_blobs(commits[0][1], cwd)
+        initial = dict((path.replace('\\', '/'), blob)
+                       for path, blob in initial.items())
+    initial = dict((path, blob) for path, blob in initial.items()
+                   if discovery.accepts(path))
+    blobs = set(initial.values())
+    for commit in commits:
+        commit[4][:] = [(path, blob) for path, blob in commit[4]
+                        if discovery.accepts(path)]
+        blobs.update(blob for _, blob in commit[4] if blob is not None)
+    block_limit = rank_limit(args.absolute)
+    stats = analyze_blobs(sorted(blobs), cwd, config, block_limit, jobs,
+                          cache)
+    series = Series(block_limit, rank_limit(args.modules), args.average)
+    for i, (sha, _, timestamp, subject, changes) in enumerate(commits):
+        if i == 0:
+            # The first point lists all the modules
+            changes = sorted(initial.items()) + changes
+        ranks = {}
+        for path, blob in changes:
+            ranks[path] = series.update(
+                path, stats[blob] if blob is not None else None)
+        point = {'commit': sha, 'timestamp': timestamp, 'subject': subject}
+        point.update(series.point())
+        point['ranks'] = ranks
+        yield point
+
+
+def parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='xenon history', description='Follow the complexity along the '
+        'first-parent history, writing one JSON line per commit.')
+    parser.add_argument('rev_range', help='The commits to analyze, e.g. '
+                        'HEAD~100..HEAD or v1.0..main')
+    parser.add_argument('path', nargs='?', default='.',
+                        help='Directory of the repository to analyze '
+                        '(default: %(default)s)')
+    parser.add_argument('-b', '--max-absolute', metavar='<str>',
+                        dest='absolute', help='Threshold for the rank of '
+                        'the blocks')
+    parser.add_argument('-m', '--max-modules', metavar='<str>',
+                        dest='modules', help='Threshold for the rank of '
+                        'the modules')
+    parser.add_argument('-a', '--max-average', metavar='<str>',
+                        dest='average', help='Threshold for the rank of the '
+                        'average complexity')
+    parser.add_argument('-e', '--exclude', metavar='<str>', dest='exclude',
+                        help='Comma separated list of patterns to exclude')
+    parser.add_argument('-i', '--ignore', metavar='<str>', dest='ignore',
+                        help='Comma separated list of patterns to ignore')
+    parser.add_argument('--no-assert', dest='no_assert', action='store_true',
+                        help='Do not count assert statements')
+    parser.add_argument('-j', '--jobs', metavar='<int>', dest='jobs',
+                        type=int, default=1, help='Number of processes used '
+                        'to analyze the blobs, 0 means one per CPU '
+                        '(default: %(default)s)')
+    parser.add_argument('--cache-dir', metavar='<path>', dest='cache_dir',
+                        default='.xenon_cache', help='Directory where the '
+                        'results of the blobs are cached (default: '
+                        '%(default)s)')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                        help='Do not read nor write the results cache')
+    parser.add_argument('-o', '--output', metavar='<path>', dest='output',
+                        help='Write the time series to this file instead of '
+                        'the standard output')
+    args = parser.parse_args(argv)
+    for attr in ('absolute', 'modules', 'average'):
+        value = getattr(args, attr)
+        setattr(args, attr, value.upper() if value else None)
+    return args
+
+
+def main(argv):
+    '''Entry point of ``xenon history``. The exit code is 2 if the history
+    cannot be read.'''
+    import subprocess
+
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger('xenon')
+    config = Config(args.exclude, args.ignore, args.no_assert)
+    cache = open_cache(args, config)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for point in history(args.rev_range, args.path, config, args,
+                             resolve_jobs(args.jobs), cache):
+            output.write(json.dumps(point, sort_keys=True) + '\n')
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error('cannot read the history: %s', e)
+        return 2
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    if cache is not None:
+        cache.prune()
+    return 0
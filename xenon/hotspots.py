@@ -0,0 +1,197 @@
+'''This module implements ``xenon hotspots``, which ranks the blocks worth
+refactoring first: the complex ones in the files that change often.
+
+The score of a block is its complexity times the number of commits which
+changed its file. The number of commits of every file comes from a single
+``git log --numstat``, parsed as it is produced, and only the files being
+analyzed are counted. The blocks are then ranked as the analysis yields them,
+keeping only the best ones in a bounded heap, so memory depends on the number
+of files and on the length of the ranking, never on the length of the
+history.
+'''
+
+import os
+import sys
+import json
+import heapq
+import logging
+
+from xenon.core import Config, iter_harvest, open_cache, resolve_jobs
+from xenon.evaluation import rank_of
+from xenon.prefetch import DEFAULT_READERS
+
+#: Default length of the ranking.
+DEFAULT_TOP = 20
+
+
+class Hotspot(object):
+    '''A *block* of *module*, changed by *commits* commits adding or removing
+    *lines* lines in total.'''
+
+    __slots__ = ('module', 'block', 'commits', 'lines')
+
+    def __init__(self, module, block, commits, lines):
+        self.module = module
+        self.block = block
+        self.commits = commits
+        self.lines = lines
+
+    @property
+    def score(self):
+        return self.block['complexity'] * self.commits
+
+    def as_dict(self):
+        return {
+            'module': self.module,
+            'name': self.block['name'],
+            'lineno': self.block['lineno'],
+            'endline': self.block['endline'],
+            'complexity': self.block['complexity'],
+            'rank': rank_of(self.block['complexity']),
+            'commits': self.commits,
+            'lines': self.lines,
+            'score': self.score,
+        }
+
+
+def file_churn(changes, modules):
+    '''Count the commits and the lines changed of every file in *modules*,
+    given the ``(path, added, deleted)`` *changes* yielded by
+    :func:`~xenon.repository.iter_numstat`. Return a dictionary mapping the
+    paths to ``[commits, lines]``.'''
+    churn = dict((module, [0, 0]) for module in modules)
+    for path, added, deleted in changes:
+        counts = churn.get(path)
+        if counts is not None:
+            counts[0] += 1
+            counts[1] += (added or 0) + (deleted or 0)
+    return churn
+
+
+def rank_hotspots(results, churn, top=DEFAULT_TOP):
+    '''Return the *top* :class:`Hotspot` objects with the highest score,
+    best first, among the ``(module, blocks)`` *results*. *churn* maps the
+    modules to ``[commits, lines]``, as returned by :func:`file_churn`.
+    Blocks with the same score keep the order of *results*.'''
+    if top < 1:
+        return []
+    heap = []
+    seq = 0
+    for module, blocks in results:
+        commits, lines = churn.get(module, (0, 0))
+        if not commits or isinstance(blocks, dict):
+            continue
+        for block in blocks:
+            # The heap keeps the worst entry first: on equal scores, the
+            # later blocks go first
+            seq -= 1
+            entry = (block['complexity'] * commits, seq, module, block)
+            if len(heap) < top:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+    return [Hotspot(module, block, churn[module][0], churn[module][1])
+            for _, _, module, block in sorted(heap, reverse=True)]
+
+
+def hotspots(paths, config, rev='HEAD', since=None, top=DEFAULT_TOP,
+             jobs=1, cache=None):
+    '''Rank the blocks of the files found in *paths* (see the module
+    documentation), counting the commits reachable from *rev* and more
+    recent than *since*. Return the list of :class:`Hotspot` objects.'''
+    from xenon.repository import iter_numstat
+
+    filenames = list(config.discovery().iter(paths))
+    # Git paths are relative to the current directory
+    modules = dict((os.path.normpath(os.path.relpath(name)), name)
+                   for name in filenames)
+    churn = file_churn(iter_numstat(rev, paths, since), modules)
+    churn = dict((modules[path], counts) for path, counts in churn.items())
+    results = iter_harvest(filenames, config, jobs, cache,
+                           readers=DEFAULT_READERS)
+    return rank_hotspots(results, churn, top)
+
+
+def write_text(output, spots):
+    '''Write the ranking *spots* as a table.'''
+    output.write('%7s %4s %8s %7s  %s\n' % ('score', 'cc', 'commits',
+                                            'lines', 'block'))
+    for spot in spots:
+        block = spot.block
+        output.write('%7d %4d %8d %7d  %s:%s %s\n' % (
+            spot.score, block['complexity'], spot.commits, spot.lines,
+            spot.module, block['lineno'], block['name']))
+
+
+def parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='xenon hotspots', description='Rank the blocks by their '
+        'complexity times the number of commits which changed their file.')
+    parser.add_argument('path', nargs='*', default=['.'],
+                        help='Directories or files to analyze, in a Git '
+                        'repository (default: the current directory)')
+    parser.add_argument('-n', '--top', metavar='<int>', dest='top', type=int,
+                        default=DEFAULT_TOP, help='Number of blocks to report '
+                        '(default: %(default)s)')
+    parser.add_argument('-r', '--rev', metavar='<rev>', dest='rev',
+                        default='HEAD', help='Count the commits reachable '
+                        'from this revision (default: %(default)s)')
+    parser.add_argument('--since', metavar='<date>', dest='since',
+                        help='Only count the commits more recent than this '
+                        'date, e.g. "6 months ago"')
+    parser.add_argument('-e', '--exclude', metavar='<str>', dest='exclude',
+                        help='Comma separated list of patterns to exclude')
+    parser.add_argument('-i', '--ignore', metavar='<str>', dest='ignore',
+                        help='Comma separated list of patterns to ignore')
+    parser.add_argument('--no-assert', dest='no_assert', action='store_true',
+                        help='Do not count assert statements')
+    parser.add_argument('-j', '--jobs', metavar='<int>', dest='jobs',
+                        type=int, default=1, help='Number of processes used '
+                        'to analyze the files, 0 means one per CPU '
+                        '(default: %(default)s)')
+    parser.add_argument('--cache-dir', metavar='<path>', dest='cache_dir',
+                        default='.xenon_cache', help='Directory where the '
+                        'results of unchanged files are cached (default: '
+                        '%(default)s)')
+    parser.add_argument('--no-cache', dest='no_cache', action='store_true',
+                        help='Do not read nor write the results cache')
+    parser.add_argument('--json', dest='json', action='store_true',
+                        help='Write the ranking as JSON instead of a table')
+    parser.add_argument('-o', '--output', metavar='<path>', dest='output',
+                        help='Write the ranking to this file instead of the '
+                        'standard output')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    '''Entry point of ``xenon hotspots``. The exit code is 2 if the history
+    cannot be read.'''
+    import subprocess
+
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger('xenon')
+    config = Config(args.exclude, args.ignore, args.no_assert)
+    cache = open_cache(args, config)
+    try:
+        spots = hotspots(args.path, config, args.rev, args.since,
+                         max(0, args.top), resolve_jobs(args.jobs), cache)
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error('cannot read the history: %s', e)
+        return 2
+    if cache is not None:
+        cache.prune()
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        if args.json:
+            json.dump({'hotspots': [spot.as_dict() for spot in spots]},
+                      output, indent=2)
+            output.write('\n')
+        else:
+            write_text(output, spots)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
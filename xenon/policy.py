@@ -0,0 +1,230 @@
+'''This module applies different thresholds to different parts of the tree.
+
+The ``policies`` of ``.xenon.yml`` are rules made of a ``path`` glob and of
+the ``max_absolute`` and ``max_modules`` thresholds to use for the modules it
+matches, instead of the ones given on the command line::
+
+    policies:
+      - path: tests/
+        max_absolute: C
+      - path: legacy/**
+        max_absolute: F
+        max_modules: null
+      - path: "*/migrations/*.py"
+        max_modules: D
+
+Paths are relative to the current directory, with ``/`` separators, and a
+rule matching a directory applies to all the files below it. When several
+rules match a module, the later ones take precedence, threshold by threshold;
+``null`` lifts a threshold. The average complexity is the one of the whole
+code base, so its threshold cannot change from one path to another.
+``xenon --server`` sends the rules along with the query, and the server
+matches them relative to the directory of the client, like the module names
+it reports.
+
+Rules are compiled once into a trie of their leading literal directories, so
+finding the rules of a module takes one step per directory, however many
+rules there are; only the globs below those directories are matched. Those
+globs (e.g. the ones without a literal prefix, like ``*/migrations/*.py``)
+are indexed by one of their literal components, which the module has to
+contain, and the globs without any are joined into alternations, so that the
+regular expression engine tries them all at once.
+'''
+
+import os
+import re
+import fnmatch
+
+from xenon.evaluation import RANKS, rank_limit
+
+#: The thresholds a rule can set.
+THRESHOLDS = ('max_absolute', 'max_modules')
+#: The characters which make a path component a glob.
+GLOB_CHARS = re.compile(r'[*?[]')
+#: How many globs are joined into an alternation. Python 2 does not allow
+#: more than 100 groups in a regular expression.
+ALTERNATION_SIZE = 99
+
+
+class PolicyError(ValueError):
+    '''Raised when the policies are not valid.'''
+
+
+class Policy(object):
+    '''The thresholds applied to a module: the highest rank of its blocks
+    (*absolute*) and of the module itself (*modules*), ``None`` for no
+    threshold.'''
+
+    __slots__ = ('absolute', 'modules', 'block_limit', 'module_limit')
+
+    def __init__(self, absolute=None, modules=None):
+        self.absolute = absolute
+        self.modules = modules
+        self.block_limit = rank_limit(absolute)
+        self.module_limit = rank_limit(modules)
+
+    def __repr__(self):
+        return 'Policy(%r, %r)' % (self.absolute, self.modules)
+
+
+class _Node(object):
+
+    __slots__ = ('children', 'rules', 'literals', 'globs', 'alternations')
+
+    def __init__(self):
+        self.children = {}
+        #: The rules whose path ends here.
+        self.rules = []
+        #: The rules whose literal directories end here, followed by a glob
+        #: with a literal component, by the last such component: the path of
+        #: the module has to contain it. The values are ``(rule, match)``
+        #: pairs.
+        self.literals = {}
+        #: ``(rule, regex)`` pairs of the other rules whose literal
+        #: directories end here, followed by a glob.
+        self.globs = []
+        #: ``(match, globs)`` pairs, where *match* is the alternation of
+        #: *globs*, built when they are first matched.
+        self.alternations = None
+
+    def add_glob(self, index, parts, regex):
+        '''Add the *index*-th rule, whose glob is made of *parts* and is
+        translated into *regex*.'''
+        # The first part is a glob, so the others are preceded by a slash
+        literal = [part for part in parts[1:] if not GLOB_CHARS.search(part)]
+        if literal:
+            self.literals.setdefault(literal[-1], []).append(
+                (index, re.compile(regex).match))
+        else:
+            self.globs.append((index, regex))
+            self.alternations = None
+
+    def match_globs(self, parts):
+        '''Return the rules whose glob matches the path made of *parts*.'''
+        path = '/'.join(parts)
+        matched = []
+        if self.literals:
+            for part in set(parts):
+                matched.extend(index for index, match
+                               in self.literals.get(part, ()) if match(path))
+        if self.alternations is None:
+            self.alternations = []
+            for start in range(0, len(self.globs), ALTERNATION_SIZE):
+                globs = self.globs[start:start + ALTERNATION_SIZE]
+                regex = '|'.join('(?P<rule%d>%s)' % (i, regex)
+                                 for i, (_, regex) in enumerate(globs))
+                self.alternations.append((re.compile(regex).match, [
+                    (index, re.compile(regex).match)
+                    for index, regex in globs]))
+        for match, globs in self.alternations:
+            found = match(path)
+            if found is None:
+                continue
+            # The first glob which matches is known, the later ones are not
+            first = int(found.lastgroup[4:])
+            matched.append(globs[first][0])
+            matched.extend(index for index, match in globs[first + 1:]
+                           if match(path))
+        return matched
+
+
+class PolicyIndex(object):
+    '''The compiled *rules*, a list of dictionaries as found in the
+    ``policies`` of the configuration file, whose paths are relative to the
+    *root* directory (the current directory by default), like the relative
+    paths of the modules.'''
+
+    def __init__(self, rules, root=None):
+        self.rules = rules
+        self.root_dir = root
+        self.root = _Node()
+        self.overrides = []
+        self._policies = {}
+        if not isinstance(rules, list):
+            raise PolicyError('policies must be a list of rules')
+        for i, rule in enumerate(rules):
+            self.add(i, rule)
+
+    def __len__(self):
+        return len(self.overrides)
+
+    def add(self, index, rule):
+        '''Compile *rule*, which is the *index*-th one.'''
+        if not isinstance(rule, dict) or not rule.get('path'):
+            raise PolicyError('every policy needs a path: %r' % (rule,))
+        if 'max_average' in rule:
+            raise PolicyError('the average complexity is global, it has no '
+                              'threshold for %s' % rule['path'])
+        unknown = set(rule) - set(THRESHOLDS) - set(['path'])
+        if unknown:
+            raise PolicyError('unknown settings for %s: %s' % (
+                rule['path'], ', '.join(sorted(unknown))))
+        overrides = {}
+        for key in THRESHOLDS:
+            if key in rule:
+                overrides[key] = _rank(rule[key], rule['path'])
+        self.overrides.append(overrides)
+        parts = _split(str(rule['path']))
+        node = self.root
+        while parts and not GLOB_CHARS.search(parts[0]):
+            node = node.children.setdefault(parts.pop(0), _Node())
+        if not parts:
+            node.rules.append(index)
+            return
+        pattern = '/'.join(parts)
+        # The glob matches the files, or the directories holding them
+        node.add_glob(index, parts, '(?:%s)|(?:%s)' % (
+            fnmatch.translate(pattern), fnmatch.translate(pattern + '/*')))
+
+    def match(self, module):
+        '''Return the indices of the rules matching *module*, in order.'''
+        parts = _split(module, self.root_dir)
+        node = self.root
+        matched = []
+        for depth in range(len(parts) + 1):
+            if (node.literals or node.globs) and depth < len(parts):
+                matched.extend(node.match_globs(parts[depth:]))
+            if depth == len(parts):
+                break
+            node = node.children.get(parts[depth])
+            if node is None:
+                break
+            matched.extend(node.rules)
+        return sorted(matched)
+
+    def resolve(self, module, default):
+        '''Return the :class:`Policy` of *module*, starting from the
+        *default* one. The policies are shared by the modules matching the
+        same rules.'''
+        matched = tuple(self.match(module))
+        if not matched:
+            return default
+        key = (matched, default.absolute, default.modules)
+        policy = self._policies.get(key)
+        if policy is None:
+            settings = {'max_absolute': default.absolute,
+                        'max_modules': default.modules}
+            for index in matched:
+                settings.update(self.overrides[index])
+            policy = self._policies[key] = Policy(settings['max_absolute'],
+                                                  settings['max_modules'])
+        return policy
+
+
+def _split(path, root=None):
+    '''Split *path* into its components, with the case normalized like in
+    :mod:`xenon.discovery`. Absolute paths are made relative to *root* (the
+    current directory by default).'''
+    if os.path.isabs(path):
+        path = os.path.relpath(path, root or os.curdir)
+    path = os.path.normcase(os.path.normpath(path)).replace(os.sep, '/')
+    return [part for part in path.split('/') if part not in ('', '.')]
+
+
+def _rank(value, path):
+    if value is None:
+        return None
+    value = str(value).upper()
+    if value not in RANKS:
+        raise PolicyError('invalid rank for %s: %s' % (path, value))
+    return value
@@ -0,0 +1,59 @@
+'''This module reads the files ahead of the analysis.
+
+On network or overlay filesystems every read can take much longer than
+parsing the file, and reading the files one after the other leaves the CPU
+idle. :func:`prefetch` hands the reads to a small pool of threads, which
+release the GIL while they wait, and yields the contents in the original
+order as soon as they are available. The number of files read ahead is
+bounded, so memory stays capped however large the tree is.
+'''
+
+import sys
+import collections
+
+#: Default number of reader threads.
+DEFAULT_READERS = 4
+
+
+def read_file(name):
+    '''Return the content of the file *name* (``'-'`` is standard input),
+    as bytes when it is read from disk.'''
+    if name == '-':
+        return sys.stdin.read()
+    with open(name, 'rb') as fobj:
+        return fobj.read()
+
+
+def prefetch(filenames, readers=DEFAULT_READERS, depth=None, read=read_file):
+    '''Yield ``(name, content)`` for every name in *filenames*, in order.
+
+    The files are read by *readers* threads, at most *depth* files ahead of
+    the one being yielded (four per thread by default). Errors raised while
+    reading a file are raised again when its turn comes. Without
+    :mod:`concurrent.futures` (Python 2 without the ``futures`` backport)
+    the files are read one after the other.
+    '''
+    try:
+        from concurrent.futures import ThreadPoolExecutor
+    except ImportError:  # pragma: no cover
+        for name in filenames:
+            yield name, read(name)
+        return
+
+    depth = max(1, depth or readers * 4)
+    pending = collections.deque()
+    executor = ThreadPoolExecutor(readers)
+    try:
+        for name in filenames:
+            pending.append((name, executor.submit(read, name)))
+            if len(pending) >= depth:
+                name, future = pending.popleft()
+                yield name, future.result()
+        while pending:
+            name, future = pending.popleft()
+            yield name, future.result()
+    finally:
+        # We may have stopped early: do not read the remaining files
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,304 @@
+'''This module contains the reporters, which write the outcome of the checks
+in machine-readable formats, selected with ``--format``.
+
+Reporters are fed by the :class:`~xenon.core.Checker` during the single
+analysis pass, a module at a time, and they write their output as they go:
+nothing is built in memory besides the current module. The formats are:
+
+* ``json``: the blocks and infractions of every module, and the average
+  complexity;
+* ``sarif``: the infractions as a SARIF 2.1.0 log, for code scanning tools;
+* ``junit``: a JUnit XML report, with a test suite per module and a test
+  case per block;
+* ``github``: GitHub Actions workflow commands, which annotate the code.
+'''
+
+import sys
+import json
+
+from xenon.blocks import to_json
+
+SARIF_SCHEMA = 'https://json.schemastore.org/sarif-2.1.0.json'
+#: The SARIF rule of every kind of infraction.
+RULES = {
+    'block': ('XEN001', 'Block complexity'),
+    'module': ('XEN002', 'Module complexity'),
+    'average': ('XEN003', 'Average complexity'),
+    'total average': ('XEN003', 'Average complexity'),
+}
+
+
+class Infraction(object):
+    '''A threshold exceeded by a *block* of *module* (``kind`` is
+    ``'block'``), by a module (``'module'``) or by the whole code base
+    (``'average'`` and ``'total average'``, *module* and *block* are then
+    ``None``). *value* is the rank or the complexity, *threshold* the limit
+    it exceeds.'''
+
+    __slots__ = ('kind', 'module', 'block', 'value', 'threshold')
+
+    def __init__(self, kind, module, block, value, threshold):
+        self.kind = kind
+        self.module = module
+        self.block = block
+        self.value = value
+        self.threshold = threshold
+
+    @property
+    def message(self):
+        if self.kind == 'block':
+            return 'block "%s" has a rank of %s (max %s)' % (
+                self.block['name'], self.value, self.threshold)
+        if self.kind == 'module':
+            return 'module has a rank of %s (max %s)' % (self.value,
+                                                         self.threshold)
+        if self.kind == 'average':
+            return 'average complexity is ranked %s (max %s)' % (
+                self.value, self.threshold)
+        return 'total average complexity is %s (max %s)' % (self.value,
+                                                            self.threshold)
+
+    def as_dict(self):
+        result = {'type': self.kind, 'value': self.value,
+                  'threshold': self.threshold, 'message': self.message}
+        if self.module is not None:
+            result['module'] = self.module
+        if self.block is not None:
+            result['name'] = self.block['name']
+            result['lineno'] = self.block['lineno']
+            result['endline'] = self.block['endline']
+        return result
+
+
+class Reporter(object):
+    '''Base class of the reporters, writing to the text file *stream*.
+
+    :meth:`start` is called first, then :meth:`module` for every module
+    checked (in the order of the analysis) and :meth:`end` once all of
+    them have been checked. :meth:`close` ends the report if that did not
+    happen and closes *stream*, unless it is the standard output.
+    '''
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.ended = False
+
+    def write(self, text):
+        self.stream.write(text)
+
+    def start(self):
+        pass
+
+    def module(self, module, blocks, infractions):
+        '''Report the *blocks* of *module*, or ``{'error': message}`` if it
+        cannot be parsed, and its *infractions*.'''
+
+    def end(self, infractions, summary):
+        '''Report the *infractions* of the whole code base and the
+        *summary* of the analysis: number of blocks, average complexity and
+        its rank, total number of infractions.'''
+        self.ended = True
+
+    def close(self):
+        if not self.ended:
+            self.end([], None)
+        if self.stream not in (sys.stdout, sys.__stdout__):
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class JSONReporter(Reporter):
+    '''Write a JSON document: ``{"modules": {path: {"blocks": [...],
+    "infractions": [...]}}, "infractions": [...], "summary": {...}}``, where
+    the top-level infractions are the ones of the whole code base. Modules
+    which cannot be parsed have an ``error`` instead of their blocks.'''
+
+    def start(self):
+        self.write('{"modules": {')
+        self.first = True
+
+    def module(self, module, blocks, infractions):
+        if isinstance(blocks, dict):
+            entry = {'error': blocks.get('error')}
+        else:
+            entry = {'blocks': blocks}
+        entry['infractions'] = [i.as_dict() for i in infractions]
+        self.write('%s%s: ' % ('' if self.first else ', ',
+                               json.dumps(module)))
+        self.write(json.dumps(entry, default=to_json))
+        self.first = False
+
+    def end(self, infractions, summary):
+        Reporter.end(self, infractions, summary)
+        self.write('}, "infractions": %s, "summary": %s}\n' % (
+            json.dumps([i.as_dict() for i in infractions]),
+            json.dumps(summary)))
+
+
+class SARIFReporter(Reporter):
+    '''Write the infractions as a SARIF log with a single run.'''
+
+    def start(self):
+        from xenon import __version__
+
+        rules = sorted(set(RULES.values()))
+        self.rule_index = dict((rule_id, i)
+                               for i, (rule_id, _) in enumerate(rules))
+        driver = {
+            'name': 'xenon',
+            'version': __version__,
+            'informationUri': 'https://github.com/rubik/xenon',
+            'rules': [{'id': rule_id, 'name': name.replace(' ', ''),
+                       'shortDescription': {'text': name}}
+                      for rule_id, name in rules],
+        }
+        self.write('{"$schema": %s, "version": "2.1.0", "runs": [{"tool": '
+                   '{"driver": %s}, "results": [' % (json.dumps(SARIF_SCHEMA),
+                                                     json.dumps(driver)))
+        self.first = True
+
+    def result(self, infraction):
+        rule_id = RULES[infraction.kind][0]
+        result = {
+            'ruleId': rule_id,
+            'ruleIndex': self.rule_index[rule_id],
+            'level': 'error',
+            'message': {'text': infraction.message},
+        }
+        if infraction.module is not None:
+            location = {'artifactLocation': {
+                'uri': infraction.module.replace('\\', '/')}}
+            if infraction.block is not None:
+                block = infraction.block
+                location['region'] = {
+                    'startLine': block['lineno'],
+                    'endLine': block['endline'] or block['lineno']}
+            result['locations'] = [{'physicalLocation': location}]
+        self.write(('' if self.first else ', ') + json.dumps(result))
+        self.first = False
+
+    def module(self, module, blocks, infractions):
+        for infraction in infractions:
+            self.result(infraction)
+
+    def end(self, infractions, summary):
+        Reporter.end(self, infractions, summary)
+        for infraction in infractions:
+            self.result(infraction)
+        self.write(']}]}\n')
+
+
+class JUnitReporter(Reporter):
+    '''Write a JUnit XML report. Every module is a test suite, holding a test
+    case for each block and one for the module itself, while the averages are
+    in the ``average`` test suite.'''
+
+    def start(self):
+        self.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                   '<testsuites name="xenon">\n')
+
+    def suite(self, name, cases):
+        '''Write the test suite *name*, with the ``(name, classname,
+        infraction)`` *cases*.'''
+        from xml.sax.saxutils import quoteattr
+
+        failures = sum(1 for case in cases if case[2] is not None)
+        self.write('  <testsuite name=%s tests="%d" failures="%d">\n' % (
+            quoteattr(name), len(cases), failures))
+        for case_name, classname, infraction in cases:
+            self.write('    <testcase name=%s classname=%s' % (
+                quoteattr(case_name), quoteattr(classname)))
+            if infraction is None:
+                self.write('/>\n')
+                continue
+            self.write('>\n      <failure type=%s message=%s/>\n'
+                       '    </testcase>\n' % (
+                           quoteattr(infraction.kind),
+                           quoteattr(infraction.message)))
+        self.write('  </testsuite>\n')
+
+    def module(self, module, blocks, infractions):
+        if isinstance(blocks, dict):
+            return
+        by_block = dict((id(i.block), i) for i in infractions
+                        if i.kind == 'block')
+        cases = [('%s:%s %s' % (module, block['lineno'], block['name']),
+                  module, by_block.get(id(block))) for block in blocks]
+        modules = [i for i in infractions if i.kind == 'module']
+        cases.append((module, module, modules[0] if modules else None))
+        self.suite(module, cases)
+
+    def end(self, infractions, summary):
+        Reporter.end(self, infractions, summary)
+        by_kind = dict((i.kind, i) for i in infractions)
+        self.suite('average', [
+            (kind, 'average', by_kind.get(kind))
+            for kind in ('average', 'total average')])
+        self.write('</testsuites>\n')
+
+
+class GitHubReporter(Reporter):
+    '''Write a GitHub Actions ``::error`` command for every infraction, which
+    shows up as an annotation of the code.'''
+
+    def annotate(self, infraction):
+        properties = ['title=%s' % _escape_property('Xenon')]
+        if infraction.module is not None:
+            properties.insert(0, 'file=%s' % _escape_property(
+                infraction.module.replace('\\', '/')))
+        if infraction.block is not None:
+            properties.insert(1, 'line=%d' % infraction.block['lineno'])
+            if infraction.block['endline']:
+                properties.insert(2, 'endLine=%d' %
+                                  infraction.block['endline'])
+        self.write('::error %s::%s\n' % (','.join(properties),
+                                         _escape_data(infraction.message)))
+
+    def module(self, module, blocks, infractions):
+        for infraction in infractions:
+            self.annotate(infraction)
+
+    def end(self, infractions, summary):
+        Reporter.end(self, infractions, summary)
+        for infraction in infractions:
+            self.annotate(infraction)
+
+
+#: The reporters selected by ``--format``.
+REPORTERS = {
+    'json': JSONReporter,
+    'sarif': SARIFReporter,
+    'junit': JUnitReporter,
+    'github': GitHubReporter,
+}
+
+
+def parse_format(value):
+    '''Split a ``--format`` value, ``name`` or ``name:path``, into the name
+    and the path (``None`` for the standard output).'''
+    name, _, path = value.partition(':')
+    return name, path or None
+
+
+def open_reporters(formats):
+    '''Return the reporters selected by the ``--format`` values in
+    *formats*, started.'''
+    import io
+
+    reporters = []
+    for value in formats or ():
+        name, path = parse_format(value)
+        stream = io.open(path, 'w', encoding='utf-8') if path else sys.stdout
+        reporter = REPORTERS[name](stream)
+        reporter.start()
+        reporters.append(reporter)
+    return reporters
+
+
+def _escape_data(text):
+    return text.replace('%', '%25').replace('\r', '%0D').replace('\n', '%0A')
+
+
+def _escape_property(text):
+    return _escape_data(text).replace(':', '%3A').replace(',', '%2C')
@@ -6,8 +6,11 @@ import subprocess
 FORMAT = '%n'.join(['%H', '%aN', '%ae', '%at', '%cN', '%ce', '%ct', '%s'])
 
 
-def git(*args):
-    p = subprocess.Popen(['git'] + list(args), stdout=subprocess.PIPE)
+def git(*args, **kwargs):
+    '''Run a Git command and return its output. The only keyword argument
+    accepted is *cwd*, the directory in which to run the command.'''
+    p = subprocess.Popen(['git'] + list(args), stdout=subprocess.PIPE,
+                         cwd=kwargs.get('cwd'))
     out, _ = p.communicate()
     ret = p.poll()
     if ret:
@@ -15,30 +18,418 @@ def git(*args):
     return out.decode('utf-8')
 
 
+def changed_files(base, cwd=None):
+    '''Return the set of files that were added or modified with respect to
+    the *base* revision, including untracked files. Deleted files are not
+    included. Paths are relative to *cwd*, and only the files below it are
+    considered.'''
+    diff = git('diff', '--name-only', '--relative', '--diff-filter=ACMRT',
+               '-z', base, '--', cwd=cwd)
+    untracked = git('ls-files', '--others', '--exclude-standard', '-z',
+                    cwd=cwd)
+    return set(os.path.normpath(p) for p in (diff + untracked).split('\0')
+               if p)
+
+
+def tree_blobs(rev, cwd=None):
+    '''Return a dictionary mapping every file of the *rev* tree that is
+    below *cwd* to the hash of its blob. Paths are relative to *cwd*.'''
+    blobs = {}
+    for line in git('ls-tree', '-r', '-z', rev, cwd=cwd).split('\0'):
+        if not line:
+            continue
+        meta, path = line.split('\t', 1)
+        _, kind, sha = meta.split()
+        if kind == 'blob':
+            blobs[os.path.normpath(path)] = sha
+    return blobs
+
+
+def staged_blobs(paths=(), cwd=None):
+    '''Return the list of ``(path, blob)`` pairs of the files added or
+    modified in the index with respect to ``HEAD``, below *paths* (all of
+    them if there are none). *blob* is the hash of the staged content.
+    Paths are relative to *cwd*, even the ones outside of it, and symbolic
+    links and submodules are skipped.'''
+    # Git lists the paths relative to the top level: --relative would drop
+    # the ones outside of the current directory
+    top = git('rev-parse', '--show-toplevel', cwd=cwd).rstrip('\n')
+    here = os.path.realpath(cwd or os.curdir)
+    out = git(*['--literal-pathspecs', 'diff', '--cached', '--raw', '-z',
+                '--no-renames', '--no-abbrev', '--diff-filter=ACMT',
+                '--'] + list(paths), cwd=cwd)
+    staged = []
+    tokens = iter(out.split('\0'))
+    for token in tokens:
+        if not token.startswith(':'):
+            continue
+        # ":old_mode new_mode old_blob new_blob status", then the path
+        _, mode, _, blob, _ = token.split(' ')
+        path = next(tokens)
+        if mode.startswith('100'):
+            path = os.path.relpath(os.path.join(top, path), here)
+            staged.append((os.path.normpath(path), blob))
+    return staged
+
+
+def iter_history(rev_range, cwd=None):
+    '''Yield ``(sha, parent, timestamp, subject, changes)`` for every
+    commit of *rev_range* along the first-parent history, oldest first.
+    *parent* is the hash of the first parent, or ``None``, while *changes*
+    lists the ``(path, blob)`` pairs of the files added, modified or deleted
+    with respect to it (*blob* is ``None`` for deletions). Only the files
+    below *cwd* are considered, and their paths are relative to it.'''
+    out = git('log', '--reverse', '--first-parent', '-m', '--raw',
+              '--no-renames', '--no-abbrev', '--relative', '-z',
+              '--format=%H%x09%P%x09%ct%x09%s', rev_range, '--', cwd=cwd)
+    tokens = iter(out.split('\0'))
+    commit = None
+    for token in tokens:
+        token = token.lstrip('\n')
+        if not token:
+            continue
+        if token.startswith(':'):
+            # ":old_mode new_mode old_blob new_blob status", then the path
+            _, mode, _, blob, status = token.split(' ')
+            path = next(tokens)
+            if not mode.startswith('160'):
+                # Submodules are not blobs
+                commit[4].append((path, None if status == 'D' else blob))
+            continue
+        if commit is not None:
+            yield commit
+        sha, parents, timestamp, subject = token.split('\t', 3)
+        commit = (sha, parents.split(' ')[0] or None, int(timestamp),
+                  subject, [])
+    if commit is not None:
+        yield commit
+
+
+def iter_numstat(rev='HEAD', paths=(), since=None, cwd=None,
+                 chunk_size=65536):
+    '''Yield ``(path, added, deleted)`` for every file changed by every
+    commit reachable from *rev* (merges excluded), newest first, optionally
+    only for the commits more recent than *since* and the files below
+    *paths*. The counts of lines are ``None`` for binary files. Paths are
+    relative to *cwd*.
+
+    The output of ``git log --numstat`` is parsed as it is produced, a chunk
+    at a time, so the memory used does not depend on the length of the
+    history.'''
+    cmd = ['git', '--literal-pathspecs', 'log', '--numstat', '--format=',
+           '-z', '--no-renames', '--relative']
+    if since:
+        cmd.append('--since=%s' % since)
+    p = subprocess.Popen(cmd + [rev, '--'] + list(paths),
+                         stdout=subprocess.PIPE, cwd=cwd)
+    finished = False
+    try:
+        rest = b''
+        while True:
+            chunk = p.stdout.read(chunk_size)
+            if not chunk:
+                break
+            records = (rest + chunk).split(b'\0')
+            rest = records.pop()
+            for record in records:
+                change = _parse_numstat(record)
+                if change is not None:
+                    yield change
+        change = _parse_numstat(rest)
+        if change is not None:
+            yield change
+        finished = True
+    finally:
+        if not finished:
+            # We stopped early
+            p.kill()
+        p.stdout.close()
+        ret = p.wait()
+    if ret:
+        raise subprocess.CalledProcessError(ret, 'git')
+
+
+def _parse_numstat(record):
+    '''Parse a record of ``git log --numstat -z``: ``added<TAB>deleted<TAB>
+    path``, preceded by newlines between commits.'''
+    record = record.lstrip(b'\n')
+    if not record:
+        return None
+    added, deleted, path = record.split(b'\t', 2)
+    return (os.path.normpath(path.decode('utf-8', 'replace')),
+            int(added) if added != b'-' else None,
+            int(deleted) if deleted != b'-' else None)
+
+
+class CatFile(object):
+    '''Read objects straight from the object store of the repository in
+    *cwd*, through a single ``git cat-file --batch`` process. The working
+    tree is never touched.'''
+
+    def __init__(self, cwd=None):
+        self.process = subprocess.Popen(['git', 'cat-file', '--batch'],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, cwd=cwd)
+
+    def read(self, sha):
+        '''Return the content of the object *sha*, as bytes. A
+        :exc:`KeyError` is raised if it does not exist.'''
+        self.process.stdin.write(sha.encode('ascii') + b'\n')
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().split()
+        if len(header) != 3:
+            # "<sha> missing" or "<sha> ambiguous"
+            raise KeyError(sha)
+        data = self.process.stdout.read(int(header[2]))
+        # Every object is followed by a newline
+        self.process.stdout.read(1)
+        return data
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 def gitrepo(root):
-    '''Construct a dictionary holding all the Git data that can be found.'''
-    oldwd = os.getcwd()
-    os.chdir(root)
-    gitlog = git('--no-pager', 'log', '-1',
-                 '--pretty="format:%s"' % FORMAT).split('\n', 7)
-    branch = (os.environ.get('CIRCLE_BRANCH') or
-              os.environ.get('TRAVIS_BRANCH',
-                             git('rev-parse',
-                                 '--abbrev-ref', 'HEAD').strip()))
-    remotes = [x.split() for x in git('remote', '-v').strip().splitlines()
-               if x.endswith('(fetch)')]
-    os.chdir(oldwd)
+    '''Construct a dictionary holding all the Git data that can be found.
+
+    The data is read straight from the ``.git`` directory whenever possible,
+    and at most one ``git`` process is started otherwise. Commits are
+    memoized per repository, so calling this function many times (e.g. from
+    a process analyzing several repositories) is cheap. The current working
+    directory is never changed.
+    '''
+    repo = Repository.open(root)
+    try:
+        sha, branch = repo.head()
+        head = repo.commit(sha)
+        remotes = repo.remotes()
+    except (IOError, OSError, ValueError):
+        # Formats we do not read (e.g. reftable): ask Git
+        sha, branch, remotes = None, None, None
+        head = read_head(repo.worktree)
+    if branch is None:
+        branch = git('rev-parse', '--abbrev-ref', 'HEAD',
+                     cwd=repo.worktree).strip()
+    if remotes is None:
+        remotes = [tuple(x.split()[:2]) for x in
+                   git('remote', '-v', cwd=repo.worktree).splitlines()
+                   if x.endswith('(fetch)')]
+    return {
+        "head": head,
+        "branch": (os.environ.get('CIRCLE_BRANCH') or
+                   os.environ.get('TRAVIS_BRANCH', branch)),
+        "remotes": [{'name': name, 'url': url} for name, url in remotes]
+    }
+
+
+def read_head(cwd, rev='HEAD'):
+    '''Return the ``head`` section of the data for the commit *rev*, asking
+    Git for it.'''
+    gitlog = git('--no-pager', 'log', '-1', '--pretty=format:%s' % FORMAT,
+                 rev, cwd=cwd).split('\n', 7)
     return {
-        "head": {
-            "id": gitlog[0],
-            "author_name": gitlog[1],
-            "author_email": gitlog[2],
-            "author_timestamp": gitlog[3],
-            "committer_name": gitlog[4],
-            "committer_email": gitlog[5],
-            "committer_timestamp": gitlog[6],
-            "message": gitlog[7].strip(),
-        },
-        "branch": branch,
-        "remotes": [{'name': r[0], 'url': r[1]} for r in remotes]
+        "id": gitlog[0],
+        "author_name": gitlog[1],
+        "author_email": gitlog[2],
+        "author_timestamp": gitlog[3],
+        "committer_name": gitlog[4],
+        "committer_email": gitlog[5],
+        "committer_timestamp": gitlog[6],
+        "message": gitlog[7].strip(),
     }
+
+
+class Repository(object):
+    '''A Git repository, read without starting any process.
+
+    *worktree* is the top-level directory of the checkout, *git_dir* its
+    ``.git`` directory and *common_dir* the directory holding the refs, the
+    objects and the configuration, which differs from *git_dir* in linked
+    worktrees. Use :meth:`open` to find the repository containing a path:
+    repositories are memoized per root, along with the commits they read.
+    '''
+
+    _repositories = {}
+
+    def __init__(self, worktree, git_dir, common_dir=None):
+        self.worktree = worktree
+        self.git_dir = git_dir
+        self.common_dir = common_dir or git_dir
+        self._commits = {}
+
+    @classmethod
+    def open(cls, path):
+        '''Return the repository containing *path*. If no ``.git``
+        directory is found, *path* itself is used as the worktree: every
+        read then fails, and the data is asked to Git.'''
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            path = os.path.dirname(path)
+        top = path
+        while True:
+            repo = cls._repositories.get(top)
+            if repo is not None:
+                return repo
+            dotgit = os.path.join(top, '.git')
+            if os.path.exists(dotgit):
+                repo = cls(top, *_git_dirs(dotgit))
+                break
+            parent = os.path.dirname(top)
+            if parent == top:
+                return cls(path, os.path.join(path, '.git'))
+            top = parent
+        cls._repositories[top] = repo
+        return repo
+
+    def head(self):
+        '''Return the hash of the commit checked out and the name of the
+        current branch, which is ``HEAD`` when detached.'''
+        head = _read(os.path.join(self.git_dir, 'HEAD')).strip()
+        if not head.startswith('ref: '):
+            return head, 'HEAD'
+        ref = head[5:]
+        name = ref[11:] if ref.startswith('refs/heads/') else ref
+        return self.resolve(ref), name
+
+    def resolve(self, ref):
+        '''Return the hash *ref* points to, looking first for a loose ref
+        and then in ``packed-refs``.'''
+        for base in (self.git_dir, self.common_dir):
+            try:
+                value = _read(os.path.join(base, ref)).strip()
+            except (IOError, OSError):
+                continue
+            if value.startswith('ref: '):
+                return self.resolve(value[5:])
+            return value
+        for line in _read(os.path.join(self.common_dir,
+                                       'packed-refs')).splitlines():
+            if line[:1] in ('#', '^'):
+                continue
+            sha, name = line.split(' ', 1)
+            if name == ref:
+                return sha
+        raise ValueError('unknown ref %s' % ref)
+
+    def commit(self, sha):
+        '''Return the ``head`` section of the data for the commit *sha*.
+        Loose objects are decoded directly, while a single ``git log``
+        process is needed for packed ones.'''
+        head = self._commits.get(sha)
+        if head is None:
+            head = self._read_commit(sha)
+            if head is None:
+                head = read_head(self.worktree, sha)
+            self._commits[sha] = head
+        return head
+
+    def _read_commit(self, sha):
+        import zlib
+
+        if os.path.exists(os.path.join(self.worktree, '.mailmap')):
+            # Only Git knows how to apply it
+            return None
+        path = os.path.join(self.common_dir, 'objects', sha[:2], sha[2:])
+        try:
+            with open(path, 'rb') as fobj:
+                data = zlib.decompress(fobj.read())
+        except (IOError, OSError, zlib.error):
+            return None
+        header, _, body = data.partition(b'\0')
+        if not header.startswith(b'commit '):
+            return None
+        try:
+            text = body.decode(commit_encoding(body), 'replace')
+        except LookupError:
+            # Git knows encodings Python does not
+            return None
+        return parse_commit(sha, text)
+
+    def remotes(self):
+        '''Return the list of ``(name, url)`` pairs of the remotes defined
+        in the repository configuration.'''
+        remotes = []
+        section = None
+        for line in _read(os.path.join(self.common_dir,
+                                       'config')).splitlines():
+            line = line.strip()
+            if line.startswith('['):
+                section = line.strip('[]').strip()
+                continue
+            if not section or not section.startswith('remote "'):
+                continue
+            key, _, value = line.partition('=')
+            if key.strip().lower() == 'url':
+                remotes.append((section[8:-1], _unquote(value.strip())))
+        return remotes
+
+
+def commit_encoding(body):
+    '''Return the encoding of the raw commit *body*, as recorded by its
+    ``encoding`` header, UTF-8 by default.'''
+    for line in body.partition(b'\n\n')[0].splitlines():
+        if line.startswith(b'encoding '):
+            return line[9:].strip().decode('ascii', 'replace')
+    return 'utf-8'
+
+
+def parse_commit(sha, text):
+    '''Build the ``head`` section of the data from the raw *text* of the
+    commit *sha*, as ``git cat-file commit`` prints it.'''
+    headers, _, message = text.partition('\n\n')
+    people = {}
+    for line in headers.splitlines():
+        key, _, value = line.partition(' ')
+        if key in ('author', 'committer'):
+            name, _, rest = value.partition(' <')
+            email, _, date = rest.partition('> ')
+            people[key] = (name, email, date.split()[0])
+    subject = ' '.join(line.strip() for line in
+                       message.split('\n\n', 1)[0].splitlines())
+    return {
+        "id": sha,
+        "author_name": people['author'][0],
+        "author_email": people['author'][1],
+        "author_timestamp": people['author'][2],
+        "committer_name": people['committer'][0],
+        "committer_email": people['committer'][1],
+        "committer_timestamp": people['committer'][2],
+        "message": subject.strip(),
+    }
+
+
+def _git_dirs(dotgit):
+    '''Return the Git directory and the common directory pointed to by
+    *dotgit*, which is a file in linked worktrees and submodules.'''
+    git_dir = dotgit
+    if os.path.isfile(dotgit):
+        target = _read(dotgit).strip()
+        if target.startswith('gitdir: '):
+            git_dir = os.path.join(os.path.dirname(dotgit), target[8:])
+    common_dir = git_dir
+    try:
+        common_dir = os.path.join(git_dir,
+                                  _read(os.path.join(git_dir,
+                                                     'commondir')).strip())
+    except (IOError, OSError):
+        pass
+    return os.path.normpath(git_dir), os.path.normpath(common_dir)
+
+
+def _read(path):
+    with open(path) as fobj:
+        return fobj.read()
+
+
+def _unquote(value):
+    if len(value) > 1 and value[0] == value[-1] == '"':
+        return value[1:-1]
+    return value
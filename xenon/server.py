@@ -0,0 +1,330 @@
+'''This module implements ``xenon serve``, a long-running process which keeps
+the results of the analysis in memory and answers threshold queries over a
+Unix socket.
+
+The server watches the analyzed tree and only analyzes again the files that
+changed. Queries are checked with :func:`~xenon.core.find_infractions`, on the
+same results a cold run would produce, so the answer is always the same.
+
+The protocol is line-based: the client sends a single JSON object with the
+thresholds and the paths to check, and the server replies with a JSON object
+holding the number of infractions and the messages to log.
+'''
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import logging
+import threading
+
+from xenon.core import Config, harvest_file, find_infractions
+from xenon.discovery import split_patterns, is_python_file
+from xenon.policy import PolicyIndex
+from xenon.watch import make_watcher, PollingWatcher
+
+try:
+    import socketserver
+except ImportError:  # pragma: no cover
+    import SocketServer as socketserver
+
+DEFAULT_SOCKET = '.xenon.sock'
+
+
+class Workspace(object):
+    '''The results of the analysis of *paths*, kept up to date.
+
+    *config* is a :class:`~xenon.core.Config` object. Every file is analyzed
+    again only when its size or modification time changes.
+    '''
+
+    def __init__(self, paths, config, cache=None, watcher=None):
+        self.paths = paths
+        self.config = config
+        self.cache = cache
+        self.files = {}
+        self.order = []
+        self.analyzed = 0
+        ignore = split_patterns(config.exclude, config.ignore)[1]
+        self.watcher = watcher or make_watcher(
+            paths, lambda path: _matches(os.path.basename(path), ignore))
+        self.rescan()
+
+    def rescan(self):
+        '''Discover the files again and analyze the ones that changed.'''
+        order = list(self.config.discovery().iter(self.paths))
+        for name in set(self.files) - set(order):
+            del self.files[name]
+        for name in order:
+            self._refresh(name)
+        self.order = order
+
+    def sync(self):
+        '''Process the changes reported by the watcher. A full rescan is
+        performed when a file appeared or disappeared, or when the watcher
+        cannot tell what changed.'''
+        changed = self.watcher.changes()
+        if changed is None:
+            return self.rescan()
+        relevant = [p for p in changed
+                    if p in self.files or is_python_file(p) or
+                    os.path.isdir(p)]
+        if any(p not in self.files or not os.path.isfile(p)
+               for p in relevant):
+            return self.rescan()
+        for name in relevant:
+            self._refresh(name)
+
+    def _refresh(self, name):
+        try:
+            st = os.stat(name)
+        except OSError:
+            self.files.pop(name, None)
+            return
+        signature = (st.st_mtime, st.st_size)
+        current = self.files.get(name)
+        if current is not None and current[0] == signature:
+            return
+        blocks = harvest_file(name, self.config.no_assert,
+                              self.config.show_closures, self.cache)
+        self.files[name] = (signature, blocks)
+        self.analyzed += 1
+
+    def results(self, paths=None, names=None):
+        '''Return the results dictionary of the files below *paths*, which
+        must be absolute. All the files are included if *paths* is empty.
+
+        :exc:`ValueError` is raised if a path is not below the ones of the
+        workspace. When *names* holds the paths as the client gave them, the
+        modules are named as a run of the client would name them.'''
+        if not paths:
+            return dict((name, self.files[name][1]) for name in self.order
+                        if self.files.get(name, (None, None))[1])
+        roots = [os.path.abspath(p) for p in self.paths]
+        prefixes = [os.path.normpath(p) for p in paths]
+        for prefix in prefixes:
+            if not _is_below(prefix, roots):
+                raise ValueError('%s is not below the paths of the server'
+                                 % prefix)
+        absolute = [(name, os.path.abspath(name)) for name in self.order]
+        results = {}
+        for i, prefix in enumerate(prefixes):
+            for name, path in absolute:
+                blocks = self.files.get(name, (None, None))[1]
+                if not blocks or not _is_below(path, [prefix]):
+                    continue
+                if names:
+                    name = _client_name(names[i], prefix, path)
+                results[name] = blocks
+        return results
+
+    def check_config(self, request):
+        '''Raise :exc:`ValueError` if the client of *request* analyzes the
+        files differently than this workspace.'''
+        for option in ('exclude', 'ignore', 'no_assert'):
+            if option not in request:
+                continue
+            if (request[option] or None) != \
+                    (getattr(self.config, option) or None):
+                raise ValueError('the server was started with a different '
+                                 '--%s' % option.replace('_', '-'))
+
+    def query(self, request):
+        '''Answer the *request* sent by a client.'''
+        self.check_config(request)
+        self.sync()
+        args = Thresholds(request)
+        logger = MessageCollector()
+        results = self.results(request.get('paths'), request.get('names'))
+        infractions = find_infractions(args, logger, results)
+        return {'infractions': infractions, 'messages': logger.messages}
+
+
+class Thresholds(object):
+    '''The subset of the command line arguments sent with a query. The
+    absolute module paths are matched against the policies relative to the
+    directory of the client.'''
+
+    def __init__(self, request):
+        self.absolute = request.get('absolute')
+        self.modules = request.get('modules')
+        self.average = request.get('average')
+        self.averagenum = request.get('averagenum')
+        self.paths_in_front = request.get('paths_in_front', False)
+        self.policies = None
+        if request.get('policies'):
+            self.policies = PolicyIndex(request['policies'],
+                                        request.get('cwd'))
+
+
+class MessageCollector(object):
+    '''A logger-like object which stores the messages it receives.'''
+
+    def __init__(self):
+        self.messages = []
+
+    def _log(self, level, msg, *args):
+        self.messages.append((level, msg % args))
+
+    def error(self, msg, *args):
+        self._log(logging.ERROR, msg, *args)
+
+    def warning(self, msg, *args):
+        self._log(logging.WARNING, msg, *args)
+
+    def info(self, msg, *args):
+        self._log(logging.INFO, msg, *args)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            if request.get('command') == 'stop':
+                # shutdown() waits for the serving loop, so it cannot be
+                # called from the thread running it
+                threading.Thread(target=self.server.shutdown).start()
+                response = {'stopped': True}
+            else:
+                response = self.server.workspace.query(request)
+        except Exception as e:
+            response = {'error': str(e)}
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class Server(socketserver.UnixStreamServer):
+    '''A Unix socket server answering the queries about *workspace*. When
+    the changes are detected by polling, the files are checked every
+    *poll_interval* seconds.'''
+
+    def __init__(self, address, workspace, poll_interval=2.):
+        socketserver.UnixStreamServer.__init__(self, address, RequestHandler)
+        self.workspace = workspace
+        self.poll_interval = poll_interval
+        self.last_sync = time.time()
+
+    def service_actions(self):
+        '''Analyze the changed files while idle, so that queries are fast.'''
+        now = time.time()
+        if (isinstance(self.workspace.watcher, PollingWatcher) and
+                now - self.last_sync < self.poll_interval):
+            return
+        self.workspace.sync()
+        self.last_sync = now
+
+
+def query(address, request):
+    '''Send *request* to the server listening on *address* and return its
+    response.'''
+    import socket
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        chunks = []
+        while True:
+            chunk = sock.recv(64 * 1024)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def check(args, logger):
+    '''Ask the server at ``args.server`` to check the paths and thresholds in
+    *args*, logging the messages through *logger*. Return the number of
+    infractions.'''
+    policies = getattr(args, 'policies', None)
+    response = query(args.server, {
+        'paths': [os.path.abspath(p) for p in args.path],
+        'names': args.path,
+        'absolute': args.absolute,
+        'modules': args.modules,
+        'average': args.average,
+        'averagenum': args.averagenum,
+        'paths_in_front': args.paths_in_front,
+        'exclude': args.exclude,
+        'ignore': args.ignore,
+        'no_assert': args.no_assert,
+        'policies': args.policies.rules if policies else None,
+        'cwd': os.getcwd(),
+    })
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    for level, message in response['messages']:
+        logger.log(level, '%s', message)
+    return response['infractions']
+
+
+def parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='xenon serve', description='Keep the analysis results in memory '
+        'and answer the queries of `xenon --server`.')
+    parser.add_argument('path', nargs='+', help='Directory containing source '
+                        'files to analyze, or multiple file paths')
+    parser.add_argument('-e', '--exclude', metavar='<str>', dest='exclude',
+                        help='Comma separated list of patterns to exclude')
+    parser.add_argument('-i', '--ignore', metavar='<str>', dest='ignore',
+                        help='Comma separated list of patterns to ignore')
+    parser.add_argument('--no-assert', dest='no_assert', action='store_true',
+                        help='Do not count `assert` statements when computing '
+                        'complexity')
+    parser.add_argument('-s', '--socket', metavar='<path>', dest='socket',
+                        default=DEFAULT_SOCKET, help='Path of the Unix socket '
+                        '(default: %(default)s)')
+    parser.add_argument('--poll', dest='poll', action='store_true',
+                        help='Poll the files instead of using inotify')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    '''Entry point of ``xenon serve``.'''
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger('xenon')
+    config = Config(args.exclude, args.ignore, args.no_assert)
+    watcher = PollingWatcher() if args.poll else None
+    workspace = Workspace(args.path, config, watcher=watcher)
+    logger.info('analyzed %d files, using %s', workspace.analyzed,
+                type(workspace.watcher).__name__)
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    server = Server(args.socket, workspace)
+    logger.info('listening on %s', args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        workspace.watcher.close()
+        os.remove(args.socket)
+    return 0
+
+
+def _matches(name, patterns):
+    return any(fnmatch.fnmatch(name, p) for p in patterns)
+
+
+def _client_name(arg, prefix, path):
+    '''Return the name of the file *path* found by a client walking *arg*,
+    whose absolute path is *prefix*, like :mod:`xenon.discovery` does.'''
+    if path == prefix:
+        return arg
+    return os.path.normpath(os.path.join(arg, os.path.relpath(path, prefix)))
+
+
+def _is_below(path, prefixes):
+    return any(path == p or path.startswith(p.rstrip(os.sep) + os.sep)
+               for p in prefixes)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
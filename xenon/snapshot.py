@@ -0,0 +1,322 @@
+'''This module implements the binary snapshots of the results, and
+``xenon diff``, which compares two of them.
+
+A snapshot is much smaller than the equivalent JSON and it does not need to
+be parsed: every column is a typed array which is read in place from a
+memory-mapped file, and strings are only decoded when they are used. The
+layout, in little-endian byte order, is:
+
+* the header (see :data:`HEADER`): magic, version and the number of strings,
+  modules and blocks;
+* the string table: the end offsets of the strings (``uint32``), followed by
+  their UTF-8 bytes. Module paths, block names and class names are interned,
+  so each one is stored once;
+* the module columns (``uint32``): path and error message indices, and the
+  index of the first block of every module (plus one final entry);
+* the block columns: name, class name, line number, end line, complexity and
+  column offset (``uint32``), type and rank (``uint8``).
+
+Missing strings (e.g. the class name of a function) and column offsets are
+stored as :data:`NONE`. Every section starts at a multiple of four bytes.
+The closures of the functions are not stored.
+'''
+
+import sys
+import struct
+from array import array
+
+from radon.complexity import cc_rank
+
+from xenon.blocks import Block
+from xenon.cache import write_atomically
+
+MAGIC = b'XENSNAP\0'
+VERSION = 2
+#: Magic, version, number of strings, of string bytes, of modules, of blocks.
+HEADER = struct.Struct('<8sIIIII')
+NONE = 0xffffffff
+TYPES = ('function', 'method', 'class')
+RANKS = 'ABCDEF'
+
+
+class SnapshotError(ValueError):
+    '''Raised when a file is not a valid snapshot.'''
+
+
+class StringTable(object):
+    '''Intern the strings written to a snapshot.'''
+
+    def __init__(self):
+        self.index = {}
+        self.data = []
+        self.ends = array('I')
+        self.size = 0
+
+    def add(self, value):
+        if value is None:
+            return NONE
+        idx = self.index.get(value)
+        if idx is None:
+            data = value.encode('utf-8')
+            self.size += len(data)
+            idx = self.index[value] = len(self.ends)
+            self.data.append(data)
+            self.ends.append(self.size)
+        return idx
+
+
+def write(fobj, results):
+    '''Write the *results* dictionary, mapping module paths to lists of
+    blocks (or to ``{'error': message}``), to the binary file *fobj*.'''
+    strings = StringTable()
+    paths, errors, starts = array('I'), array('I'), array('I')
+    columns = [array('I') for _ in range(6)] + [array('B'), array('B')]
+    (names, classnames, linenos, endlines, complexities, col_offsets, types,
+     ranks) = columns
+    for module, blocks in results.items():
+        paths.append(strings.add(module))
+        starts.append(len(names))
+        if isinstance(blocks, dict):
+            errors.append(strings.add(blocks.get('error', '')))
+            continue
+        errors.append(NONE)
+        for block in blocks:
+            names.append(strings.add(block['name']))
+            classnames.append(strings.add(_get(block, 'classname')))
+            linenos.append(block['lineno'])
+            endlines.append(block['endline'] or 0)
+            complexities.append(block['complexity'])
+            col_offset = _get(block, 'col_offset')
+            col_offsets.append(NONE if col_offset is None else col_offset)
+            types.append(TYPES.index(block['type']))
+            ranks.append(RANKS.index(cc_rank(block['complexity'])))
+    starts.append(len(names))
+    fobj.write(HEADER.pack(MAGIC, VERSION, len(strings.ends), strings.size,
+                           len(paths), len(names)))
+    _write_array(fobj, strings.ends)
+    fobj.write(b''.join(strings.data))
+    fobj.write(b'\0' * _padding(strings.size))
+    for column in [paths, errors, starts] + columns:
+        _write_array(fobj, column)
+        fobj.write(b'\0' * _padding(len(column) * column.itemsize))
+
+
+def save(path, results):
+    '''Write the snapshot of *results* to *path*, atomically.'''
+    write_atomically(path, lambda fobj: write(fobj, results))
+
+
+class Snapshot(object):
+    '''A snapshot read from *data*, any object supporting the buffer
+    protocol. The columns are views on *data*: nothing is copied.'''
+
+    def __init__(self, data):
+        self._data = data
+        self._views = []
+        view = self._view(memoryview(data))
+        if len(view) < HEADER.size:
+            raise SnapshotError('truncated snapshot')
+        magic, version, n_strings, n_bytes, n_modules, n_blocks = \
+            HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError('not a snapshot, or unsupported version')
+        self.n_modules = n_modules
+        self.n_blocks = n_blocks
+        offset = HEADER.size
+        self._ends, offset = self._column(view, offset, 'I', n_strings)
+        self._strings = self._view(view[offset:offset + n_bytes])
+        offset += n_bytes + _padding(n_bytes)
+        self._paths, offset = self._column(view, offset, 'I', n_modules)
+        self._errors, offset = self._column(view, offset, 'I', n_modules)
+        self._starts, offset = self._column(view, offset, 'I',
+                                            n_modules + 1)
+        self._names, offset = self._column(view, offset, 'I', n_blocks)
+        self._classnames, offset = self._column(view, offset, 'I', n_blocks)
+        self._linenos, offset = self._column(view, offset, 'I', n_blocks)
+        self._endlines, offset = self._column(view, offset, 'I', n_blocks)
+        self.complexities, offset = self._column(view, offset, 'I', n_blocks)
+        self._col_offsets, offset = self._column(view, offset, 'I',
+                                                 n_blocks)
+        self._types, offset = self._column(view, offset, 'B', n_blocks)
+        self.ranks, offset = self._column(view, offset, 'B', n_blocks)
+
+    @classmethod
+    def open(cls, path):
+        '''Memory-map the snapshot at *path*.'''
+        import mmap
+
+        with open(path, 'rb') as fobj:
+            try:
+                data = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                data = fobj.read()
+        return cls(data)
+
+    def _view(self, view):
+        self._views.append(view)
+        return view
+
+    def _column(self, view, offset, typecode, length):
+        column, offset = _column(view, offset, typecode, length)
+        if isinstance(column, memoryview):
+            self._views.append(column)
+        return column, offset
+
+    def close(self):
+        # A memory map cannot be closed while views on it exist
+        for view in reversed(self._views):
+            view.release()
+        if hasattr(self._data, 'close'):
+            self._data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def raw_string(self, idx):
+        '''Return the UTF-8 bytes of the string *idx* as a view.'''
+        if idx == NONE:
+            return None
+        start = self._ends[idx - 1] if idx else 0
+        return self._strings[start:self._ends[idx]]
+
+    def string(self, idx):
+        '''Return the string *idx*, decoded.'''
+        raw = self.raw_string(idx)
+        return None if raw is None else bytes(raw).decode('utf-8')
+
+    def module(self, i):
+        '''Return the path of the *i*-th module.'''
+        return self.string(self._paths[i])
+
+    def block_range(self, i):
+        '''Return the range of the indices of the blocks of the *i*-th
+        module.'''
+        return range(self._starts[i], self._starts[i + 1])
+
+    def block(self, j):
+        '''Return the *j*-th block as a :class:`~xenon.blocks.Block`.'''
+        col_offset = self._col_offsets[j]
+        return Block(self.string(self._names[j]), TYPES[self._types[j]],
+                     self.string(self._classnames[j]), self._linenos[j],
+                     self._endlines[j] or None, self.complexities[j],
+                     None if col_offset == NONE else col_offset)
+
+    def block_key(self, j):
+        '''Return the raw ``(class name, name)`` bytes identifying the
+        *j*-th block within its module.'''
+        classname = self.raw_string(self._classnames[j])
+        return (bytes(classname) if classname is not None else None,
+                bytes(self.raw_string(self._names[j])))
+
+    def results(self):
+        '''Decode the whole snapshot into a results dictionary, as returned
+        by :func:`~xenon.core.harvest`.'''
+        results = {}
+        for i in range(self.n_modules):
+            error = self._errors[i]
+            if error != NONE:
+                results[self.module(i)] = {'error': self.string(error)}
+            else:
+                results[self.module(i)] = [self.block(j)
+                                           for j in self.block_range(i)]
+        return results
+
+
+def diff(old, new):
+    '''Yield ``(module, block, old_rank, new_rank)`` for every block of the
+    *new* snapshot whose rank is worse than in the *old* one. Blocks are
+    matched by module, class name and name; blocks sharing all three are
+    matched in order. The time taken is linear in the size of the
+    snapshots.'''
+    index = {}
+    for i in range(old.n_modules):
+        path = bytes(old.raw_string(old._paths[i]))
+        for j in old.block_range(i):
+            key = (path,) + old.block_key(j)
+            index.setdefault(key, []).append(old.ranks[j])
+    for key in index:
+        index[key].reverse()
+    for i in range(new.n_modules):
+        path = bytes(new.raw_string(new._paths[i]))
+        for j in new.block_range(i):
+            ranks = index.get((path,) + new.block_key(j))
+            if not ranks:
+                continue
+            old_rank = ranks.pop()
+            if new.ranks[j] > old_rank:
+                yield (new.module(i), new.block(j), RANKS[old_rank],
+                       RANKS[new.ranks[j]])
+
+
+def parse_args(argv):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog='xenon diff', description='Report the blocks whose rank got '
+        'worse between two snapshots, written with `--output-format '
+        'snapshot`.')
+    parser.add_argument('old', help='Path of the old snapshot')
+    parser.add_argument('new', help='Path of the new snapshot')
+    return parser.parse_args(argv)
+
+
+def main(argv, logger=None):
+    '''Entry point of ``xenon diff``. The exit code is 1 if any block got
+    worse. The messages go to *logger*; without one, logging is configured
+    and the ``xenon`` logger is used.'''
+    args = parse_args(argv)
+    if logger is None:
+        import logging
+
+        logging.basicConfig(level=logging.INFO)
+        logger = logging.getLogger('xenon')
+    try:
+        old, new = Snapshot.open(args.old), Snapshot.open(args.new)
+    except (IOError, OSError, SnapshotError) as e:
+        logger.error('%s', e)
+        return 2
+    worse = 0
+    with old, new:
+        for module, block, old_rank, new_rank in diff(old, new):
+            logger.error('block "%s:%s %s" got worse: %s -> %s', module,
+                         block.lineno, block.name, old_rank, new_rank)
+            worse += 1
+    return 1 if worse else 0
+
+
+def _get(block, key):
+    '''Return the *key* field of *block*, or ``None`` if it has none.'''
+    try:
+        return block[key]
+    except KeyError:
+        return None
+
+
+def _write_array(fobj, column):
+    if sys.byteorder != 'little':  # pragma: no cover
+        column = array(column.typecode, column)
+        column.byteswap()
+    fobj.write(column.tobytes())
+
+
+def _column(view, offset, typecode, length):
+    '''Return the column of *length* items of type *typecode* found at
+    *offset* in *view*, and the offset of the next section.'''
+    size = struct.calcsize(typecode) * length
+    if offset + size > len(view):
+        raise SnapshotError('truncated snapshot')
+    column = view[offset:offset + size]
+    if sys.byteorder == 'little':
+        column = column.cast(typecode)
+    else:  # pragma: no cover
+        column = array(typecode, bytes(column))
+        column.byteswap()
+    return column, offset + size + _padding(size)
+
+
+def _padding(size):
+    return -size % 4
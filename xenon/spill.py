@@ -0,0 +1,97 @@
+'''This module keeps the results of the analysis within a memory budget.
+
+The threshold checks only need running totals, but uploads, snapshots and
+baselines need the blocks of every module, and on very large trees they do
+not fit in small CI containers. :class:`SpilledResults` collects them like
+a dictionary until their estimated size exceeds the budget, then appends them
+to a temporary file, one JSON line per module, and frees the memory. The
+results are read back a module at a time when they are used.
+'''
+
+import json
+import tempfile
+
+from xenon.blocks import encode, decode
+
+#: Rough number of bytes a block takes in memory, strings included.
+BLOCK_BYTES = 200
+#: Rough number of bytes a module takes in memory, besides its blocks.
+MODULE_BYTES = 200
+
+
+class SpilledResults(object):
+    '''Results of the analysis, mapping module paths to lists of blocks (or
+    to ``{'error': message}``), holding at most about *max_memory* bytes in
+    memory. Only the methods needed to consume the results are provided:
+    modules can be added, counted and iterated over, in the order they were
+    added.'''
+
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self.memory = {}
+        self.size = 0
+        #: The number of modules written to the temporary file.
+        self.spilled = 0
+        self._file = None
+
+    def __setitem__(self, module, blocks):
+        self.memory[module] = blocks
+        self.size += MODULE_BYTES
+        if not isinstance(blocks, dict):
+            self.size += BLOCK_BYTES * len(blocks)
+        if self.size > self.max_memory:
+            self.spill()
+
+    def spill(self):
+        '''Move the results held in memory to the temporary file.'''
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+        self._file.seek(0, 2)
+        for module, blocks in self.memory.items():
+            line = json.dumps([module, encode(blocks)],
+                              separators=(',', ':'))
+            self._file.write(line.encode('utf-8') + b'\n')
+        self.spilled += len(self.memory)
+        self.memory = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.spilled + len(self.memory)
+
+    def __iter__(self):
+        for module, _ in self.items():
+            yield module
+
+    def items(self):
+        '''Yield ``(module, blocks)`` for every module.'''
+        if self._file is not None:
+            self._file.flush()
+            # Keep track of the offset, so that several iterations can run
+            # at the same time
+            offset = 0
+            for _ in range(self.spilled):
+                self._file.seek(offset)
+                line = self._file.readline()
+                offset += len(line)
+                module, blocks = json.loads(line.decode('utf-8'))
+                yield module, decode(blocks)
+        for item in list(self.memory.items()):
+            yield item
+
+    def values(self):
+        for _, blocks in self.items():
+            yield blocks
+
+    def close(self):
+        '''Delete the temporary file.'''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.memory = {}
+        self.spilled = self.size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,129 @@
+'''This module contains the objects used to measure where Xenon spends its
+time.
+
+A :class:`Timings` object can be passed to :func:`~xenon.core.analyze`: it
+records the wall and CPU time of every stage of the analysis, as well as the
+time spent on every single file. Subclasses can override
+:meth:`Timings.record_stage` and :meth:`Timings.record_file` to forward the
+measurements elsewhere, e.g. to a metrics service.
+'''
+
+import time
+import heapq
+from contextlib import contextmanager
+
+wall_clock = getattr(time, 'perf_counter', time.time)
+cpu_clock = getattr(time, 'process_time', None) or time.clock
+
+
+class Timings(object):
+    '''Collect the time spent in every stage and on every file.'''
+
+    def __init__(self):
+        self.stages = {}
+        self.order = []
+        self.files = []
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        '''A context manager measuring the time spent in its body, which is
+        added to the stage called *name*.'''
+        wall, cpu = wall_clock(), cpu_clock()
+        try:
+            yield
+        finally:
+            self.record_stage(name, wall_clock() - wall, cpu_clock() - cpu)
+
+    def timed(self, name, iterable):
+        '''Iterate over *iterable*, adding the time spent producing every
+        item to the stage called *name*.'''
+        it = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+            yield item
+
+    def record_stage(self, name, wall, cpu):
+        '''Add *wall* and *cpu* seconds to the stage called *name*.'''
+        if name not in self.stages:
+            self.order.append(name)
+            self.stages[name] = [0., 0.]
+        self.stages[name][0] += wall
+        self.stages[name][1] += cpu
+
+    def record_file(self, name, wall, cpu):
+        '''Record that analyzing the file *name* took *wall* and *cpu*
+        seconds. The time is also added to the ``analysis`` stage.'''
+        self.files.append((wall, cpu, name))
+        self.record_stage('analysis', wall, cpu)
+
+    def record_count(self, name, value):
+        '''Add *value* to the counter called *name*, e.g. the number of files
+        skipped by the discovery.'''
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def slowest(self, n=10):
+        '''Return the *n* files which took the longest to analyze, as a list
+        of ``(wall, cpu, filename)`` tuples.'''
+        return heapq.nlargest(n, self.files)
+
+    def as_dict(self, n=10):
+        '''Return the measurements as a dictionary, including the *n* slowest
+        files.'''
+        return {
+            'stages': dict((name, {'wall': wall, 'cpu': cpu})
+                           for name, (wall, cpu) in self.stages.items()),
+            'files': len(self.files),
+            'counters': dict(self.counters),
+            'slowest': [{'path': name, 'wall': wall, 'cpu': cpu}
+                        for wall, cpu, name in self.slowest(n)],
+        }
+
+    def log(self, logger, n=10):
+        '''Log the time spent in every stage and the *n* slowest files.'''
+        for name in self.order:
+            wall, cpu = self.stages[name]
+            logger.info('time: %-10s wall %.3fs, cpu %.3fs', name, wall, cpu)
+        for name in sorted(self.counters):
+            logger.info('count: %s %d', name, self.counters[name])
+        for wall, cpu, name in self.slowest(n):
+            logger.info('slow file: %s wall %.3fs, cpu %.3fs', name, wall,
+                        cpu)
+
+
+class NullTimings(Timings):
+    '''A :class:`Timings` object which discards every measurement.'''
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def timed(self, name, iterable):
+        return iterable
+
+    def record_stage(self, name, wall, cpu):
+        pass
+
+    def record_file(self, name, wall, cpu):
+        pass
+
+    def record_count(self, name, value):
+        pass
+
+
+def peak_rss():
+    '''Return the peak resident set size of the process in bytes, or
+    ``None`` where it cannot be measured.'''
+    import sys
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
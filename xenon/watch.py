@@ -0,0 +1,125 @@
+'''This module contains the objects used by the server to be notified of
+file changes.
+
+On Linux, :class:`InotifyWatcher` uses the kernel's inotify interface
+through :mod:`ctypes`. Everywhere else :class:`PollingWatcher` is used: it
+knows nothing about what changed, so the caller has to compare the state of
+every file by itself.
+'''
+
+import os
+import errno
+import struct
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class PollingWatcher(object):
+    '''A watcher which does not know what changed.'''
+
+    def changes(self):
+        '''Return the set of paths that changed since the last call, or
+        ``None`` if every file has to be checked.'''
+        return None
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    '''Watch the directories below *roots* with inotify. *ignore* is a
+    function telling whether a directory must not be watched.'''
+
+    def __init__(self, roots, ignore=lambda path: False):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                 use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.ignore = ignore
+        self.dirs = {}
+        for root in roots:
+            if os.path.isdir(root):
+                self.add_tree(root)
+            else:
+                self.add_dir(os.path.dirname(root) or '.')
+
+    def add_tree(self, root):
+        '''Watch *root* and all the directories below it.'''
+        for dirpath, dirs, _ in os.walk(root):
+            dirs[:] = [d for d in dirs
+                       if not self.ignore(os.path.join(dirpath, d))]
+            self.add_dir(dirpath)
+
+    def add_dir(self, path):
+        wd = self._libc.inotify_add_watch(self.fd,
+                                          os.path.normpath(path).encode(),
+                                          WATCH_MASK)
+        if wd >= 0:
+            self.dirs[wd] = os.path.normpath(path)
+
+    def changes(self):
+        '''Return the set of paths that changed since the last call, or
+        ``None`` if the kernel queue overflowed and events were lost.'''
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return changed
+                raise
+            if self._parse(data, changed):
+                return None
+
+    def _parse(self, data, changed):
+        '''Add the paths found in the events in *data* to *changed*. Return
+        ``True`` if events were lost.'''
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return True
+            directory = self.dirs.get(wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, name.decode()) if name \
+                else directory
+            changed.add(os.path.normpath(path))
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and \
+                    not self.ignore(path):
+                self.add_tree(path)
+        return False
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(roots, ignore=lambda path: False):
+    '''Return an :class:`InotifyWatcher` if inotify is available, or a
+    :class:`PollingWatcher` otherwise.'''
+    try:
+        return InotifyWatcher(roots, ignore)
+    except (OSError, AttributeError, TypeError):
+        return PollingWatcher()